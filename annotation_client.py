@@ -0,0 +1,223 @@
+import http.client
+import json
+import os
+import queue
+import socket
+import threading
+import time
+from urllib.parse import urlsplit
+
+# Seconds to wait before retrying writes after a network error
+RETRY_SECONDS = 2.0
+
+
+class AnnotationClient:
+    """
+    Client of annotation_server.py. Reads and leases are synchronous, point
+    writes are queued and sent in batches by a background thread so the UI
+    never waits on the network. Each thread keeps its own persistent connection.
+    Tools of the same process share one client (shared()), so they see the
+    same versions and don't reject each other's writes.
+    """
+
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, url, annotator=None, timeout=10):
+        parsed = urlsplit(url if "://" in url else "http://" + url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 8765
+        self.timeout = timeout
+        self.annotator = annotator or f"{socket.gethostname()}-{os.getpid()}"
+
+        self.versions = {}  # Last version seen for every key
+        # Entry at that version, to tell whether a rejected merge touches fields someone else changed
+        self.seen = {}
+        self.pending = {}  # Format: {key: (entry, merge)}, newest write per key
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.idle = threading.Event()
+        self.idle.set()
+        self.closed = False
+        # Rejected writes as (key, status, server_entry), to be read from the UI thread
+        self.conflicts = queue.Queue()
+        self.subscribers = []  # More conflict queues, one per tool sharing the client
+        self.users = 1
+
+        self._local = threading.local()
+        self.writer = threading.Thread(target=self._write_loop, daemon=True)
+        self.writer.start()
+
+    @classmethod
+    def shared(cls, url, annotator=None):
+        """The client of this process for url, created on first use. Each call must be matched by a close()."""
+        probe = urlsplit(url if "://" in url else "http://" + url)
+        key = (probe.hostname or "127.0.0.1", probe.port or 8765)
+        with cls._shared_lock:
+            client = cls._shared.get(key)
+            if client is None or client.closed:
+                client = cls(url, annotator)
+                cls._shared[key] = client
+            else:
+                client.users += 1
+            return client
+
+    def subscribe(self):
+        """A new queue receiving every rejected write, for one of several tools sharing the client"""
+        conflicts = queue.Queue()
+        with self.lock:
+            self.subscribers.append(conflicts)
+        return conflicts
+
+    def unsubscribe(self, conflicts):
+        with self.lock:
+            if conflicts in self.subscribers:
+                self.subscribers.remove(conflicts)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            self._local.conn = conn
+        return conn
+
+    def _request(self, method, path, payload=None):
+        body = json.dumps(payload).encode("utf-8") if payload is not None else None
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        for attempt in range(2):
+            conn = self._connection()
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                data = json.loads(response.read() or b"{}")
+                if response.status == 404:
+                    return None
+                if response.status != 200:
+                    raise IOError(data.get("error", f"HTTP {response.status}"))
+                return data
+            except (http.client.HTTPException, ConnectionError, socket.timeout):
+                # The server closed the kept-alive connection, reconnect once
+                conn.close()
+                self._local.conn = None
+                if attempt:
+                    raise
+
+    @staticmethod
+    def _strip_version(entry):
+        return {k: v for k, v in entry.items() if k != "version"}
+
+    def fetch_all(self):
+        entries = self._request("GET", "/entries")["entries"]
+        entries = {key: (entry.get("version", 0), self._strip_version(entry)) for key, entry in entries.items()}
+        with self.lock:
+            for key, (version, entry) in entries.items():
+                self.versions[key] = version
+                self.seen[key] = entry
+        return {key: entry for key, (_, entry) in entries.items()}
+
+    def fetch(self, key):
+        entry = self._request("GET", f"/entries/{key}")
+        with self.lock:
+            self.versions[str(key)] = entry.get("version", 0) if entry else 0
+            self.seen[str(key)] = self._strip_version(entry) if entry else {}
+        return self._strip_version(entry) if entry else None
+
+    def acquire(self, key):
+        """Leases one image, returns False if another annotator holds it"""
+        result = self._request("POST", "/leases", {"annotator": self.annotator, "key": str(key)})
+        return result["key"] is not None
+
+    def acquire_next(self, start, stop, step=1):
+        """Leases the first free index of range(start, stop, step), None if all are taken"""
+        result = self._request("POST", "/leases", {"annotator": self.annotator,
+                                                   "start": start, "stop": stop, "step": step})
+        return int(result["key"]) if result["key"] is not None else None
+
+    def release(self, key):
+        try:
+            self._request("POST", "/leases/release", {"annotator": self.annotator, "key": str(key)})
+        except (IOError, OSError) as e:
+            # An unreleased lease just expires on the server
+            print(f"Warning: could not release lease {key}: {e}")
+
+    def submit(self, key, entry, merge=False):
+        """Queues a write of 'entry' (None deletes) and returns immediately"""
+        key = str(key)
+        with self.lock:
+            previous = self.pending.get(key)
+            if merge and previous and previous[1] and previous[0] is not None:
+                entry = dict(previous[0], **entry)
+            self.pending[key] = (entry, merge)
+            self.idle.clear()
+        self.wakeup.set()
+
+    def _write_loop(self):
+        while not self.closed or self.pending:
+            self.wakeup.wait(timeout=1.0)
+            self.wakeup.clear()
+            with self.lock:
+                batch, self.pending = self.pending, {}
+                writes = [{"key": key, "version": self.versions.get(key, 0),
+                           "entry": entry, "merge": merge}
+                          for key, (entry, merge) in batch.items()]
+            if not writes:
+                self.idle.set()
+                continue
+
+            try:
+                results = self._request("POST", "/entries",
+                                        {"annotator": self.annotator, "writes": writes})["results"]
+            except (IOError, OSError, http.client.HTTPException) as e:
+                print(f"Warning: annotation server unreachable, retrying: {e}")
+                with self.lock:
+                    # Newer writes of the same key win over the failed ones
+                    for key, value in batch.items():
+                        self.pending.setdefault(key, value)
+                time.sleep(RETRY_SECONDS)
+                self.wakeup.set()
+                continue
+
+            retry = False
+            with self.lock:
+                for result in results:
+                    key = result["key"]
+                    self.versions[key] = result["version"]
+                    entry, merge = batch[key]
+                    if result["status"] == "ok":
+                        if merge and entry is not None:
+                            entry = dict(self.seen.get(key) or {}, **entry)
+                        # As the server will return it (tuples become lists)
+                        self.seen[key] = json.loads(json.dumps({k: v for k, v in (entry or {}).items()
+                                                                if v is not None}))
+                        continue
+                    seen = self.seen.get(key) or {}
+                    current = self._strip_version(result.get("entry") or {})
+                    self.seen[key] = current
+                    if result["status"] == "conflict" and merge and entry is not None and key not in self.pending and \
+                            all(seen.get(field) == current.get(field) for field in entry):
+                        # Only fields this write doesn't touch changed, resend on top of the new version
+                        self.pending[key] = (entry, merge)
+                        retry = True
+                    else:
+                        # Someone else changed the same fields (or holds the image): the tool decides
+                        for conflicts in [self.conflicts] + self.subscribers:
+                            conflicts.put((key, result["status"], result.get("entry")))
+                if not self.pending:
+                    self.idle.set()
+            if retry:
+                self.wakeup.set()
+
+    def flush(self, timeout=None):
+        """Blocks until every queued write has been sent"""
+        self.wakeup.set()
+        return self.idle.wait(timeout)
+
+    def close(self, timeout=5.0):
+        """Sends what is pending, the client stops once every user of a shared client closed it"""
+        self.flush(timeout)
+        with self._shared_lock:
+            self.users -= 1
+            if self.users > 0:
+                return
+        self.closed = True
+        self.wakeup.set()
@@ -0,0 +1,323 @@
+import json
+from annotation_render import DEFAULT_ALPHA, compose_overlay
+from dataset_scan import find_next_index, navigable_mask, scan_dataset
+from dataset_sources import open_dataset
+from depth_registration import DEFAULT_OFFSET
+from depth_validity import DEFAULT_MAX_SNAP
+from lens_calibration import convert_points
+
+# GUI-free core of the annotation tools: dataset source, annotation store,
+# offset transform and overlay compositor. Nothing here imports tkinter, so
+# batch jobs, process pool workers and notebooks can use it without a display.
+
+POINTS_FILE = "labeled_points.json"
+# Shift of the depth map over the RGB image in the Image Overlay tool
+DEFAULT_OVERLAY_OFFSET = (-36, 0)
+# Range of the offset controls of both tools
+MAX_OFFSET = 100
+# Trailing path components that identify an image across machines (e.g. rgb/0001.png)
+DEFAULT_PATH_COMPONENTS = 2
+# Fields of a server entry written by the Point Mapping tool (keyframe mode included);
+# the other fields (overlay_points) belong to other tools and are left as they are
+MAPPING_FIELDS = ("rgb_points", "depth_points", "offset", "undistorted", "image_paths",
+                  "interpolated", "keyframes")
+
+
+def load_pairs(folder):
+    """Pairs of a dataset folder (or video/archive) with the header-only integrity scan applied"""
+    dataset_df = open_dataset(folder)
+    if not dataset_df.empty:
+        dataset_df = scan_dataset(dataset_df)
+    return dataset_df
+
+
+def prefetch_paths(dataset_df, index):
+    """Image paths of the neighbours of index, the ones most likely opened next"""
+    return [dataset_df.iloc[i][column] for i in (index + 1, index - 1)
+            if 0 <= i < len(dataset_df) for column in ('rgb', 'depth')]
+
+
+def normalize_path(path, components=DEFAULT_PATH_COMPONENTS):
+    """Machine-independent name of an image: its last path components, '/'-separated"""
+    parts = [p for p in str(path).replace("\\", "/").split("/") if p]
+    return "/".join(parts[-components:])
+
+
+def image_size(row, side):
+    """(width, height) of the 'rgb' or 'depth' image of a scanned dataset row, None if unknown"""
+    width = row.get(f'{side}_width')
+    return (width, row[f'{side}_height']) if width else None
+
+
+class OffsetTransform:
+    """
+    Translation from RGB to depth image coordinates, depth = rgb + offset, as
+    set in the Point Mapping tool. The Image Overlay tool shifts the depth map
+    over the RGB image instead, which is the opposite translation.
+    """
+
+    def __init__(self, dx=DEFAULT_OFFSET[0], dy=DEFAULT_OFFSET[1]):
+        self.dx = dx
+        self.dy = dy
+
+    @classmethod
+    def from_overlay(cls, x_shift, y_shift):
+        return cls(-x_shift, -y_shift)
+
+    @staticmethod
+    def check(value):
+        """Validates an offset typed by the user, raises ValueError"""
+        value = int(value)
+        if not -MAX_OFFSET <= value <= MAX_OFFSET:
+            raise ValueError(f"Offset values must be between -{MAX_OFFSET} and {MAX_OFFSET}")
+        return value
+
+    @property
+    def offset(self):
+        return [int(self.dx), int(self.dy)]
+
+    @property
+    def overlay_shift(self):
+        """Shift of the depth map over the RGB image that lines up corresponding pixels"""
+        return -self.dx, -self.dy
+
+    def to_depth(self, points, validity=None, max_snap=DEFAULT_MAX_SNAP):
+        """
+        Depth image positions of RGB points. With validity (a DepthValidity),
+        points landing on invalid depth are moved to the nearest valid pixel.
+        """
+        points = [(x + self.dx, y + self.dy) for x, y in points]
+        if validity is not None and points:
+            snapped, _ = validity.snap(points, max_snap)
+            points = [(int(x), int(y)) for x, y in snapped]
+        return points
+
+    def to_rgb(self, points):
+        return [(x - self.dx, y - self.dy) for x, y in points]
+
+
+def make_entry(rgb_points, depth_points, transform, undistorted, rgb_path, depth_path):
+    """Stored form of the points of one image pair"""
+    return {
+        'rgb_points': [(x, y) for x, y in rgb_points],
+        'depth_points': [(x, y) for x, y in depth_points],
+        # Offset the depth points were placed with (depth = rgb + offset)
+        'offset': transform.offset,
+        # Whether the points refer to undistorted images
+        'undistorted': bool(undistorted),
+        'image_paths': {'rgb': rgb_path, 'depth': depth_path},
+    }
+
+
+def entry_points(entry, side, calibration=None, size=None):
+    """
+    Stored points of one side ('rgb' or 'depth'), converted to undistorted
+    space when there is a calibration and they were placed on raw images.
+    """
+    points = entry.get(f'{side}_points') or []
+    if points and calibration and not entry.get('undistorted'):
+        points = [(int(round(x)), int(round(y)))
+                  for x, y in convert_points(calibration, side, points, size, to_undistorted=True)]
+    return [tuple(point) for point in points]
+
+
+def render_overlay(rgb, depth, transform, alpha=DEFAULT_ALPHA, scale=1.0):
+    """
+    RGB image with the colour-mapped depth map blended over it, lined up by
+    transform. scale is the size of the images relative to full resolution
+    (previews), the transform is always in full-resolution pixels.
+    """
+    x_shift, y_shift = transform.overlay_shift
+    return compose_overlay(rgb, depth, (x_shift * scale, y_shift * scale), alpha)
+
+
+class AnnotationStore:
+    """
+    Points of a dataset keyed by str(dataset index). Entries are kept in
+    memory and persisted to a JSON file (path), to the shared annotation
+    server once connected, or not at all (path None, session only).
+
+    With server_field, local entries are {'points': [...]} and the server
+    keeps them in that field of its entries, next to the point mapping data.
+    Either way only the fields the store owns are sent, as merges, so the
+    tools sharing a server entry never overwrite each other's fields.
+    """
+
+    def __init__(self, path=None, server_field=None):
+        self.path = path
+        self.server_field = server_field
+        self.client = None
+        self.conflicts = None
+        self.entries = {}
+
+    def __contains__(self, key):
+        return str(key) in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        return self.entries.get(str(key))
+
+    def set(self, key, entry):
+        """Sets (or with None removes) the entry of key, without saving"""
+        if entry is None:
+            self.entries.pop(str(key), None)
+        else:
+            self.entries[str(key)] = entry
+
+    def pop(self, key):
+        return self.entries.pop(str(key), None)
+
+    def reconcile(self, dataset_df, move=True):
+        """
+        Checks the rgb image path of every entry against the dataset row of its
+        key. Entries stored for another image (files indexed in a different
+        order, or keyed by path) are moved to the index of their image, unless
+        move is False or an entry for that image is already there.
+        Returns (moved {old key: new key}, keys of entries whose image is not in the dataset).
+        """
+        indices = {normalize_path(path): str(i) for i, path in enumerate(dataset_df['rgb'])}
+        moved, unmatched = {}, []
+        for key, entry in self.entries.items():
+            rgb_path = (entry.get('image_paths') or {}).get('rgb')
+            if not rgb_path:
+                continue
+            index = indices.get(normalize_path(rgb_path))
+            if index is None:
+                unmatched.append(key)
+            elif index != key:
+                moved[key] = index
+        if not move or not moved:
+            return moved, unmatched
+        entries = {key: entry for key, entry in self.entries.items() if key not in moved}
+        for key, index in list(moved.items()):
+            if index in entries:
+                # Two entries of one image: the one already at the right index stays,
+                # the other keeps its key, or is keyed by its path if that was taken
+                del moved[key]
+                spare = key if key not in entries else normalize_path(self.entries[key]['image_paths']['rgb'])
+                entries[spare] = self.entries[key]
+                unmatched.append(spare)
+            else:
+                entries[index] = self.entries[key]
+        self.entries = entries
+        return moved, unmatched
+
+    def load(self):
+        """Reads the JSON file, a missing file is an empty store. Raises ValueError if it's corrupted."""
+        self.entries = {}
+        if self.path is None:
+            return
+        try:
+            with open(self.path, 'r') as f:
+                self.entries = json.load(f)
+        except FileNotFoundError:
+            pass
+
+    def write(self):
+        """Writes the whole JSON file"""
+        if self.path is not None:
+            with open(self.path, 'w') as f:
+                json.dump(self.entries, f, indent=4)
+
+    def save(self, *keys):
+        """Persists the entries of keys: queued to the server when connected, else the JSON file is rewritten"""
+        if self.client is None:
+            self.write()
+            return
+        for key in keys:
+            entry = self.entries.get(str(key)) or {}
+            if self.server_field is None:
+                # Owned fields the entry doesn't have are sent as None, which removes them
+                fields = {field: entry.get(field) for field in MAPPING_FIELDS}
+            else:
+                fields = {self.server_field: entry.get('points') or None}
+            self.client.submit(key, fields, merge=True)
+
+    def _from_server(self, entry):
+        if entry is None:
+            return None
+        if self.server_field is None:
+            if not any(entry.get(field) is not None for field in MAPPING_FIELDS):
+                return None
+            return {k: v for k, v in entry.items() if k != "version" and v is not None}
+        return {'points': entry[self.server_field]} if entry.get(self.server_field) else None
+
+    def connect(self, client):
+        """Switches to the server's entries, closing the previous client"""
+        entries = client.fetch_all()
+        self._disconnect()
+        self.client = client
+        self.conflicts = client.subscribe()
+        self.entries = {}
+        for key, entry in entries.items():
+            self.set(key, self._from_server(entry))
+
+    def close(self, release=None):
+        """Sends pending writes, releasing the lease of index release first"""
+        if self.client is not None:
+            if release is not None:
+                self.release(release)
+            self._disconnect()
+
+    def _disconnect(self):
+        if self.client is not None:
+            self.client.unsubscribe(self.conflicts)
+            self.client.close()
+            self.client = None
+            self.conflicts = None
+
+    def refresh(self, index):
+        """Takes the server's version of one entry, another annotator may have changed it"""
+        self.set(index, self._from_server(self.client.fetch(index)))
+
+    def lease(self, mask, start, step):
+        """
+        Leases the first index from start in the direction of step (0 = only
+        start) that is set in mask and free on the server. None if there is none.
+        """
+        if step == 0:
+            return start if self.client.acquire(start) else None
+        stop = len(mask) if step > 0 else -1
+        index = find_next_index(mask, start, step)
+        while index is not None:
+            leased = self.client.acquire_next(index, stop, step)
+            if leased is None or mask[leased]:
+                return leased
+            # The free image is a bad pair, keep looking past it
+            self.client.release(leased)
+            index = find_next_index(mask, leased + step, step)
+        return None
+
+    def release(self, index):
+        if self.client is not None and index >= 0:
+            self.client.release(index)
+
+    def take_conflicts(self):
+        """
+        [(key, status, server entry or None)] of the writes the server rejected
+        since the last call: 'leased' (another annotator holds the image) or
+        'conflict' (another annotator changed the fields this store writes)
+        """
+        conflicts = []
+        while self.conflicts is not None and not self.conflicts.empty():
+            key, status, entry = self.conflicts.get_nowait()
+            conflicts.append((key, status, self._from_server(entry)))
+        return conflicts
+
+
+def find_image(dataset_df, start, step, skip_invalid=True, representatives=False, store=None):
+    """
+    First index from start in the direction of step (0 = only start) that can
+    be opened, skipping bad pairs and non-representatives as requested. With a
+    store connected to the server the image is leased and its entry refreshed.
+    None if there is no such image.
+    """
+    mask = navigable_mask(dataset_df, skip_invalid, representatives)
+    if store is None or store.client is None:
+        return start if step == 0 else find_next_index(mask, start, step)
+    index = store.lease(mask, start, step)
+    if index is not None:
+        store.refresh(index)
+    return index
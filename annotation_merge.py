@@ -0,0 +1,320 @@
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import tempfile
+import numpy as np
+from annotation_core import DEFAULT_PATH_COMPONENTS, MAPPING_FIELDS, normalize_path
+from dataset_sources import open_dataset
+
+# Point lists compared between annotations of the same pair
+POINT_FIELDS = ("rgb_points", "depth_points", "overlay_points")
+# Largest distance (pixels) between matching points of two annotations that still agree
+DEFAULT_TOLERANCE = 2.0
+# Fields of one point mapping annotation, always taken together from a single file:
+# rgb points of one file with depth points of another are correspondences nobody placed
+MAPPING_UNIT = tuple(field for field in MAPPING_FIELDS if field != "image_paths")
+READ_SIZE = 1 << 16
+
+CONFLICT_COLUMNS = ["key", "field", "reason", "max_distance", "kept", "other"]
+DIFF_COLUMNS = ["key", "status", "field", "max_distance"]
+
+
+def iter_json_object(path, read_size=READ_SIZE):
+    """
+    Yields the (key, value) members of the top-level JSON object in a file,
+    reading it in chunks. Only one member is held in memory at a time.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buf, pos, eof = "", 0, False
+
+        def more():
+            nonlocal buf, pos, eof
+            chunk = f.read(read_size)
+            eof = not chunk
+            buf, pos = buf[pos:] + chunk, 0
+
+        def token():
+            nonlocal pos
+            while True:
+                while pos < len(buf) and buf[pos] in " \t\r\n":
+                    pos += 1
+                if pos < len(buf) or eof:
+                    return buf[pos:pos + 1]
+                more()
+
+        def value():
+            nonlocal pos
+            while True:
+                try:
+                    obj, end = decoder.raw_decode(buf, pos)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                    more()
+                    continue
+                if not eof and (end == len(buf) or buf[end] not in " \t\r\n,:}]"):
+                    # A number cut by the end of the buffer may continue in the next chunk
+                    more()
+                    continue
+                pos = end
+                return obj
+
+        if token() != "{":
+            raise ValueError(f"{path} does not contain a JSON object")
+        pos += 1
+        if token() == "}":
+            return
+        while True:
+            token()
+            key = value()
+            if token() != ":":
+                raise ValueError(f"Malformed JSON in {path} after key {key!r}")
+            pos += 1
+            token()
+            yield key, value()
+            separator = token()
+            pos += 1
+            if separator == "}":
+                return
+            if separator != ",":
+                raise ValueError(f"Malformed JSON in {path} after key {key!r}")
+
+
+def entry_key(key, entry, components=DEFAULT_PATH_COMPONENTS):
+    """Normalized rgb path of an entry, the dataset index for entries without paths"""
+    rgb_path = (entry.get("image_paths") or {}).get("rgb")
+    return normalize_path(rgb_path, components) if rgb_path else f"index/{key}"
+
+
+def compare_entries(a, b, tolerance=DEFAULT_TOLERANCE):
+    """
+    Compares the point lists both entries have. Returns a list of
+    (field, reason, max_distance) for every field that disagrees.
+    """
+    problems = []
+    for field in POINT_FIELDS:
+        pa, pb = a.get(field), b.get(field)
+        if pa is None or pb is None or (not pa and not pb):
+            continue
+        if len(pa) != len(pb):
+            problems.append((field, "count", np.nan))
+            continue
+        dist = np.linalg.norm(np.asarray(pa, dtype=np.float64) - np.asarray(pb, dtype=np.float64), axis=1)
+        max_dist = float(dist.max()) if len(dist) else 0.0
+        if max_dist > tolerance:
+            problems.append((field, "distance", max_dist))
+    return problems
+
+
+class EntryTable:
+    """
+    Disk-backed table of (key, source, entry) used to group the entries of
+    several files by key without holding them in memory.
+    """
+
+    def __init__(self):
+        handle, self.path = tempfile.mkstemp(suffix=".sqlite")
+        os.close(handle)
+        self.db = sqlite3.connect(self.path)
+        self.db.execute("CREATE TABLE entries (key TEXT, source INTEGER, seq INTEGER, entry TEXT)")
+
+    def load(self, source, json_file, components):
+        rows = ((entry_key(key, entry, components), source, seq, json.dumps(entry))
+                for seq, (key, entry) in enumerate(iter_json_object(json_file)) if entry)
+        self.db.executemany("INSERT INTO entries VALUES (?, ?, ?, ?)", rows)
+        self.db.commit()
+
+    def groups(self):
+        """Yields (key, [(source, entry), ...]) in key order"""
+        self.db.execute("CREATE INDEX IF NOT EXISTS entries_key ON entries (key, source, seq)")
+        key, group = None, []
+        for row_key, source, _, entry in self.db.execute(
+                "SELECT key, source, seq, entry FROM entries ORDER BY key, source, seq"):
+            if row_key != key and group:
+                yield key, group
+                group = []
+            key = row_key
+            group.append((source, json.loads(entry)))
+        if group:
+            yield key, group
+
+    def close(self):
+        self.db.close()
+        os.remove(self.path)
+
+
+class JsonObjectWriter:
+    """Writes a JSON object member by member, in the layout of json.dump(indent=4)"""
+
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = path + ".tmp"
+        self.f = open(self.tmp_path, "w", encoding="utf-8")
+        self.f.write("{")
+        self.count = 0
+
+    def write(self, key, value):
+        text = json.dumps(value, indent=4).replace("\n", "\n    ")
+        self.f.write(("," if self.count else "") + f"\n    {json.dumps(key)}: {text}")
+        self.count += 1
+
+    def close(self):
+        self.f.write("\n}" if self.count else "}")
+        self.f.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        """Drops the partial output, an existing file at path is left untouched"""
+        self.f.close()
+        os.remove(self.tmp_path)
+
+
+def has_mapping(entry):
+    return bool(entry.get("rgb_points") or entry.get("depth_points"))
+
+
+def _merge_group(key, group, tolerance, sources):
+    """
+    Entry of the first file for the key, completed with fields only other
+    files have. The point mapping (MAPPING_UNIT) comes whole from the first
+    file that has one; independent fields (overlay_points) are filled in
+    from any file.
+    """
+    kept_source, merged = group[0]
+    merged = dict(merged)
+    conflicts = []
+    for source, entry in group[1:]:
+        for field, reason, max_dist in compare_entries(merged, entry, tolerance):
+            conflicts.append({"key": key, "field": field, "reason": reason, "max_distance": max_dist,
+                              "kept": sources[kept_source], "other": sources[source]})
+        if not has_mapping(merged) and has_mapping(entry):
+            for field in MAPPING_UNIT:
+                merged.pop(field, None)
+                if field in entry:
+                    merged[field] = entry[field]
+        for field, value in entry.items():
+            if field in MAPPING_UNIT:
+                continue
+            if field not in merged or (field in POINT_FIELDS and not merged[field]):
+                merged[field] = value
+    return merged, conflicts
+
+
+def merge_files(json_files, output, tolerance=DEFAULT_TOLERANCE, components=DEFAULT_PATH_COMPONENTS,
+                dataset=None, conflicts_file=None):
+    """
+    Merges several points files into one. Entries are matched by normalized rgb
+    path; when files disagree beyond tolerance the earliest file in json_files
+    wins and the conflict is reported. With a dataset folder the output is keyed
+    by that dataset's indices and paths, so the tools can open it directly;
+    otherwise it's keyed by normalized path. Returns (entries, conflicts, unmatched).
+    """
+    local = None
+    if dataset is not None:
+        dataset_df = open_dataset(dataset)
+        local = {normalize_path(rgb, components): (str(i), rgb, depth)
+                 for i, (rgb, depth) in enumerate(zip(dataset_df["rgb"], dataset_df["depth"]))}
+
+    table = EntryTable()
+    written = conflicts = unmatched = 0
+    try:
+        for source, json_file in enumerate(json_files):
+            table.load(source, json_file, components)
+
+        with open(conflicts_file or os.devnull, "w", newline="") as report:
+            conflict_writer = csv.DictWriter(report, fieldnames=CONFLICT_COLUMNS)
+            conflict_writer.writeheader()
+            writer = JsonObjectWriter(output)
+            try:
+                for key, group in table.groups():
+                    entry, problems = _merge_group(key, group, tolerance, json_files)
+                    conflicts += len(problems)
+                    conflict_writer.writerows(problems)
+                    if local is not None:
+                        if key not in local:
+                            unmatched += 1
+                            continue
+                        key, rgb, depth = local[key]
+                        entry["image_paths"] = {"rgb": rgb, "depth": depth}
+                    writer.write(key, entry)
+                    written += 1
+            except BaseException:
+                writer.abort()
+                raise
+            writer.close()
+    finally:
+        table.close()
+    return written, conflicts, unmatched
+
+
+def diff_files(json_a, json_b, tolerance=DEFAULT_TOLERANCE, components=DEFAULT_PATH_COMPONENTS):
+    """Yields one row per pair: only_a, only_b, same, or changed (one row per differing field)"""
+    table = EntryTable()
+    try:
+        table.load(0, json_a, components)
+        table.load(1, json_b, components)
+        for key, group in table.groups():
+            sources = {source for source, _ in group}
+            if sources == {0}:
+                yield {"key": key, "status": "only_a", "field": "", "max_distance": np.nan}
+            elif sources == {1}:
+                yield {"key": key, "status": "only_b", "field": "", "max_distance": np.nan}
+            else:
+                a = next(entry for source, entry in group if source == 0)
+                b = next(entry for source, entry in group if source == 1)
+                problems = compare_entries(a, b, tolerance)
+                if not problems:
+                    yield {"key": key, "status": "same", "field": "", "max_distance": np.nan}
+                for field, reason, max_dist in problems:
+                    yield {"key": key, "status": "changed", "field": f"{field} ({reason})",
+                           "max_distance": max_dist}
+    finally:
+        table.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge or diff labeled points files from several machines")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="Max point distance in pixels for two annotations to agree")
+    parser.add_argument("--path-components", type=int, default=DEFAULT_PATH_COMPONENTS,
+                        help="Trailing path components used to match images across machines")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    merge = commands.add_parser("merge", help="Consolidate files, earlier files win conflicts")
+    merge.add_argument("json_files", nargs="+")
+    merge.add_argument("-o", "--output", default="labeled_points_merged.json")
+    merge.add_argument("--dataset", help="Key the output by this dataset's indices and paths")
+    merge.add_argument("--conflicts", default="merge_conflicts.csv")
+
+    diff = commands.add_parser("diff", help="Compare two files")
+    diff.add_argument("json_a")
+    diff.add_argument("json_b")
+    diff.add_argument("-o", "--output", default="points_diff.csv")
+    diff.add_argument("--all", action="store_true", help="Also list pairs that agree")
+    args = parser.parse_args()
+
+    if args.command == "merge":
+        written, conflicts, unmatched = merge_files(args.json_files, args.output, args.tolerance,
+                                                    args.path_components, args.dataset, args.conflicts)
+        print(f"Merged {len(args.json_files)} files into {written} entries ({args.output}), "
+              f"{conflicts} conflicts written to {args.conflicts}")
+        if unmatched:
+            print(f"Warning: {unmatched} annotated images are not part of {args.dataset}")
+    else:
+        counts = {}
+        with open(args.output, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=DIFF_COLUMNS)
+            writer.writeheader()
+            for row in diff_files(args.json_a, args.json_b, args.tolerance, args.path_components):
+                counts[row["status"]] = counts.get(row["status"], 0) + 1
+                if args.all or row["status"] != "same":
+                    writer.writerow(row)
+        print(", ".join(f"{status}: {count}" for status, count in sorted(counts.items()))
+              + f". Differences written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
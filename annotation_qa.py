@@ -0,0 +1,190 @@
+import argparse
+import json
+import os
+import warnings
+import numpy as np
+import pandas as pd
+
+# Robust z-score above which an image is reported as a dataset-wide outlier
+OUTLIER_Z = 3.5
+# Residual (in pixels) above which a single point is reported as inconsistent
+RESIDUAL_TOLERANCE = 2.0
+# Images are processed in blocks to bound the size of the pairwise distance arrays
+CHUNK_SIZE = 4096
+
+
+def load_annotation_arrays(storage):
+    """
+    Packs a points storage dict ({key: {'rgb_points': [...], 'depth_points': [...]}})
+    into NaN padded arrays of shape (n_images, max_points, 2).
+    """
+    keys = list(storage.keys())
+    rgb_lists = [storage[k].get('rgb_points') or [] for k in keys]
+    depth_lists = [storage[k].get('depth_points') or [] for k in keys]
+
+    rgb_counts = np.fromiter((len(p) for p in rgb_lists), dtype=np.int64, count=len(keys))
+    depth_counts = np.fromiter((len(p) for p in depth_lists), dtype=np.int64, count=len(keys))
+    max_points = int(max(rgb_counts.max(initial=0), depth_counts.max(initial=0)))
+
+    def pad(lists, counts):
+        padded = np.full((len(keys), max_points, 2), np.nan)
+        total = int(counts.sum())
+        if total:
+            flat = np.array([pt for pts in lists for pt in pts], dtype=np.float64).reshape(total, 2)
+            rows = np.repeat(np.arange(len(keys)), counts)
+            # Position of every point inside its own image
+            cols = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+            padded[rows, cols] = flat
+        return padded
+
+    return {
+        'keys': np.array(keys, dtype=object),
+        'rgb_names': np.array([os.path.basename(str(storage[k].get('image_paths', {}).get('rgb', '')))
+                               for k in keys], dtype=object),
+        'rgb': pad(rgb_lists, rgb_counts),
+        'depth': pad(depth_lists, depth_counts),
+        'rgb_counts': rgb_counts,
+        'depth_counts': depth_counts,
+    }
+
+
+def fit_translations(rgb, depth):
+    """
+    Least-squares translation (the tool's RGB -> depth model) for every image at once.
+    Returns the (n_images, 2) translation and the (n_images, max_points) residuals.
+    """
+    diff = depth - rgb
+    valid = ~np.isnan(diff).any(axis=2)
+    n_valid = valid.sum(axis=1)
+    sums = np.where(valid[..., None], diff, 0.0).sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        translations = sums / n_valid[:, None]
+    residuals = np.linalg.norm(diff - translations[:, None, :], axis=2)
+    residuals[~valid] = np.nan
+    return translations, residuals
+
+
+def find_ordering_anomalies(rgb, depth, translations):
+    """
+    Flags images whose depth points are matched to a different RGB point
+    than the one stored at the same position once the translation is applied.
+    """
+    n_images, max_points, _ = rgb.shape
+    anomalies = np.zeros(n_images, dtype=bool)
+    if max_points < 2:
+        return anomalies
+
+    for start in range(0, n_images, CHUNK_SIZE):
+        stop = start + CHUNK_SIZE
+        predicted = rgb[start:stop] + translations[start:stop, None, :]
+        # Distance from every predicted point to every stored depth point
+        dist = np.linalg.norm(predicted[:, :, None, :] - depth[start:stop, None, :, :], axis=3)
+        dist = np.where(np.isnan(dist), np.inf, dist)
+        nearest = dist.argmin(axis=2)
+        has_match = np.isfinite(dist).any(axis=2)
+        swapped = has_match & (nearest != np.arange(max_points)[None, :])
+        # Only count swaps that are clearly better than the stored pairing
+        own_dist = np.diagonal(dist, axis1=1, axis2=2)
+        with np.errstate(invalid='ignore'):
+            swapped &= np.isfinite(own_dist) & ((own_dist - dist.min(axis=2)) > RESIDUAL_TOLERANCE)
+        anomalies[start:stop] = swapped.any(axis=1)
+    return anomalies
+
+
+def robust_zscore(values):
+    """Median/MAD based z-score, NaN where the value is undefined."""
+    values = np.asarray(values, dtype=np.float64)
+    finite = np.isfinite(values)
+    if not finite.any():
+        return np.full(values.shape, np.nan)
+    median = np.median(values[finite])
+    mad = np.median(np.abs(values[finite] - median))
+    if mad == 0:
+        mad = np.mean(np.abs(values[finite] - median)) or 1.0
+    return 0.6745 * (values - median) / mad
+
+
+def run_qa(storage):
+    """
+    Runs the reprojection-residual QA over a points storage dict and
+    returns a DataFrame ranked from most to least suspicious.
+    """
+    arrays = load_annotation_arrays(storage)
+    rgb, depth = arrays['rgb'], arrays['depth']
+    rgb_counts, depth_counts = arrays['rgb_counts'], arrays['depth_counts']
+
+    translations, residuals = fit_translations(rgb, depth)
+    with warnings.catch_warnings():
+        # Images without any complete pair produce all-NaN rows
+        warnings.simplefilter("ignore", RuntimeWarning)
+        rms = np.sqrt(np.nanmean(residuals ** 2, axis=1))
+        max_residual = np.nanmax(residuals, axis=1)
+    worst_point = np.where(np.isnan(residuals).all(axis=1), -1,
+                           np.nan_to_num(residuals, nan=-1.0).argmax(axis=1))
+
+    ordering = find_ordering_anomalies(rgb, depth, translations)
+    offset_z = np.hypot(robust_zscore(translations[:, 0]), robust_zscore(translations[:, 1]))
+    residual_z = robust_zscore(rms)
+
+    flags = {
+        'empty': (rgb_counts == 0) | (depth_counts == 0),
+        'count_mismatch': rgb_counts != depth_counts,
+        'ordering': ordering,
+        'residual': np.nan_to_num(max_residual) > RESIDUAL_TOLERANCE,
+        'offset_outlier': np.nan_to_num(offset_z) > OUTLIER_Z,
+        'residual_outlier': np.nan_to_num(residual_z) > OUTLIER_Z,
+    }
+    flag_matrix = np.column_stack(list(flags.values()))
+    flag_names = np.array(list(flags.keys()), dtype=object)
+    flag_text = [','.join(flag_names[row]) for row in flag_matrix]
+
+    # Hard anomalies dominate the ranking, outlier strength breaks ties
+    score = (flag_matrix[:, :3].sum(axis=1) * 100.0
+             + np.nan_to_num(max_residual)
+             + np.nan_to_num(offset_z)
+             + np.nan_to_num(residual_z).clip(min=0))
+
+    report = pd.DataFrame({
+        'key': arrays['keys'],
+        'rgb_file': arrays['rgb_names'],
+        'rgb_points': rgb_counts,
+        'depth_points': depth_counts,
+        'offset_x': translations[:, 0],
+        'offset_y': translations[:, 1],
+        'rms_residual': rms,
+        'max_residual': max_residual,
+        'worst_point': worst_point + 1,
+        'offset_z': offset_z,
+        'residual_z': residual_z,
+        'flags': flag_text,
+        'score': score,
+    })
+    report = report.sort_values('score', ascending=False, kind='stable').reset_index(drop=True)
+    return report
+
+
+def write_report(report, path):
+    report.to_csv(path, index=False, float_format="%.3f")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reprojection-residual QA over labeled points")
+    parser.add_argument("json_file", nargs="?", default="labeled_points.json")
+    parser.add_argument("-o", "--output", default="qa_report.csv")
+    parser.add_argument("--only-flagged", action="store_true",
+                        help="Write only images with at least one flag")
+    args = parser.parse_args()
+
+    with open(args.json_file, 'r') as f:
+        storage = json.load(f)
+
+    report = run_qa(storage)
+    if args.only_flagged:
+        report = report[report['flags'] != '']
+    write_report(report, args.output)
+    flagged = int((report['flags'] != '').sum())
+    print(f"Checked {len(storage)} images, {flagged} flagged. Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
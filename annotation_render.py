@@ -0,0 +1,297 @@
+import argparse
+import json
+import os
+from collections import deque
+from itertools import islice
+import cv2
+import numpy as np
+from dataset_sources import open_dataset, process_context, read_frame
+from depth_registration import DEFAULT_OFFSET, pair_offsets, register_depth
+from lens_calibration import CALIBRATION_FILE, load_calibration, undistort
+from point_editing import POINT_STYLE, LINE_STYLE, LABEL_STYLE, FLAGGED_OUTLINE
+
+# BGR of the Tk colour names used by the canvas styles
+TK_COLORS = {
+    "white": (255, 255, 255),
+    "black": (0, 0, 0),
+    "yellow": (0, 255, 255),
+    "red": (0, 0, 255),
+    "orange": (0, 165, 255),
+}
+# Canvas marker radius and label offset of PointLayer
+MARKER_RADIUS = 4
+LABEL_OFFSET = 15
+# Arial 12 bold on the canvas is about this size in Hershey units
+LABEL_FONT = (cv2.FONT_HERSHEY_SIMPLEX, 0.5, 2)
+
+PANELS = ("rgb", "depth", "overlay")
+DEFAULT_PANEL_SIZE = (320, 240)
+DEFAULT_COLUMNS = 4
+DEFAULT_ROWS = 6
+DEFAULT_ALPHA = 0.4
+DEFAULT_FPS = 4
+CAPTION_HEIGHT = 22
+# Chunks submitted per worker ahead of the writer, bounds the rendered tiles held in memory
+CHUNKS_IN_FLIGHT = 2
+
+
+def compose_overlay(rgb, depth, shift, alpha=DEFAULT_ALPHA):
+    """
+    RGB image blended with the JET-coloured depth map moved by shift (pixels
+    of rgb), the composition of the Image Overlay tool.
+    """
+    depth_resized = cv2.resize(depth, (rgb.shape[1], rgb.shape[0]))
+    depth_shifted = register_depth(depth_resized, (-shift[0], -shift[1]), interpolation=cv2.INTER_LINEAR)
+    depth_gray = depth_shifted if depth_shifted.ndim == 2 else cv2.cvtColor(depth_shifted, cv2.COLOR_BGR2GRAY)
+    depth_normalized = cv2.normalize(depth_gray, None, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8U)
+    depth_colormap = cv2.applyColorMap(depth_normalized, cv2.COLORMAP_JET)
+    return cv2.addWeighted(to_bgr(rgb), 1 - alpha, depth_colormap, alpha, 0)
+
+
+def to_bgr(image):
+    """3-channel 8-bit version of an image for drawing; other depth formats are colour-mapped"""
+    if image.ndim == 3 and image.shape[2] == 3 and image.dtype == np.uint8:
+        return image.copy()
+    if image.ndim == 3 and image.shape[2] == 4 and image.dtype == np.uint8:
+        return cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+    gray = image if image.ndim == 2 else image[:, :, 0]
+    normalized = cv2.normalize(gray, None, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8U)
+    return cv2.applyColorMap(normalized, cv2.COLORMAP_JET)
+
+
+def draw_points(image, points, scale=1.0, flags=None):
+    """
+    Draws an ordered point list like PointLayer does on the canvas: connecting
+    lines, numbered markers and labels. Points are in image coordinates and
+    drawn at scale. flags marks points drawn with the flagged outline.
+    """
+    points = [(int(round(x * scale)), int(round(y * scale))) for x, y in points]
+    line_color = TK_COLORS[LINE_STYLE["fill"]]
+    for p, q in zip(points, points[1:]):
+        cv2.line(image, p, q, line_color, LINE_STYLE["width"], cv2.LINE_AA)
+
+    font, font_scale, thickness = LABEL_FONT
+    for i, (x, y) in enumerate(points):
+        outline = FLAGGED_OUTLINE if flags is not None and flags[i] else POINT_STYLE["outline"]
+        cv2.circle(image, (x, y), MARKER_RADIUS, TK_COLORS[POINT_STYLE["fill"]], -1, cv2.LINE_AA)
+        cv2.circle(image, (x, y), MARKER_RADIUS, TK_COLORS[outline], POINT_STYLE["width"], cv2.LINE_AA)
+        # Centred on (x, y - 15) like the canvas text items
+        label = str(i + 1)
+        (w, h), _ = cv2.getTextSize(label, font, font_scale, thickness)
+        cv2.putText(image, label, (x - w // 2, y - LABEL_OFFSET + h // 2), font, font_scale,
+                    TK_COLORS[LABEL_STYLE["fill"]], thickness, cv2.LINE_AA)
+    return image
+
+
+def fit_panel(image, points, size):
+    """Letterboxes image into size (width, height), returns it and the scale applied to the points"""
+    width, height = size
+    scale = min(width / image.shape[1], height / image.shape[0])
+    resized = cv2.resize(image, (max(1, int(image.shape[1] * scale)), max(1, int(image.shape[0] * scale))),
+                         interpolation=cv2.INTER_AREA)
+    panel = np.zeros((height, width, 3), dtype=np.uint8)
+    y0 = (height - resized.shape[0]) // 2
+    x0 = (width - resized.shape[1]) // 2
+    panel[y0:y0 + resized.shape[0], x0:x0 + resized.shape[1]] = resized
+    return panel, [(x * scale + x0, y * scale + y0) for x, y in points]
+
+
+def render_pair(rgb, depth, entry, offset, panels=PANELS, panel_size=DEFAULT_PANEL_SIZE, alpha=DEFAULT_ALPHA):
+    """Panels of one pair side by side, each with its points drawn"""
+    entry = entry or {}
+    rgb_points = entry.get('rgb_points') or []
+    depth_points = entry.get('depth_points') or []
+    # Points of the Image Overlay tool refer to the RGB frame
+    overlay_points = entry.get('points') or entry.get('overlay_points') or rgb_points
+
+    images = []
+    for panel in panels:
+        if panel == "rgb":
+            image, points = to_bgr(rgb), rgb_points
+        elif panel == "depth":
+            image, points = to_bgr(depth), depth_points
+        else:
+            # depth = rgb + offset, so the depth map moves by -offset onto the RGB frame
+            image, points = compose_overlay(rgb, depth, (-offset[0], -offset[1]), alpha), overlay_points
+        fitted, fitted_points = fit_panel(image, points, panel_size)
+        images.append(draw_points(fitted, fitted_points))
+    return np.hstack(images)
+
+
+def add_caption(tile, text):
+    caption = np.zeros((CAPTION_HEIGHT, tile.shape[1], 3), dtype=np.uint8)
+    cv2.putText(caption, text, (6, CAPTION_HEIGHT - 7), cv2.FONT_HERSHEY_SIMPLEX, 0.45,
+                TK_COLORS["white"], 1, cv2.LINE_AA)
+    return np.vstack([caption, tile])
+
+
+def _render_tile(task):
+    index, rgb_path, depth_path, entry, offset, panels, panel_size, alpha, calibration = task
+    try:
+        rgb = read_frame(rgb_path, cv2.IMREAD_UNCHANGED)
+        depth = read_frame(depth_path, cv2.IMREAD_UNCHANGED)
+        if rgb is None or depth is None:
+            raise IOError(f"Could not read {rgb_path if rgb is None else depth_path}")
+        if entry and entry.get('undistorted'):
+            # The points were placed on undistorted images
+            rgb = undistort(calibration, "rgb", rgb)
+            depth = undistort(calibration, "depth", depth)
+        tile = render_pair(rgb, depth, entry, offset, panels, panel_size, alpha)
+        error = None
+    except Exception as e:
+        tile = np.zeros((panel_size[1], panel_size[0] * len(panels), 3), dtype=np.uint8)
+        error = str(e)
+    points = len((entry or {}).get('rgb_points') or (entry or {}).get('points') or [])
+    text = f"{index + 1}: {os.path.basename(rgb_path)}  {points} points" + (f"  [{error}]" if error else "")
+    return index, add_caption(tile, text), error
+
+
+def _render_chunk(tasks):
+    return [_render_tile(task) for task in tasks]
+
+
+class ContactSheetWriter:
+    """Places tiles row by row on sheets of columns x rows, writing each sheet once it's full"""
+
+    def __init__(self, output_dir, columns=DEFAULT_COLUMNS, rows=DEFAULT_ROWS):
+        os.makedirs(output_dir, exist_ok=True)
+        self.output_dir = output_dir
+        self.columns = columns
+        self.rows = rows
+        self.sheet = None
+        self.count = 0
+        self.written = []
+
+    def write(self, tile):
+        h, w = tile.shape[:2]
+        if self.sheet is None:
+            self.sheet = np.zeros((h * self.rows, w * self.columns, 3), dtype=np.uint8)
+        slot = self.count % (self.columns * self.rows)
+        r, c = divmod(slot, self.columns)
+        self.sheet[r * h:(r + 1) * h, c * w:(c + 1) * w] = tile
+        self.count += 1
+        if slot == self.columns * self.rows - 1:
+            self.flush()
+
+    def flush(self):
+        if self.sheet is None:
+            return
+        used_rows = ((self.count - 1) % (self.columns * self.rows)) // self.columns + 1
+        h = self.sheet.shape[0] // self.rows
+        path = os.path.join(self.output_dir, f"sheet_{len(self.written):04d}.png")
+        cv2.imwrite(path, self.sheet[:used_rows * h])
+        self.written.append(path)
+        self.sheet = None
+
+    def close(self):
+        self.flush()
+
+
+class VideoWriter:
+    """One tile per frame of an MP4 walkthrough"""
+
+    def __init__(self, path, fps=DEFAULT_FPS):
+        self.path = path
+        self.fps = fps
+        self.writer = None
+        self.count = 0
+
+    def write(self, tile):
+        if self.writer is None:
+            size = (tile.shape[1], tile.shape[0])
+            self.writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*"mp4v"), self.fps, size)
+            if not self.writer.isOpened():
+                raise IOError(f"Could not open {self.path} for writing")
+        self.writer.write(tile)
+        self.count += 1
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.release()
+
+
+def render_dataset(dataset_df, storage, writer, start=0, stop=None, panels=PANELS,
+                   panel_size=DEFAULT_PANEL_SIZE, alpha=DEFAULT_ALPHA, only_annotated=False,
+                   workers=None, chunksize=8, calibration=None):
+    """
+    Renders the pairs start..stop of a dataset in a process pool and streams the
+    tiles, in dataset order, to writer (ContactSheetWriter or VideoWriter).
+    The overlay uses each pair's stored or fitted offset. Returns (rendered, failed).
+    """
+    offsets = pair_offsets(storage)
+    default_offset = tuple(np.median(list(offsets.values()), axis=0)) if offsets else DEFAULT_OFFSET
+    stop = len(dataset_df) if stop is None else min(stop, len(dataset_df))
+
+    tasks = ((i, dataset_df['rgb'].iat[i], dataset_df['depth'].iat[i], storage.get(str(i)),
+              offsets.get(str(i), default_offset), panels, panel_size, alpha, calibration)
+             for i in range(start, stop) if not only_annotated or storage.get(str(i)))
+
+    rendered = failed = 0
+    workers = workers or os.cpu_count() or 1
+    with process_context().Pool(processes=workers) as pool:
+        # A new chunk is submitted only when the oldest is written, so a slow writer
+        # holds back the workers instead of queueing every rendered tile in memory
+        pending = deque()
+        while True:
+            while len(pending) < workers * CHUNKS_IN_FLIGHT:
+                chunk = list(islice(tasks, chunksize))
+                if not chunk:
+                    break
+                pending.append(pool.apply_async(_render_chunk, (chunk,)))
+            if not pending:
+                break
+            # Ordered results, each tile is handed to the writer as soon as its turn comes
+            for index, tile, error in pending.popleft().get():
+                if error is not None:
+                    print(f"Warning: pair {index} not rendered: {error}")
+                    failed += 1
+                writer.write(tile)
+                rendered += 1
+    writer.close()
+    return rendered, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render annotated pairs to contact sheets or an MP4 walkthrough")
+    parser.add_argument("dataset", help="Dataset root folder")
+    parser.add_argument("--points", default="labeled_points.json")
+    parser.add_argument("-o", "--output", default="contact_sheets",
+                        help="Folder for contact sheet PNGs, or a .mp4 file for a walkthrough video")
+    parser.add_argument("--start", type=int, default=1, help="First pair (1-based, as shown in the tools)")
+    parser.add_argument("--stop", type=int, default=None, help="Last pair (inclusive)")
+    parser.add_argument("--panels", default=",".join(PANELS), help="Comma-separated: rgb, depth, overlay")
+    parser.add_argument("--panel-size", type=int, nargs=2, metavar=("WIDTH", "HEIGHT"), default=DEFAULT_PANEL_SIZE)
+    parser.add_argument("--columns", type=int, default=DEFAULT_COLUMNS)
+    parser.add_argument("--rows", type=int, default=DEFAULT_ROWS)
+    parser.add_argument("--fps", type=float, default=DEFAULT_FPS)
+    parser.add_argument("--alpha", type=float, default=DEFAULT_ALPHA, help="Depth opacity of the overlay panel")
+    parser.add_argument("--only-annotated", action="store_true", help="Skip pairs without points")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--calibration", default=CALIBRATION_FILE,
+                        help="Lens calibration for points placed on undistorted images")
+    args = parser.parse_args()
+
+    panels = tuple(p.strip() for p in args.panels.split(",") if p.strip())
+    unknown = set(panels) - set(PANELS)
+    if unknown:
+        parser.error(f"Unknown panels: {', '.join(sorted(unknown))}")
+
+    try:
+        with open(args.points, 'r') as f:
+            storage = json.load(f)
+    except FileNotFoundError:
+        storage = {}
+
+    if args.output.lower().endswith(".mp4"):
+        writer = VideoWriter(args.output, args.fps)
+    else:
+        writer = ContactSheetWriter(args.output, args.columns, args.rows)
+    rendered, failed = render_dataset(open_dataset(args.dataset), storage, writer, args.start - 1, args.stop,
+                                      panels, tuple(args.panel_size), args.alpha, args.only_annotated,
+                                      args.workers, calibration=load_calibration(args.calibration))
+    target = args.output if isinstance(writer, VideoWriter) else f"{len(writer.written)} sheets in {args.output}"
+    print(f"Rendered {rendered} pairs to {target} ({failed} failed)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+import argparse
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Seconds a lease stays valid without being renewed
+DEFAULT_LEASE_SECONDS = 600
+# Seconds between two saves of the store to disk
+DEFAULT_FLUSH_SECONDS = 2.0
+
+
+class AnnotationStore:
+    """
+    Points storage owned by the server. Every entry carries a "version" that is
+    bumped on each write, so clients can only overwrite the version they last saw.
+    """
+
+    def __init__(self, json_file, lease_seconds=DEFAULT_LEASE_SECONDS):
+        self.json_file = json_file
+        self.lease_seconds = lease_seconds
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()
+        self.leases = {}  # Format: {key: (annotator, expires)}
+        self.dirty = False
+        try:
+            with open(json_file, 'r') as f:
+                self.entries = json.load(f)
+        except FileNotFoundError:
+            self.entries = {}
+        for entry in self.entries.values():
+            entry.setdefault("version", 1)
+
+    def get(self, key=None):
+        with self.lock:
+            if key is None:
+                return dict(self.entries)
+            return self.entries.get(key)
+
+    def write(self, annotator, writes):
+        """
+        Applies a batch of writes [{'key', 'version', 'entry', 'merge'}].
+        A write only succeeds if 'version' matches the stored version (0 for a new key)
+        and the key isn't leased by another annotator. entry=None deletes the key.
+        """
+        results = []
+        now = time.time()
+        with self.lock:
+            for write in writes:
+                key = str(write["key"])
+                current = self.entries.get(key)
+                current_version = current["version"] if current else 0
+
+                holder = self.leases.get(key)
+                if holder and holder[0] != annotator and holder[1] > now:
+                    results.append({"key": key, "status": "leased", "annotator": holder[0],
+                                    "version": current_version, "entry": current})
+                    continue
+                if write.get("version", 0) != current_version:
+                    results.append({"key": key, "status": "conflict",
+                                    "version": current_version, "entry": current})
+                    continue
+
+                entry = write.get("entry")
+                if entry is not None and write.get("merge"):
+                    # Fields merged as None are removed, an entry left without fields is deleted
+                    merged = dict(current or {}, **entry)
+                    entry = {k: v for k, v in merged.items() if v is not None and k != "version"} or None
+                if entry is None:
+                    self.entries.pop(key, None)
+                    new_version = 0
+                else:
+                    new_version = current_version + 1
+                    self.entries[key] = dict(entry, version=new_version)
+                self.dirty = True
+                if holder and holder[0] == annotator:
+                    self.leases[key] = (annotator, now + self.lease_seconds)
+                results.append({"key": key, "status": "ok", "version": new_version})
+        return results
+
+    def acquire_lease(self, annotator, keys):
+        """Leases the first key of 'keys' that is free or already held by annotator"""
+        now = time.time()
+        with self.lock:
+            for key in keys:
+                key = str(key)
+                holder = self.leases.get(key)
+                if holder is None or holder[0] == annotator or holder[1] <= now:
+                    expires = now + self.lease_seconds
+                    self.leases[key] = (annotator, expires)
+                    return {"key": key, "expires": expires}
+        return {"key": None}
+
+    def release_lease(self, annotator, key):
+        with self.lock:
+            holder = self.leases.get(str(key))
+            if holder and holder[0] == annotator:
+                del self.leases[str(key)]
+                return True
+        return False
+
+    def flush(self):
+        """Saves the store if it changed, replacing the file atomically"""
+        with self.save_lock:
+            with self.lock:
+                if not self.dirty:
+                    return
+                data = json.dumps(self.entries, indent=4)
+                self.dirty = False
+            tmp_file = self.json_file + ".tmp"
+            with open(tmp_file, 'w') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file, self.json_file)
+
+
+class AnnotationRequestHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps connections open so clients can reuse them
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        store = self.server.store
+        if self.path == "/entries":
+            self.send_json({"entries": store.get()})
+        elif self.path.startswith("/entries/"):
+            entry = store.get(self.path[len("/entries/"):])
+            if entry is None:
+                self.send_json({"error": "not found"}, 404)
+            else:
+                self.send_json(entry)
+        else:
+            self.send_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        store = self.server.store
+        try:
+            request = self.read_json()
+            annotator = request["annotator"]
+            if self.path == "/entries":
+                self.send_json({"results": store.write(annotator, request["writes"])})
+            elif self.path == "/leases":
+                if "key" in request:
+                    keys = [request["key"]]
+                else:
+                    keys = range(request["start"], request["stop"], request.get("step", 1))
+                self.send_json(store.acquire_lease(annotator, keys))
+            elif self.path == "/leases/release":
+                self.send_json({"released": store.release_lease(annotator, request["key"])})
+            else:
+                self.send_json({"error": "not found"}, 404)
+        except (KeyError, TypeError, ValueError) as e:
+            self.send_json({"error": f"bad request: {e}"}, 400)
+
+
+def serve(json_file, host="127.0.0.1", port=8765, lease_seconds=DEFAULT_LEASE_SECONDS,
+          flush_seconds=DEFAULT_FLUSH_SECONDS, verbose=False):
+    store = AnnotationStore(json_file, lease_seconds)
+    server = ThreadingHTTPServer((host, port), AnnotationRequestHandler)
+    server.daemon_threads = True
+    server.store = store
+    server.verbose = verbose
+
+    stop = threading.Event()
+
+    def flush_loop():
+        while not stop.wait(flush_seconds):
+            try:
+                store.flush()
+            except OSError as e:
+                print(f"Warning: could not save {json_file}: {e}")
+
+    threading.Thread(target=flush_loop, daemon=True).start()
+    print(f"Serving {json_file} on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        server.server_close()
+        store.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared annotation store for several workstations")
+    parser.add_argument("json_file", nargs="?", default="labeled_points.json")
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="Use 0.0.0.0 to accept connections from the LAN")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--lease-seconds", type=int, default=DEFAULT_LEASE_SECONDS)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+    serve(args.json_file, args.host, args.port, args.lease_seconds, verbose=args.verbose)
+
+
+if __name__ == "__main__":
+    main()
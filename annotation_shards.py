@@ -0,0 +1,335 @@
+import argparse
+import glob
+import json
+import os
+import numpy as np
+from annotation_core import AnnotationStore, POINTS_FILE
+from annotation_merge import iter_json_object
+from depth_registration import pair_offsets
+
+# Binary export of a points file for training data loaders. Each shard is a
+# little-endian file: a fixed header (magic, version, image count and the
+# offset and size of every section), then the sections, each aligned so it can
+# be viewed in place from a memory map. Image i of a shard has the points
+# rgb_points[rgb_offsets[i]:rgb_offsets[i + 1]] (same for depth), the 2x3
+# RGB -> depth affine transforms[i] and the strings key, rgb path, depth path
+# at strings[string_offsets[3 * i]:string_offsets[3 * i + 3]].
+
+MAGIC = b"PTSHARD\0"
+VERSION = 1
+SHARD_PATTERN = "annotations_{:05d}.pts"
+DEFAULT_SHARD_IMAGES = 10000
+ALIGNMENT = 64
+
+# name, dtype, shape of one row
+SECTIONS = (
+    ("indices", "<i8", ()),  # Dataset index, -1 for keys that are not an index
+    ("rgb_offsets", "<u8", ()),  # images + 1 offsets into rgb_points
+    ("depth_offsets", "<u8", ()),
+    ("rgb_points", "<f4", (2,)),
+    ("depth_points", "<f4", (2,)),
+    ("transforms", "<f4", (2, 3)),  # NaN when the pair has neither an offset nor points to fit one
+    ("flags", "u1", ()),
+    ("string_offsets", "<u8", ()),  # 3 * images + 1 offsets into strings
+    ("strings", "u1", ()),  # UTF-8 key, rgb path and depth path of every image
+    ("extra", "u1", ()),  # JSON object of the entry fields not stored above, by key
+)
+HEADER = np.dtype([("magic", "S8"), ("version", "<u4"), ("images", "<u4"),
+                   ("sections", "<u8", (len(SECTIONS), 2))])
+
+# Flags: which of the stored fields the entry had, so the importer gives back the same entry
+HAS_RGB_POINTS = 1
+HAS_DEPTH_POINTS = 2
+HAS_OFFSET = 4
+HAS_UNDISTORTED = 8
+HAS_IMAGE_PATHS = 16
+HAS_INTERPOLATED = 32
+UNDISTORTED = 64
+STORED_FIELDS = ("rgb_points", "depth_points", "offset", "undistorted", "image_paths", "interpolated")
+
+
+def _entry_flags(entry):
+    flags = 0
+    for bit, field in zip((HAS_RGB_POINTS, HAS_DEPTH_POINTS, HAS_OFFSET, HAS_UNDISTORTED,
+                           HAS_IMAGE_PATHS, HAS_INTERPOLATED), STORED_FIELDS):
+        if entry.get(field) is not None:
+            flags |= bit
+    if entry.get("undistorted"):
+        flags |= UNDISTORTED
+    return flags
+
+
+def _pack_points(lists):
+    counts = np.fromiter((len(points) for points in lists), dtype=np.uint64, count=len(lists))
+    offsets = np.concatenate(([0], np.cumsum(counts, dtype=np.uint64))).astype("<u8")
+    points = np.array([point for points in lists for point in points], dtype="<f4").reshape(-1, 2)
+    return offsets, points
+
+
+def pack_entries(items):
+    """Section arrays of one shard from [(key, entry)]"""
+    keys = [str(key) for key, _ in items]
+    entries = [entry for _, entry in items]
+    rgb_offsets, rgb_points = _pack_points([entry.get("rgb_points") or [] for entry in entries])
+    depth_offsets, depth_points = _pack_points([entry.get("depth_points") or [] for entry in entries])
+
+    # The saved offset, else the translation fitted to the points, as an affine matrix
+    transforms = np.full((len(items), 2, 3), np.nan, dtype="<f4")
+    offsets = pair_offsets(dict(items))
+    for i, key in enumerate(keys):
+        if key in offsets:
+            dx, dy = offsets[key]
+            transforms[i] = [[1, 0, dx], [0, 1, dy]]
+
+    strings, string_offsets = [], [0]
+    for key, entry in zip(keys, entries):
+        paths = entry.get("image_paths") or {}
+        for text in (key, paths.get("rgb") or "", paths.get("depth") or ""):
+            strings.append(str(text).encode("utf-8"))
+            string_offsets.append(string_offsets[-1] + len(strings[-1]))
+
+    extra = {key: {field: value for field, value in entry.items() if field not in STORED_FIELDS}
+             for key, entry in zip(keys, entries)}
+    extra = {key: fields for key, fields in extra.items() if fields}
+
+    return {
+        "indices": np.array([int(key) if key.isdigit() else -1 for key in keys], dtype="<i8"),
+        "rgb_offsets": rgb_offsets,
+        "depth_offsets": depth_offsets,
+        "rgb_points": rgb_points,
+        "depth_points": depth_points,
+        "transforms": transforms,
+        "flags": np.array([_entry_flags(entry) for entry in entries], dtype="u1"),
+        "string_offsets": np.array(string_offsets, dtype="<u8"),
+        "strings": np.frombuffer(b"".join(strings), dtype="u1"),
+        "extra": np.frombuffer(json.dumps(extra).encode("utf-8") if extra else b"", dtype="u1"),
+    }
+
+
+def _aligned(position):
+    return -(-position // ALIGNMENT) * ALIGNMENT
+
+
+def write_shard(path, items):
+    """Writes the entries [(key, entry)] as one shard file (through a temporary file)"""
+    arrays = pack_entries(items)
+    header = np.zeros((), dtype=HEADER)
+    header["magic"] = MAGIC
+    header["version"] = VERSION
+    header["images"] = len(items)
+    position = _aligned(HEADER.itemsize)
+    for i, (name, dtype, _) in enumerate(SECTIONS):
+        data = np.ascontiguousarray(arrays[name], dtype=dtype)
+        arrays[name] = data
+        header["sections"][i] = (position, data.nbytes)
+        position = _aligned(position + data.nbytes)
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(header.tobytes())
+        for i, (name, _, _) in enumerate(SECTIONS):
+            f.seek(int(header["sections"][i][0]))
+            f.write(arrays[name].tobytes())
+        f.truncate(position)
+    os.replace(tmp_path, path)
+
+
+def export_shards(json_file, output_dir, shard_images=DEFAULT_SHARD_IMAGES):
+    """
+    Writes the entries of a points file as shards of up to shard_images images.
+    The file is read entry by entry, only one shard is held in memory.
+    Returns the shard paths.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    for stale in glob.glob(os.path.join(output_dir, SHARD_PATTERN.replace("{:05d}", "*"))):
+        os.remove(stale)
+    paths, batch = [], []
+
+    def flush():
+        path = os.path.join(output_dir, SHARD_PATTERN.format(len(paths)))
+        write_shard(path, batch)
+        paths.append(path)
+        batch.clear()
+
+    for key, entry in iter_json_object(json_file):
+        batch.append((key, entry))
+        if len(batch) >= shard_images:
+            flush()
+    if batch or not paths:
+        flush()
+    return paths
+
+
+def _to_list(points):
+    """Points as JSON lists, integers when they were stored as integers"""
+    if len(points) and np.array_equal(points, np.rint(points)):
+        return points.astype(np.int64).tolist()
+    return points.astype(np.float64).tolist()
+
+
+def _number(value):
+    value = float(value)
+    return int(value) if value.is_integer() else value
+
+
+class AnnotationShard:
+    """
+    Read-only view of one shard file. The sections are numpy arrays over a
+    memory map of the file, so points(i) slices an image's points without
+    copying or parsing anything. Pickling keeps only the path, so a shard can
+    be handed to data loader worker processes, each maps the file again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.data = np.memmap(path, dtype="u1", mode="r")
+        header = np.frombuffer(self.data, dtype=HEADER, count=1)[0]
+        if header["magic"] != MAGIC.rstrip(b"\0") or header["version"] != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} annotation shard")
+        self.images = int(header["images"])
+        self.sections = {}
+        for (name, dtype, shape), (offset, nbytes) in zip(SECTIONS, header["sections"]):
+            view = self.data[int(offset):int(offset) + int(nbytes)].view(dtype)
+            self.sections[name] = view.reshape((-1,) + shape)
+        self._extra = None
+
+    def __getstate__(self):
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"])
+
+    def __len__(self):
+        return self.images
+
+    def __getattr__(self, name):
+        # Section arrays as attributes: shard.rgb_points, shard.transforms, ...
+        sections = self.__dict__.get("sections")
+        if sections is not None and name in sections:
+            return sections[name]
+        raise AttributeError(name)
+
+    def points(self, i):
+        """(rgb, depth) float32 (n, 2) views of the points of image i"""
+        rgb, depth = self.rgb_offsets, self.depth_offsets
+        return (self.rgb_points[int(rgb[i]):int(rgb[i + 1])],
+                self.depth_points[int(depth[i]):int(depth[i + 1])])
+
+    def transform(self, i):
+        return self.transforms[i]
+
+    def _string(self, j):
+        start, stop = int(self.string_offsets[j]), int(self.string_offsets[j + 1])
+        return self.strings[start:stop].tobytes().decode("utf-8")
+
+    def key(self, i):
+        return self._string(3 * i)
+
+    def paths(self, i):
+        """(rgb path, depth path) of image i"""
+        return self._string(3 * i + 1), self._string(3 * i + 2)
+
+    def entry(self, i):
+        """Image i as an entry of the points store, as it was exported"""
+        flags = int(self.flags[i])
+        rgb, depth = self.points(i)
+        entry = {}
+        if flags & HAS_RGB_POINTS:
+            entry["rgb_points"] = _to_list(rgb)
+        if flags & HAS_DEPTH_POINTS:
+            entry["depth_points"] = _to_list(depth)
+        if flags & HAS_OFFSET:
+            entry["offset"] = [_number(v) for v in self.transforms[i, :, 2]]
+        if flags & HAS_UNDISTORTED:
+            entry["undistorted"] = bool(flags & UNDISTORTED)
+        if flags & HAS_IMAGE_PATHS:
+            rgb_path, depth_path = self.paths(i)
+            entry["image_paths"] = {"rgb": rgb_path, "depth": depth_path}
+        if flags & HAS_INTERPOLATED:
+            entry["interpolated"] = True
+        if self._extra is None:
+            extra = self.sections["extra"]
+            self._extra = json.loads(extra.tobytes().decode("utf-8")) if len(extra) else {}
+        entry.update(self._extra.get(self.key(i), {}))
+        return entry
+
+    def items(self):
+        for i in range(self.images):
+            yield self.key(i), self.entry(i)
+
+
+class ShardedAnnotations:
+    """The shards of an export folder as one sequence of images, for map-style data loaders"""
+
+    def __init__(self, directory):
+        paths = sorted(glob.glob(os.path.join(directory, SHARD_PATTERN.replace("{:05d}", "*"))))
+        if not paths:
+            raise FileNotFoundError(f"No annotation shards in {directory}")
+        self.shards = [AnnotationShard(path) for path in paths]
+        self.starts = np.cumsum([0] + [len(shard) for shard in self.shards])
+
+    def __len__(self):
+        return int(self.starts[-1])
+
+    def locate(self, i):
+        """(shard, index inside the shard) of image i"""
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        s = int(np.searchsorted(self.starts, i, side="right")) - 1
+        return self.shards[s], i - int(self.starts[s])
+
+    def __getitem__(self, i):
+        """(rgb points, depth points, transform) of image i, views into the shard"""
+        shard, j = self.locate(i)
+        rgb, depth = shard.points(j)
+        return rgb, depth, shard.transform(j)
+
+    def items(self):
+        for shard in self.shards:
+            yield from shard.items()
+
+
+def import_shards(directory, json_file=POINTS_FILE, replace=False):
+    """
+    Loads the entries of an export folder into the points file of the tools.
+    Entries of the shards replace existing ones with the same key; with
+    replace the file holds only the shards' entries. Returns the entry count.
+    """
+    store = AnnotationStore(json_file)
+    if not replace:
+        store.load()
+    count = 0
+    for key, entry in ShardedAnnotations(directory).items():
+        store.set(key, entry)
+        count += 1
+    store.write()
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Binary sharded export of labeled points for training data loaders")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", help="Write a points file as shards")
+    export.add_argument("json_file", nargs="?", default=POINTS_FILE)
+    export.add_argument("-o", "--output", default="annotation_shards")
+    export.add_argument("--shard-images", type=int, default=DEFAULT_SHARD_IMAGES,
+                        help="Images per shard")
+
+    load = commands.add_parser("import", help="Read shards back into a points file")
+    load.add_argument("directory")
+    load.add_argument("-o", "--output", default=POINTS_FILE)
+    load.add_argument("--replace", action="store_true", help="Drop the entries the shards don't have")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        paths = export_shards(args.json_file, args.output, args.shard_images)
+        images = sum(len(AnnotationShard(path)) for path in paths)
+        print(f"Exported {images} images to {len(paths)} shards in {args.output}")
+    else:
+        count = import_shards(args.directory, args.output, args.replace)
+        print(f"Imported {count} entries into {args.output}")
+
+
+if __name__ == "__main__":
+    main()
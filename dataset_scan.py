@@ -0,0 +1,174 @@
+import argparse
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from PIL import Image
+from dataset_sources import frame_header, open_dataset, process_context, split_locator
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# PNG colour type -> number of channels
+PNG_CHANNELS = {0: 1, 2: 3, 3: 3, 4: 2, 6: 4}
+# JPEG start-of-frame markers (C4, C8 and CC are not frames)
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+# Bytes at the end of a JPEG searched for the end-of-image marker, cameras may append data after it
+JPEG_TAIL_SEARCH = 1 << 16
+# PIL mode -> (channels, bit depth) for formats without a dedicated parser
+PIL_MODES = {"1": (1, 1), "L": (1, 8), "P": (3, 8), "RGB": (3, 8), "RGBA": (4, 8),
+             "I;16": (1, 16), "I;16B": (1, 16), "I": (1, 32), "F": (1, 32)}
+
+# (bit depth, channels) combinations the tools can display
+EXPECTED_RGB = {(8, 3), (8, 4)}
+EXPECTED_DEPTH = {(8, 3), (16, 1)}
+
+HEADER_FIELDS = ["width", "height", "channels", "bit_depth"]
+
+
+def _png_header(f):
+    f.seek(8)
+    length, chunk = struct.unpack(">I4s", f.read(8))
+    if chunk != b"IHDR" or length != 13:
+        raise IOError("missing IHDR chunk")
+    width, height, bit_depth, color_type = struct.unpack(">IIBB", f.read(10))
+    # A complete PNG ends with the IEND chunk, a cheap check for truncated files
+    f.seek(-12, os.SEEK_END)
+    if f.read(12)[4:8] != b"IEND":
+        raise IOError("truncated PNG")
+    return width, height, PNG_CHANNELS.get(color_type, 0), bit_depth
+
+
+def _jpeg_header(f):
+    f.seek(2)
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            raise IOError("invalid JPEG marker")
+        if marker[1] == 0xFF:
+            # Fill byte, the marker starts at the next byte
+            f.seek(-1, os.SEEK_CUR)
+            continue
+        length = struct.unpack(">H", f.read(2))[0]
+        if marker[1] in JPEG_SOF_MARKERS:
+            bit_depth, height, width, channels = struct.unpack(">BHHB", f.read(6))
+            # A complete JPEG has an EOI marker after the frame header (a thumbnail's
+            # EOI comes before it), possibly followed by trailing data
+            frame_start = f.tell()
+            size = f.seek(0, os.SEEK_END)
+            f.seek(max(frame_start, size - JPEG_TAIL_SEARCH))
+            if f.read().rfind(b"\xff\xd9") < 0:
+                raise IOError("truncated JPEG")
+            return width, height, channels, bit_depth
+        f.seek(length - 2, os.SEEK_CUR)
+
+
+def read_header(path):
+    """
+    Reads (width, height, channels, bit_depth) from the image header only,
+    without decoding the pixels. Raises IOError for unreadable files.
+    Frames of videos and archives report the format of their container.
+    """
+    if split_locator(path)[1] is not None:
+        return frame_header(path)
+
+    with open(path, "rb") as f:
+        magic = f.read(8)
+        if magic == PNG_SIGNATURE:
+            return _png_header(f)
+        if magic[:2] == b"\xff\xd8":
+            return _jpeg_header(f)
+
+    # Other formats: PIL only parses the header on open
+    with Image.open(path) as img:
+        if img.mode not in PIL_MODES:
+            raise IOError(f"unsupported image mode {img.mode}")
+        channels, bit_depth = PIL_MODES[img.mode]
+        return img.width, img.height, channels, bit_depth
+
+
+def scan_pair(paths):
+    """Header metadata and problems of one rgb/depth pair, as a flat dict"""
+    row = {}
+    problems = []
+    for side, path in zip(("rgb", "depth"), paths):
+        try:
+            header = read_header(path)
+        except (OSError, struct.error) as e:
+            header = (0, 0, 0, 0)
+            problems.append(f"{side} unreadable ({e})")
+        row.update({f"{side}_{name}": value for name, value in zip(HEADER_FIELDS, header)})
+
+    if not problems:
+        if (row["rgb_width"], row["rgb_height"]) != (row["depth_width"], row["depth_height"]):
+            problems.append("resolution mismatch")
+        if (row["rgb_bit_depth"], row["rgb_channels"]) not in EXPECTED_RGB:
+            problems.append(f"rgb is {row['rgb_bit_depth']}-bit {row['rgb_channels']}-channel")
+        if (row["depth_bit_depth"], row["depth_channels"]) not in EXPECTED_DEPTH:
+            problems.append(f"depth is {row['depth_bit_depth']}-bit {row['depth_channels']}-channel")
+
+    row["scan_status"] = "; ".join(problems) if problems else "ok"
+    row["valid"] = not problems
+    return row
+
+
+def scan_dataset(dataset_df, workers=None, chunksize=256):
+    """
+    Scans the headers of every pair in a process pool and returns a copy of
+    dataset_df with the metadata columns, 'scan_status' and 'valid' added.
+    """
+    pairs = list(zip(dataset_df["rgb"], dataset_df["depth"]))
+    if len(pairs) < chunksize:
+        # Not worth starting a pool
+        rows = [scan_pair(pair) for pair in pairs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count(),
+                                 mp_context=process_context()) as executor:
+            rows = list(executor.map(scan_pair, pairs, chunksize=chunksize))
+
+    columns = [f"{side}_{name}" for side in ("rgb", "depth") for name in HEADER_FIELDS]
+    scan = pd.DataFrame(rows, columns=columns + ["scan_status", "valid"], index=dataset_df.index)
+    result = dataset_df.drop(columns=[c for c in scan.columns if c in dataset_df.columns])
+    return pd.concat([result, scan], axis=1)
+
+
+def navigable_mask(dataset_df, skip_invalid, representatives_only=False):
+    """
+    Boolean array of the indices navigation may stop at. representatives_only
+    keeps one image per near-duplicate cluster (see frame_dedup.py).
+    """
+    mask = np.ones(len(dataset_df), dtype=bool)
+    if skip_invalid and "valid" in dataset_df.columns:
+        mask &= dataset_df["valid"].to_numpy(dtype=bool)
+    if representatives_only and "cluster" in dataset_df.columns:
+        mask &= dataset_df["cluster"].to_numpy() == np.arange(len(dataset_df))
+    return mask
+
+
+def find_next_index(mask, start, step):
+    """First index from start (inclusive) in the direction of step where mask is set, or None"""
+    if not 0 <= start < len(mask):
+        return None
+    if step >= 0:
+        hits = np.flatnonzero(mask[start:])
+        return int(start + hits[0]) if len(hits) else None
+    hits = np.flatnonzero(mask[:start + 1])
+    return int(hits[-1]) if len(hits) else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Header-only integrity scan of a dataset")
+    parser.add_argument("dataset", help="Dataset root folder with rgb and depth folders, videos or archives")
+    parser.add_argument("-o", "--output", default="dataset_scan.csv")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    scan = scan_dataset(open_dataset(args.dataset), args.workers)
+    scan.to_csv(args.output, index_label="index")
+    bad = scan[~scan["valid"]]
+    print(f"Scanned {len(scan)} pairs, {len(bad)} with problems. Results written to {args.output}")
+    for index, status in bad["scan_status"].head(20).items():
+        print(f"  {index}: {status}")
+
+
+if __name__ == "__main__":
+    main()
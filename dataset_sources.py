@@ -0,0 +1,364 @@
+import multiprocessing
+import os
+import struct
+import threading
+import zipfile
+from collections import OrderedDict
+import cv2
+import numpy as np
+import pandas as pd
+from image_io import read_image
+
+# Frames inside a video or archive are addressed as "<container path>#frame=<index>"
+FRAME_SEPARATOR = "#frame="
+VIDEO_EXTENSIONS = (".mp4", ".m4v", ".mov", ".avi", ".mkv")
+ARCHIVE_EXTENSIONS = (".zip", ".npy")
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff")
+
+# Frames decoded ahead of the last requested one while the video source is idle
+DEFAULT_READAHEAD = 8
+# Forward jumps up to this many frames are decoded sequentially instead of seeking
+SEQUENTIAL_GAP = 16
+
+# IMREAD_REDUCED_* flags -> reduction, applied after decoding frames from containers
+REDUCED_FLAGS = {
+    cv2.IMREAD_REDUCED_COLOR_2: 2,
+    cv2.IMREAD_REDUCED_COLOR_4: 4,
+    cv2.IMREAD_REDUCED_COLOR_8: 8,
+}
+
+
+def create_dataset_df(main_path):
+    """
+    Recibe el directorio principal del dataset y retorna un DataFrame
+    con las rutas de las imágenes rgb y su correspondiente imagen de profundidad.
+    """
+    # Directorios de imágenes rgb y depth
+    rgb_dir = os.path.join(main_path, "rgb")
+    depth_dir = os.path.join(main_path, "depth")
+
+    # Verificar que los directorios existan
+    if not os.path.exists(rgb_dir):
+        raise FileNotFoundError(f"No se encontró el directorio: {rgb_dir}")
+    if not os.path.exists(depth_dir):
+        raise FileNotFoundError(f"No se encontró el directorio: {depth_dir}")
+
+    # Obtener la lista ordenada de archivos en la carpeta rgb
+    # (el orden define los índices, que deben coincidir entre equipos)
+    rgb_files = sorted(os.listdir(rgb_dir))
+
+    # Crear una lista para almacenar las rutas correspondientes de cada imagen
+    data = []
+    for file in rgb_files:
+        rgb_image_path = os.path.join(rgb_dir, file)
+        depth_image_path = os.path.join(depth_dir, file)
+
+        # Verificar que la imagen de profundidad exista
+        if os.path.exists(depth_image_path):
+            data.append({
+                "rgb": rgb_image_path,
+                "depth": depth_image_path
+            })
+        else:
+            print(f"Warning: No se encontró la imagen de profundidad para: {file}")
+
+    # Crear el DataFrame
+    df = pd.DataFrame(data)
+    return df
+
+
+def mp4_keyframes(path):
+    """
+    Indices of the sync samples of the first video track, read from the MP4
+    'stss' box without decoding. Returns None if every frame is a keyframe or
+    the file can't be parsed. Sample order is decode order, which matches the
+    frame order of streams without B-frames (the usual capture-rig encoding).
+    """
+    def boxes(f, start, end):
+        pos = start
+        while pos + 8 <= end:
+            f.seek(pos)
+            size, kind = struct.unpack(">I4s", f.read(8))
+            header = 8
+            if size == 1:
+                size = struct.unpack(">Q", f.read(8))[0]
+                header = 16
+            elif size == 0:
+                size = end - pos
+            if size < header:
+                return
+            yield kind, pos + header, pos + size
+            pos += size
+
+    def child(f, start, end, kind):
+        return next(((s, e) for k, s, e in boxes(f, start, end) if k == kind), None)
+
+    try:
+        with open(path, "rb") as f:
+            moov = child(f, 0, os.path.getsize(path), b"moov")
+            if moov is None:
+                return None
+            for kind, start, end in boxes(f, *moov):
+                if kind != b"trak":
+                    continue
+                mdia = child(f, start, end, b"mdia")
+                hdlr = mdia and child(f, *mdia, b"hdlr")
+                if not hdlr:
+                    continue
+                f.seek(hdlr[0] + 8)
+                if f.read(4) != b"vide":
+                    continue
+                minf = child(f, *mdia, b"minf")
+                stbl = minf and child(f, *minf, b"stbl")
+                stss = stbl and child(f, *stbl, b"stss")
+                if not stss:
+                    return None
+                f.seek(stss[0] + 4)
+                count = struct.unpack(">I", f.read(4))[0]
+                samples = np.frombuffer(f.read(4 * count), dtype=">u4").astype(np.int64)
+                return samples - 1
+    except (OSError, struct.error):
+        pass
+    return None
+
+
+class VideoFrames:
+    """
+    Random access to the frames of a video. Seeks jump to the closest keyframe
+    before the target and decode forward from there; an idle background thread
+    decodes the next frames so stepping forward doesn't wait on the decoder.
+    """
+
+    def __init__(self, path, readahead=DEFAULT_READAHEAD):
+        self.path = path
+        self.capture = cv2.VideoCapture(path)
+        if not self.capture.isOpened():
+            raise IOError(f"Could not open video: {path}")
+        self.count = int(self.capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.width = int(self.capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.keyframes = mp4_keyframes(path)
+        self.position = 0  # Index of the frame the next capture.read() returns
+        self.readahead = readahead
+        self.prefetch_until = -1
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        threading.Thread(target=self._prefetch_loop, daemon=True).start()
+
+    def __len__(self):
+        return self.count
+
+    def header(self):
+        return self.width, self.height, 3, 8
+
+    def _seek(self, index):
+        if self.position <= index <= self.position + SEQUENTIAL_GAP:
+            start = self.position
+        else:
+            start = index
+            if self.keyframes is not None and len(self.keyframes):
+                i = np.searchsorted(self.keyframes, index, side="right") - 1
+                start = int(self.keyframes[max(i, 0)])
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, start)
+            self.position = start
+        while self.position < index:
+            if not self.capture.grab():
+                break
+            self.position += 1
+
+    def _read_at(self, index):
+        # Caller holds self.lock
+        self._seek(index)
+        ok, frame = self.capture.read()
+        self.position += 1
+        if not ok:
+            return None
+        self.cache[index] = frame
+        while len(self.cache) > 2 * self.readahead + 1:
+            self.cache.popitem(last=False)
+        return frame
+
+    def read(self, index):
+        with self.lock:
+            if index in self.cache:
+                self.cache.move_to_end(index)
+                frame = self.cache[index]
+            else:
+                frame = self._read_at(index)
+            self.prefetch_until = index + self.readahead
+        self.wakeup.set()
+        return frame
+
+    def _prefetch_loop(self):
+        while True:
+            self.wakeup.wait()
+            self.wakeup.clear()
+            while True:
+                with self.lock:
+                    index = self.position
+                    if index > self.prefetch_until or index >= self.count:
+                        break
+                    if index not in self.cache and self._read_at(index) is None:
+                        break
+                    elif index in self.cache:
+                        # Already decoded, just move the decoder past it
+                        self.capture.grab()
+                        self.position += 1
+
+
+class ArchiveFrames:
+    """Frames stored as images inside a .zip archive or as an (N, H, W[, C]) .npy stack"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        try:
+            if path.lower().endswith(".npy"):
+                # Memory-mapped, only the requested frame is read from disk
+                self.stack = np.load(path, mmap_mode="r")
+                self.archive = None
+                self.count = len(self.stack)
+            else:
+                self.stack = None
+                self.archive = zipfile.ZipFile(path)
+                self.names = sorted(name for name in self.archive.namelist()
+                                    if name.lower().endswith(IMAGE_EXTENSIONS))
+                self.count = len(self.names)
+        except (ValueError, zipfile.BadZipFile) as e:
+            raise IOError(f"Could not open archive {path}: {e}")
+        self._header = None
+
+    def __len__(self):
+        return self.count
+
+    def read(self, index):
+        if self.stack is not None:
+            return np.array(self.stack[index])
+        with self.lock:
+            data = self.archive.read(self.names[index])
+        return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+
+    def header(self):
+        # All frames of an archive share the format of the first one
+        if self._header is None:
+            frame = self.read(0) if self.count else None
+            if frame is None:
+                raise IOError(f"Could not read frames from {self.path}")
+            channels = frame.shape[2] if frame.ndim == 3 else 1
+            self._header = (frame.shape[1], frame.shape[0], channels, frame.dtype.itemsize * 8)
+        return self._header
+
+
+_sources = {}
+_sources_lock = threading.Lock()
+
+
+def process_context():
+    """
+    multiprocessing context for worker pools. Workers are spawned, not forked:
+    pools are started from the tools' worker threads, and a forked child would
+    inherit the open sources above with their locks, captures and prefetch state.
+    """
+    return multiprocessing.get_context("spawn")
+
+
+def get_frame_source(path):
+    """Opened source of a video or archive, shared by every frame of the container"""
+    with _sources_lock:
+        source = _sources.get(path)
+        if source is None:
+            if path.lower().endswith(VIDEO_EXTENSIONS):
+                source = VideoFrames(path)
+            elif path.lower().endswith(ARCHIVE_EXTENSIONS):
+                source = ArchiveFrames(path)
+            else:
+                raise IOError(f"Unsupported frame container: {path}")
+            _sources[path] = source
+        return source
+
+
+def split_locator(locator):
+    """'<path>#frame=<i>' -> (path, i), plain image paths -> (path, None)"""
+    path, sep, index = str(locator).rpartition(FRAME_SEPARATOR)
+    if not sep:
+        return str(locator), None
+    return path, int(index)
+
+
+def _reduced_color(frame, reduction):
+    # Same output as cv2.IMREAD_REDUCED_COLOR_*: 8-bit BGR at 1/reduction size
+    if frame.dtype != np.uint8:
+        frame = (frame >> 8).astype(np.uint8) if frame.dtype == np.uint16 else \
+            cv2.normalize(frame, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+    if frame.ndim == 2:
+        frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+    elif frame.shape[2] == 4:
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGRA2BGR)
+    h, w = frame.shape[:2]
+    size = ((w + reduction - 1) // reduction, (h + reduction - 1) // reduction)
+    return cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+
+
+def read_frame(locator, flags=cv2.IMREAD_UNCHANGED):
+    """Decodes an image file or a frame of a video/archive. Returns None on failure."""
+    path, index = split_locator(locator)
+    if index is None:
+        return read_image(path, flags)
+    try:
+        frame = get_frame_source(path).read(index)
+    except (IOError, IndexError):
+        return None
+    if frame is not None and flags in REDUCED_FLAGS:
+        frame = _reduced_color(frame, REDUCED_FLAGS[flags])
+    return frame
+
+
+def frame_mtime(locator):
+    return os.path.getmtime(split_locator(locator)[0])
+
+
+def frame_header(locator):
+    """(width, height, channels, bit_depth) of a frame inside a container"""
+    path, _ = split_locator(locator)
+    return get_frame_source(path).header()
+
+
+def _find_side(folder, name):
+    """The rgb/depth entry of a dataset folder: a directory, a video or an archive"""
+    directory = os.path.join(folder, name)
+    if os.path.isdir(directory):
+        return directory
+    for ext in VIDEO_EXTENSIONS + ARCHIVE_EXTENSIONS:
+        for candidate in (name + ext, name + ext.upper()):
+            path = os.path.join(folder, candidate)
+            if os.path.isfile(path):
+                return path
+    raise FileNotFoundError(f"No se encontró '{name}' (carpeta, video o archivo) en: {folder}")
+
+
+def _side_locators(path):
+    if os.path.isdir(path):
+        return [os.path.join(path, f) for f in sorted(os.listdir(path))
+                if f.lower().endswith(IMAGE_EXTENSIONS)]
+    return [f"{path}{FRAME_SEPARATOR}{i}" for i in range(len(get_frame_source(path)))]
+
+
+def open_dataset(folder):
+    """
+    Dataset index of a folder. rgb and depth can each be a folder of images,
+    a video (rgb.mp4) or a multi-frame archive (depth.zip, depth.npy).
+    Two image folders are paired by file name, anything else by frame number.
+    """
+    rgb_side = _find_side(folder, "rgb")
+    depth_side = _find_side(folder, "depth")
+    if os.path.isdir(rgb_side) and os.path.isdir(depth_side):
+        return create_dataset_df(folder)
+
+    rgb_frames = _side_locators(rgb_side)
+    depth_frames = _side_locators(depth_side)
+    if len(rgb_frames) != len(depth_frames):
+        print(f"Warning: {len(rgb_frames)} rgb frames and {len(depth_frames)} depth frames, "
+              f"using the first {min(len(rgb_frames), len(depth_frames))}")
+    count = min(len(rgb_frames), len(depth_frames))
+    return pd.DataFrame({"rgb": rgb_frames[:count], "depth": depth_frames[:count]})
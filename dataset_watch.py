@@ -0,0 +1,143 @@
+import os
+import queue
+import threading
+import pandas as pd
+from dataset_sources import IMAGE_EXTENSIONS
+from dataset_scan import scan_dataset
+from frame_dedup import DEFAULT_THRESHOLD, add_hashes, extend_clusters
+
+# Seconds between two looks at the rgb/ and depth/ folders
+DEFAULT_INTERVAL = 2.0
+# How often the UI collects the pairs found by the watch thread
+WATCH_POLL_MS = 500
+
+
+class FolderWatcher:
+    """
+    Finds new complete pairs in the rgb/ and depth/ folders of a dataset.
+    Folders are only listed when their mtime changes (or some candidate is
+    still being written), known files are never stat'ed again, and a pair is
+    complete once both files exist and their size and mtime didn't change
+    between two polls. New pairs are returned in file name order.
+    """
+
+    def __init__(self, folder, known_paths=()):
+        self.rgb_dir = os.path.join(folder, "rgb")
+        self.depth_dir = os.path.join(folder, "depth")
+        if not (os.path.isdir(self.rgb_dir) and os.path.isdir(self.depth_dir)):
+            raise ValueError(f"Watching needs rgb/ and depth/ image folders in: {folder}")
+        self.known = {os.path.basename(path) for path in known_paths}
+        self.stamps = None
+        self.pending = {}  # name -> (rgb size, rgb mtime, depth size, depth mtime) at the last poll
+
+    def _list(self, directory, names=None):
+        """{name: (size, mtime_ns)} of the unknown image files of a folder"""
+        files = {}
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                name = entry.name
+                if name in self.known or (names is not None and name not in names) \
+                        or not name.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+                try:
+                    if entry.is_file():
+                        st = entry.stat()
+                        files[name] = (st.st_size, st.st_mtime_ns)
+                except OSError:
+                    continue  # Removed or renamed meanwhile
+        return files
+
+    def poll(self):
+        """DataFrame (rgb, depth) of the pairs completed since the last call"""
+        stamps = (os.stat(self.rgb_dir).st_mtime_ns, os.stat(self.depth_dir).st_mtime_ns)
+        if stamps == self.stamps and not self.pending:
+            return pd.DataFrame(columns=["rgb", "depth"])
+        self.stamps = stamps
+
+        rgb_files = self._list(self.rgb_dir)
+        depth_files = self._list(self.depth_dir, rgb_files)
+        ready, pending = [], {}
+        for name in sorted(rgb_files.keys() & depth_files.keys()):
+            stat = rgb_files[name] + depth_files[name]
+            # Empty files are still being created
+            if stat[0] and stat[2] and self.pending.get(name) == stat:
+                ready.append(name)
+            else:
+                pending[name] = stat
+        self.pending = pending
+        self.known.update(ready)
+        return pd.DataFrame({"rgb": [os.path.join(self.rgb_dir, name) for name in ready],
+                             "depth": [os.path.join(self.depth_dir, name) for name in ready]})
+
+
+class DatasetWatcher:
+    """
+    Runs a FolderWatcher in a background thread. New pairs go through
+    prepare (header scan, previews, hashes...) in that same thread and are
+    handed to the UI thread by get().
+    """
+
+    def __init__(self, folder, known_paths=(), prepare=None, interval=DEFAULT_INTERVAL):
+        self.watcher = FolderWatcher(folder, known_paths)
+        self.prepare = prepare
+        self.interval = interval
+        self.results = queue.Queue()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                new_pairs = self.watcher.poll()
+                if len(new_pairs):
+                    if self.prepare is not None:
+                        new_pairs = self.prepare(new_pairs)
+                    self.results.put((new_pairs, None))
+            except Exception as e:
+                self.results.put((None, e))
+
+    def get(self):
+        """(DataFrame of the new pairs found so far or None, list of errors). UI thread only."""
+        batches, errors = [], []
+        while True:
+            try:
+                new_pairs, error = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if error is not None:
+                errors.append(error)
+            else:
+                batches.append(new_pairs)
+        new_pairs = pd.concat(batches, ignore_index=True) if batches else None
+        return new_pairs, errors
+
+    def stop(self):
+        self.stopped.set()
+
+
+def prepare_pairs(new_pairs, loader=None, hash_cache=None):
+    """
+    Background work for new pairs only: header scan, warm previews in the
+    loader's cache and perceptual hashes (with hash_cache, the path of the
+    dataset's hash cache, when duplicate grouping is in use).
+    """
+    new_pairs = scan_dataset(new_pairs)
+    if hash_cache is not None:
+        new_pairs, _ = add_hashes(new_pairs, hash_cache)
+    if loader is not None:
+        # Only the newest pairs fit in the preview cache
+        for path in list(new_pairs["rgb"])[-loader.previews.max_items // 2:]:
+            loader.previews.get(path)
+    return new_pairs
+
+
+def append_pairs(dataset_df, new_pairs, threshold=DEFAULT_THRESHOLD):
+    """
+    Appends new pairs after the existing ones, so existing indices never change.
+    A clustered dataset keeps its clusters and the new pairs are assigned to them.
+    """
+    if "cluster" in dataset_df.columns:
+        return extend_clusters(dataset_df, new_pairs, threshold)
+    return pd.concat([dataset_df, new_pairs], ignore_index=True)
+
@@ -0,0 +1,161 @@
+import argparse
+import json
+import os
+import cv2
+import numpy as np
+from annotation_qa import load_annotation_arrays, fit_translations
+from dataset_scan import read_header
+from dataset_sources import open_dataset, process_context, read_frame, split_locator
+from lens_calibration import CALIBRATION_FILE, load_calibration, undistort
+
+# Offset of the Point Mapping tool sliders at start-up (depth = rgb + offset)
+DEFAULT_OFFSET = (36, -8)
+# Completed dataset indices, one per line, so an interrupted export can resume
+CHECKPOINT_NAME = "registered_depth.done"
+
+
+def register_depth(depth, offset, size=None, dst=None, interpolation=cv2.INTER_NEAREST):
+    """
+    Warps a depth map into the RGB frame of the tool's translation model:
+    out(x, y) = depth(x + dx, y + dy). Pixels without depth become 0, the
+    dtype and channels are kept. size is the (width, height) of the output,
+    dst an optional preallocated output array. Nearest-neighbour by default
+    so depth values are never blended across edges.
+    """
+    dx, dy = offset
+    if size is None:
+        size = (depth.shape[1], depth.shape[0])
+    M = np.float32([[1, 0, dx], [0, 1, dy]])
+    return cv2.warpAffine(depth, M, size, dst=dst, flags=interpolation | cv2.WARP_INVERSE_MAP,
+                          borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+
+
+def pair_offsets(storage):
+    """
+    (dx, dy) of every stored pair: the offset saved with the points, otherwise
+    the translation fitted to its point correspondences. Pairs without either
+    are left out.
+    """
+    offsets = {}
+    fitted = [key for key, entry in storage.items() if entry.get('offset') is None]
+    if fitted:
+        arrays = load_annotation_arrays({key: storage[key] for key in fitted})
+        translations, _ = fit_translations(arrays['rgb'], arrays['depth'])
+        for key, (dx, dy) in zip(arrays['keys'], translations):
+            if np.isfinite(dx) and np.isfinite(dy):
+                offsets[key] = (float(dx), float(dy))
+    for key, entry in storage.items():
+        if entry.get('offset') is not None:
+            offsets[key] = tuple(float(v) for v in entry['offset'])
+    return offsets
+
+
+def output_name(rgb_path):
+    """File name of a registered depth map, after the rgb image (or video frame) it belongs to"""
+    path, frame = split_locator(rgb_path)
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return f"{stem}_{frame:06d}.png" if frame is not None else f"{stem}.png"
+
+
+# Output buffers of the worker process, reused across pairs of the same size
+_buffers = {}
+
+
+def _register_pair(task):
+    index, rgb_path, depth_path, offset, output_path, calibration = task
+    try:
+        depth = read_frame(depth_path, cv2.IMREAD_UNCHANGED)
+        if depth is None:
+            raise IOError(f"Could not read {depth_path}")
+        # Both cameras' distortion is removed first, the offset applies to undistorted images
+        depth = undistort(calibration, "depth", depth)
+        # The output takes the RGB frame's size, which only needs the header
+        width, height = read_header(rgb_path)[:2]
+        key = (height, width) + depth.shape[2:] + (depth.dtype.str,)
+        dst = _buffers.get(key)
+        if dst is None:
+            dst = _buffers[key] = np.empty(key[:-1], dtype=depth.dtype)
+        register_depth(depth, offset, (width, height), dst)
+
+        tmp_path = output_path + ".tmp.png"
+        if not cv2.imwrite(tmp_path, dst):
+            raise IOError(f"Could not write {output_path}")
+        os.replace(tmp_path, output_path)
+        return index, None
+    except Exception as e:
+        return index, str(e)
+
+
+def read_checkpoint(path):
+    try:
+        with open(path, 'r') as f:
+            return {int(line) for line in f if line.strip()}
+    except FileNotFoundError:
+        return set()
+
+
+def export_registered_depth(dataset_df, storage, output_dir, default_offset=None, workers=None,
+                            resume=True, chunksize=8, calibration=None):
+    """
+    Writes the depth map of every pair of the dataset registered to its RGB
+    image, at the original bit depth, using a process pool. Pairs without a
+    stored or fitted offset use default_offset (the median of the fitted ones
+    if None). With a lens calibration the output is aligned to the undistorted
+    RGB image. Returns (exported, skipped, failed).
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    checkpoint_path = os.path.join(output_dir, CHECKPOINT_NAME)
+    done = read_checkpoint(checkpoint_path) if resume else set()
+
+    offsets = pair_offsets(storage)
+    if default_offset is None:
+        default_offset = tuple(np.median(list(offsets.values()), axis=0)) if offsets else DEFAULT_OFFSET
+
+    tasks = ((i, rgb, depth, offsets.get(str(i), default_offset), os.path.join(output_dir, output_name(rgb)),
+              calibration)
+             for i, (rgb, depth) in enumerate(zip(dataset_df['rgb'], dataset_df['depth']))
+             if i not in done)
+
+    exported = failed = 0
+    with open(checkpoint_path, 'a' if resume else 'w') as checkpoint, \
+            process_context().Pool(processes=workers) as pool:
+        for index, error in pool.imap_unordered(_register_pair, tasks, chunksize=chunksize):
+            if error is not None:
+                print(f"Warning: pair {index} not exported: {error}")
+                failed += 1
+                continue
+            checkpoint.write(f"{index}\n")
+            checkpoint.flush()
+            exported += 1
+    return exported, len(done), failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export depth maps registered to their RGB images")
+    parser.add_argument("dataset", help="Dataset root folder")
+    parser.add_argument("--points", default="labeled_points.json",
+                        help="Labeled points with the stored or fitted offset of each pair")
+    parser.add_argument("-o", "--output", default="registered_depth")
+    parser.add_argument("--offset", type=float, nargs=2, metavar=("DX", "DY"), default=None,
+                        help="Offset of pairs without points (default: median of the fitted offsets)")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and export every pair")
+    parser.add_argument("--calibration", default=CALIBRATION_FILE,
+                        help="Lens calibration, the output is then aligned to the undistorted RGB images")
+    args = parser.parse_args()
+
+    try:
+        with open(args.points, 'r') as f:
+            storage = json.load(f)
+    except FileNotFoundError:
+        storage = {}
+
+    exported, skipped, failed = export_registered_depth(open_dataset(args.dataset), storage, args.output,
+                                                        args.offset, args.workers, not args.restart,
+                                                        calibration=load_calibration(args.calibration))
+    print(f"Exported {exported} registered depth maps to {args.output} "
+          f"({skipped} already done, {failed} failed)")
+
+
+if __name__ == "__main__":
+    main()
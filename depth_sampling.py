@@ -0,0 +1,228 @@
+import argparse
+import csv
+import json
+import os
+import shutil
+import tempfile
+import warnings
+import cv2
+import numpy as np
+from dataset_sources import process_context, read_frame
+from lens_calibration import CALIBRATION_FILE, load_calibration, undistort
+
+# Intrinsics of the depth camera. cx/cy default to the image centre when None.
+# depth_scale converts raw depth units to metres (0.001 for millimetre maps).
+DEFAULT_INTRINSICS = {
+    "fx": 615.0,
+    "fy": 615.0,
+    "cx": None,
+    "cy": None,
+    "depth_scale": 0.001,
+}
+
+# Half size of the neighbourhood used for the median depth (2 -> 5x5 window)
+DEFAULT_RADIUS = 2
+
+EXPORT_COLUMNS = ["key", "point", "rgb_file", "u", "v",
+                  "depth_bilinear", "depth_median", "x", "y", "z"]
+
+
+def load_intrinsics(path=None):
+    """Reads camera intrinsics from a JSON file, falling back to the defaults"""
+    intrinsics = dict(DEFAULT_INTRINSICS)
+    if path and os.path.exists(path):
+        with open(path, 'r') as f:
+            intrinsics.update(json.load(f))
+    return intrinsics
+
+
+def to_depth_channel(depth):
+    """Returns the raw depth as a single float32 channel"""
+    if depth.ndim == 3:
+        # Depth maps saved as 3 identical channels, keep the first one
+        depth = depth[:, :, 0]
+    return depth.astype(np.float32, copy=False)
+
+
+def sample_bilinear(depth, points):
+    """
+    Bilinear depth at sub-pixel positions. Invalid (zero) neighbours are left
+    out of the weighting so holes don't pull the value towards zero.
+    """
+    depth = to_depth_channel(depth)
+    h, w = depth.shape
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    u = np.clip(points[:, 0], 0, w - 1)
+    v = np.clip(points[:, 1], 0, h - 1)
+
+    x0 = np.floor(u).astype(np.int64)
+    y0 = np.floor(v).astype(np.int64)
+    x1 = np.minimum(x0 + 1, w - 1)
+    y1 = np.minimum(y0 + 1, h - 1)
+    fx = u - x0
+    fy = v - y0
+
+    values = np.stack([depth[y0, x0], depth[y0, x1], depth[y1, x0], depth[y1, x1]], axis=1)
+    weights = np.stack([(1 - fx) * (1 - fy), fx * (1 - fy), (1 - fx) * fy, fx * fy], axis=1)
+    weights = np.where(values > 0, weights, 0.0)
+    total = weights.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        result = (values * weights).sum(axis=1) / total
+    result[total == 0] = np.nan
+
+    outside = (points[:, 0] < 0) | (points[:, 0] > w - 1) | (points[:, 1] < 0) | (points[:, 1] > h - 1)
+    result[outside] = np.nan
+    return result
+
+
+def sample_median(depth, points, radius=DEFAULT_RADIUS):
+    """Median of the valid depth values in a (2r+1)x(2r+1) window around each point"""
+    depth = to_depth_channel(depth)
+    h, w = depth.shape
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    cols = np.rint(points[:, 0]).astype(np.int64)
+    rows = np.rint(points[:, 1]).astype(np.int64)
+
+    offsets = np.arange(-radius, radius + 1)
+    window_rows = rows[:, None, None] + offsets[None, :, None]
+    window_cols = cols[:, None, None] + offsets[None, None, :]
+    inside = (window_rows >= 0) & (window_rows < h) & (window_cols >= 0) & (window_cols < w)
+
+    patches = depth[np.clip(window_rows, 0, h - 1), np.clip(window_cols, 0, w - 1)]
+    patches = np.where(inside & (patches > 0), patches, np.nan).reshape(len(points), -1)
+    with warnings.catch_warnings():
+        # Windows made only of holes give NaN
+        warnings.simplefilter("ignore", RuntimeWarning)
+        return np.nanmedian(patches, axis=1)
+
+
+def back_project(points, depth_values, intrinsics, image_shape):
+    """Pixel coordinates + raw depth -> camera-space XYZ in metres, shape (n, 3)"""
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    h, w = image_shape[:2]
+    cx = intrinsics["cx"] if intrinsics.get("cx") is not None else (w - 1) / 2.0
+    cy = intrinsics["cy"] if intrinsics.get("cy") is not None else (h - 1) / 2.0
+
+    z = np.asarray(depth_values, dtype=np.float64) * intrinsics["depth_scale"]
+    x = (points[:, 0] - cx) * z / intrinsics["fx"]
+    y = (points[:, 1] - cy) * z / intrinsics["fy"]
+    return np.column_stack([x, y, z])
+
+
+def sample_landmarks(depth, points, intrinsics, radius=DEFAULT_RADIUS):
+    """
+    Samples every point once with both methods and back-projects the median
+    depth. Returns (bilinear, median, xyz).
+    """
+    bilinear = sample_bilinear(depth, points)
+    median = sample_median(depth, points, radius)
+    xyz = back_project(points, median, intrinsics, depth.shape)
+    return bilinear, median, xyz
+
+
+def _sample_entry(task):
+    key, entry, intrinsics, radius, calibration = task
+    points = entry.get('depth_points') or []
+    depth_path = entry.get('image_paths', {}).get('depth')
+    if not points or not depth_path:
+        return key, entry, None, "no depth points"
+
+    depth = read_frame(depth_path, cv2.IMREAD_UNCHANGED)
+    if depth is None:
+        return key, entry, None, f"could not read {depth_path}"
+    if entry.get('undistorted'):
+        # The points were placed on undistorted images
+        depth = undistort(calibration, "depth", depth)
+
+    return key, entry, sample_landmarks(depth, points, intrinsics, radius), None
+
+
+def iter_landmarks(storage, intrinsics, radius=DEFAULT_RADIUS, workers=None, chunksize=16, calibration=None):
+    """
+    Samples all stored images in a process pool and yields one row dict per
+    depth point, plus a list of (key, reason) for images that were skipped.
+    """
+    tasks = ((key, entry, intrinsics, radius, calibration) for key, entry in storage.items())
+    skipped = []
+    with process_context().Pool(processes=workers) as pool:
+        for key, entry, result, error in pool.imap_unordered(_sample_entry, tasks, chunksize=chunksize):
+            if error:
+                skipped.append((key, error))
+                continue
+            bilinear, median, xyz = result
+            rgb_file = os.path.basename(str(entry.get('image_paths', {}).get('rgb', '')))
+            for i, (u, v) in enumerate(entry['depth_points']):
+                yield {
+                    "key": key, "point": i + 1, "rgb_file": rgb_file, "u": u, "v": v,
+                    "depth_bilinear": bilinear[i], "depth_median": median[i],
+                    "x": xyz[i, 0], "y": xyz[i, 1], "z": xyz[i, 2],
+                }
+    for key, reason in skipped:
+        print(f"Warning: skipped image {key}: {reason}")
+
+
+def export_csv(rows, path):
+    count = 0
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=EXPORT_COLUMNS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+def export_ply(rows, path):
+    """ASCII PLY point cloud of every landmark with a valid depth"""
+    count = 0
+    # The vertex count goes in the header, so stream the body to a temporary file first
+    with tempfile.TemporaryFile('w+') as body:
+        for row in rows:
+            if not np.isfinite(row["z"]) or row["z"] <= 0:
+                continue
+            # Dataset index of the image, -1 for keys that aren't one (merged files keyed by path)
+            image = int(row['key']) if str(row['key']).isdigit() else -1
+            body.write(f"{row['x']:.6f} {row['y']:.6f} {row['z']:.6f} {image} {row['point']}\n")
+            count += 1
+        body.seek(0)
+        with open(path, 'w') as f:
+            f.write("ply\nformat ascii 1.0\n")
+            f.write(f"element vertex {count}\n")
+            f.write("property float x\nproperty float y\nproperty float z\n")
+            f.write("property int image\nproperty int point\nend_header\n")
+            shutil.copyfileobj(body, f)
+    return count
+
+
+def export_landmarks(storage, path, intrinsics, radius=DEFAULT_RADIUS, workers=None, calibration=None):
+    """Writes the 3D landmarks of the whole store to a .csv or .ply file"""
+    rows = iter_landmarks(storage, intrinsics, radius, workers, calibration=calibration)
+    if path.lower().endswith(".ply"):
+        return export_ply(rows, path)
+    return export_csv(rows, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export depth and 3D position of labeled points")
+    parser.add_argument("json_file", nargs="?", default="labeled_points.json")
+    parser.add_argument("-o", "--output", default="landmarks_3d.csv",
+                        help="Output file, .csv or .ply")
+    parser.add_argument("--intrinsics", default="camera_intrinsics.json",
+                        help="JSON file with fx, fy, cx, cy and depth_scale")
+    parser.add_argument("--radius", type=int, default=DEFAULT_RADIUS,
+                        help="Half size of the median window")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--calibration", default=CALIBRATION_FILE,
+                        help="Lens calibration for points placed on undistorted images")
+    args = parser.parse_args()
+
+    with open(args.json_file, 'r') as f:
+        storage = json.load(f)
+
+    count = export_landmarks(storage, args.output, load_intrinsics(args.intrinsics),
+                             args.radius, args.workers, load_calibration(args.calibration))
+    print(f"Exported {count} points to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+import argparse
+import csv
+import json
+import os
+import threading
+from collections import OrderedDict
+import cv2
+import numpy as np
+from dataset_sources import frame_mtime, process_context, read_frame
+from depth_sampling import to_depth_channel
+from lens_calibration import CALIBRATION_FILE, load_calibration, undistort
+
+# Relative depth jump within a 3x3 neighbourhood above which a pixel counts as an
+# edge (mixed/flying pixels at depth discontinuities). 0 or None keeps edges.
+DEFAULT_EDGE_JUMP = 0.1
+# Farthest (pixels) a depth point is moved to reach a valid pixel
+DEFAULT_MAX_SNAP = 10.0
+DEFAULT_CACHE_SIZE = 16
+
+AUDIT_COLUMNS = ["key", "point", "rgb_file", "u", "v", "valid", "distance", "snap_u", "snap_v"]
+
+
+class DepthValidity:
+    """
+    Invalid-pixel mask of a depth map (holes and, optionally, edges) with a
+    distance transform that also records the nearest valid pixel of every
+    pixel, so checking or snapping a point is a table lookup.
+    """
+
+    def __init__(self, depth, edge_jump=DEFAULT_EDGE_JUMP):
+        depth = to_depth_channel(depth)
+        invalid = ~(depth > 0)
+        if edge_jump:
+            kernel = np.ones((3, 3), np.uint8)
+            # Holes are left out of the neighbourhood range, they are invalid already
+            high = cv2.dilate(np.where(invalid, 0, depth).astype(np.float32), kernel)
+            low = cv2.erode(np.where(invalid, np.inf, depth).astype(np.float32), kernel)
+            with np.errstate(invalid='ignore'):
+                invalid |= (high - low) > edge_jump * depth
+        self.invalid = invalid
+        self.height, self.width = invalid.shape
+
+        ys, xs = np.nonzero(~invalid)
+        if not len(xs):
+            self.distance = np.full(invalid.shape, np.inf, dtype=np.float32)
+            self.labels = self.lookup = None
+            return
+        # Distance to (and label of) the nearest zero pixel of the source: the valid ones
+        self.distance, self.labels = cv2.distanceTransformWithLabels(
+            invalid.astype(np.uint8), cv2.DIST_L2, cv2.DIST_MASK_5, labelType=cv2.DIST_LABEL_PIXEL)
+        # Label -> (x, y) of the valid pixel it was given to
+        self.lookup = np.zeros((int(self.labels.max()) + 1, 2), dtype=np.int64)
+        self.lookup[self.labels[ys, xs]] = np.column_stack([xs, ys])
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in (self.invalid, self.distance, self.labels, self.lookup)
+                   if array is not None)
+
+    def _pixels(self, points):
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        cols = np.clip(np.rint(points[:, 0]), 0, self.width - 1).astype(np.int64)
+        rows = np.clip(np.rint(points[:, 1]), 0, self.height - 1).astype(np.int64)
+        # Distance of points outside the image to its border
+        outside = np.hypot(points[:, 0] - np.clip(points[:, 0], 0, self.width - 1),
+                           points[:, 1] - np.clip(points[:, 1], 0, self.height - 1))
+        return points, cols, rows, outside
+
+    def check(self, points):
+        """(valid, distance to the nearest valid pixel) of every point, points outside the image are invalid"""
+        points, cols, rows, outside = self._pixels(points)
+        valid = ~self.invalid[rows, cols] & (outside == 0)
+        distance = np.where(valid, 0.0, self.distance[rows, cols] + outside)
+        return valid, distance
+
+    def snap(self, points, max_distance=DEFAULT_MAX_SNAP):
+        """
+        Moves every invalid point to its nearest valid pixel when that is within
+        max_distance. Returns the (N, 2) points and a mask of the ones moved.
+        """
+        points, cols, rows, _ = self._pixels(points)
+        valid, distance = self.check(points)
+        moved = ~valid & (distance <= max_distance)
+        snapped = points.copy()
+        if self.lookup is not None and moved.any():
+            snapped[moved] = self.lookup[self.labels[rows[moved], cols[moved]]]
+        return snapped, moved
+
+
+class ValidityCache:
+    """Thread-safe LRU cache of DepthValidity per depth frame, keyed by path and mtime"""
+
+    def __init__(self, max_items=DEFAULT_CACHE_SIZE, edge_jump=DEFAULT_EDGE_JUMP):
+        self.max_items = max_items
+        self.edge_jump = edge_jump
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, path, depth):
+        """Validity of the frame at path, built from depth (as displayed) the first time"""
+        try:
+            key = (path, frame_mtime(path))
+        except OSError:
+            key = (path, None)
+        with self.lock:
+            if key in self.items:
+                self.items.move_to_end(key)
+                return self.items[key]
+
+        validity = DepthValidity(depth, self.edge_jump)
+        with self.lock:
+            self.items[key] = validity
+            while len(self.items) > self.max_items:
+                self.items.popitem(last=False)
+        return validity
+
+    def memory_usage(self):
+        with self.lock:
+            return sum(validity.nbytes for validity in self.items.values())
+
+    def release_memory(self, target):
+        """Drops the least recently used masks until at most target bytes are held"""
+        with self.lock:
+            used = sum(validity.nbytes for validity in self.items.values())
+            while self.items and used > target:
+                _, validity = self.items.popitem(last=False)
+                used -= validity.nbytes
+
+
+def _audit_entry(task):
+    key, entry, edge_jump, max_distance, calibration = task
+    points = entry.get('depth_points') or []
+    depth_path = entry.get('image_paths', {}).get('depth')
+    if not points or not depth_path:
+        return key, entry, None, "no depth points"
+
+    depth = read_frame(depth_path, cv2.IMREAD_UNCHANGED)
+    if depth is None:
+        return key, entry, None, f"could not read {depth_path}"
+    if entry.get('undistorted'):
+        depth = undistort(calibration, "depth", depth)
+
+    validity = DepthValidity(depth, edge_jump)
+    valid, distance = validity.check(points)
+    snapped, _ = validity.snap(points, max_distance)
+    return key, entry, (valid, distance, snapped), None
+
+
+def audit_store(storage, edge_jump=DEFAULT_EDGE_JUMP, max_distance=DEFAULT_MAX_SNAP, workers=None,
+                chunksize=16, calibration=None):
+    """
+    Checks the depth points of every stored image in a process pool. Yields
+    (key, entry, valid, distance, snapped) per image with depth points and
+    prints the images that were skipped.
+    """
+    tasks = ((key, entry, edge_jump, max_distance, calibration) for key, entry in storage.items())
+    skipped = []
+    with process_context().Pool(processes=workers) as pool:
+        for key, entry, result, error in pool.imap_unordered(_audit_entry, tasks, chunksize=chunksize):
+            if error:
+                skipped.append((key, error))
+                continue
+            yield (key, entry) + result
+    for key, reason in skipped:
+        print(f"Warning: skipped image {key}: {reason}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that depth points land on valid depth pixels")
+    parser.add_argument("json_file", nargs="?", default="labeled_points.json")
+    parser.add_argument("-o", "--output", default="depth_audit.csv")
+    parser.add_argument("--edge-jump", type=float, default=DEFAULT_EDGE_JUMP,
+                        help="Relative 3x3 depth jump that marks an edge pixel as invalid (0 keeps edges)")
+    parser.add_argument("--max-snap", type=float, default=DEFAULT_MAX_SNAP,
+                        help="Farthest distance in pixels an invalid point is snapped")
+    parser.add_argument("--snapped", help="Also write a copy of the points file with invalid points snapped")
+    parser.add_argument("--all", action="store_true", help="Also list valid points")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--calibration", default=CALIBRATION_FILE,
+                        help="Lens calibration for points placed on undistorted images")
+    args = parser.parse_args()
+
+    with open(args.json_file, 'r') as f:
+        storage = json.load(f)
+
+    checked = invalid = snapped_count = 0
+    with open(args.output, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=AUDIT_COLUMNS)
+        writer.writeheader()
+        for key, entry, valid, distance, snapped in audit_store(storage, args.edge_jump, args.max_snap,
+                                                                args.workers,
+                                                                calibration=load_calibration(args.calibration)):
+            rgb_file = os.path.basename(str(entry.get('image_paths', {}).get('rgb', '')))
+            checked += len(valid)
+            invalid += int((~valid).sum())
+            for i, (u, v) in enumerate(entry['depth_points']):
+                if valid[i] and not args.all:
+                    continue
+                writer.writerow({"key": key, "point": i + 1, "rgb_file": rgb_file, "u": u, "v": v,
+                                 "valid": bool(valid[i]), "distance": f"{distance[i]:.2f}",
+                                 "snap_u": int(snapped[i, 0]), "snap_v": int(snapped[i, 1])})
+            if args.snapped and not valid.all():
+                moved = [(int(round(x)), int(round(y))) for x, y in snapped]
+                snapped_count += sum(tuple(p) != tuple(m) for p, m in zip(entry['depth_points'], moved))
+                storage[key] = dict(entry, depth_points=moved)
+
+    print(f"Checked {checked} depth points, {invalid} on invalid depth. Report written to {args.output}")
+    if args.snapped:
+        with open(args.snapped, 'w') as f:
+            json.dump(storage, f, indent=4)
+        print(f"Snapped {snapped_count} points, written to {args.snapped}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+import argparse
+import copy
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import numpy as np
+import pandas as pd
+from dataset_sources import frame_mtime, open_dataset, process_context, read_frame
+
+# Side of the downscaled image the DCT is computed on, the hash uses its 8x8 low frequencies
+HASH_INPUT = 32
+# Largest Hamming distance (of 63 bits) between a cluster's representative and its members
+DEFAULT_THRESHOLD = 10
+# Hash cache written next to the dataset, {locator: [mtime, hash]}
+CACHE_NAME = ".phash_cache.json"
+
+
+def phash(image):
+    """DCT perceptual hash of an image as a 63-bit int (the DC term is left out)"""
+    gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (HASH_INPUT, HASH_INPUT), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].ravel()[1:]
+    bits = (low > np.median(low)).astype(np.uint64)
+    return int((bits << np.arange(len(bits), dtype=np.uint64)).sum())
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+def _hash_path(path):
+    try:
+        # Reduced decoding is enough for a 32x32 input
+        image = read_frame(path, cv2.IMREAD_REDUCED_COLOR_8)
+        return None if image is None else phash(image)
+    except Exception as e:
+        print(f"Warning: could not hash {path}: {e}")
+        return None
+
+
+def load_cache(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_cache(cache, path):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(cache, f)
+    os.replace(tmp_path, path)
+
+
+def compute_hashes(dataset_df, cache_path=None, workers=None, chunksize=64):
+    """
+    pHash of every rgb image in a process pool. Hashes of unchanged files are
+    taken from the cache file. Returns a list with None for unreadable images.
+    """
+    cache = load_cache(cache_path) if cache_path else {}
+    paths = list(dataset_df['rgb'])
+    hashes = [None] * len(paths)
+    mtimes = {}
+    missing = []
+    for i, path in enumerate(paths):
+        try:
+            mtimes[path] = frame_mtime(path)
+        except OSError:
+            continue
+        cached = cache.get(path)
+        if cached is not None and cached[0] == mtimes[path]:
+            hashes[i] = cached[1]
+        else:
+            missing.append(i)
+
+    if missing:
+        missing_paths = [paths[i] for i in missing]
+        if len(missing) < chunksize:
+            results = [_hash_path(path) for path in missing_paths]
+        else:
+            with ProcessPoolExecutor(max_workers=workers or os.cpu_count(),
+                                     mp_context=process_context()) as executor:
+                results = list(executor.map(_hash_path, missing_paths, chunksize=chunksize))
+        for i, value in zip(missing, results):
+            hashes[i] = value
+            if value is not None:
+                cache[paths[i]] = [mtimes[paths[i]], value]
+        if cache_path:
+            save_cache(cache, cache_path)
+    return hashes
+
+
+class BKTree:
+    """Burkhard-Keller tree over hashes for Hamming-radius queries"""
+
+    def __init__(self):
+        self.root = None  # Node: [hash, [indices], {distance: child}]
+
+    def add(self, value, index):
+        if self.root is None:
+            self.root = [value, [index], {}]
+            return
+        node = self.root
+        while True:
+            d = hamming(value, node[0])
+            if d == 0:
+                node[1].append(index)
+                return
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [value, [index], {}]
+                return
+            node = child
+
+    def search(self, value, radius):
+        """Indices of every hash within radius of value"""
+        found = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            d = hamming(value, node[0])
+            if d <= radius:
+                found.extend(node[1])
+            # Triangle inequality: only children at distance d +- radius can match
+            stack.extend(child for dist, child in node[2].items() if d - radius <= dist <= d + radius)
+        return found
+
+
+def cluster_hashes(hashes, threshold=DEFAULT_THRESHOLD):
+    """
+    Groups near-duplicates in dataset order: the first unassigned image becomes
+    a representative and takes every unassigned image within threshold of it.
+    Returns the representative index of every image (unhashed images are their own).
+    """
+    tree = BKTree()
+    for i, value in enumerate(hashes):
+        if value is not None:
+            tree.add(value, i)
+
+    labels = np.full(len(hashes), -1, dtype=np.int64)
+    for i, value in enumerate(hashes):
+        if labels[i] >= 0:
+            continue
+        labels[i] = i
+        if value is None:
+            continue
+        members = np.array(tree.search(value, threshold), dtype=np.int64)
+        members = members[labels[members] < 0]
+        labels[members] = i
+    return labels
+
+
+def add_hashes(dataset_df, cache_path=None, workers=None):
+    """Copy of dataset_df with a 'phash' column (hex, empty for unreadable images) and the int hashes"""
+    hashes = compute_hashes(dataset_df, cache_path, workers)
+    result = dataset_df.copy()
+    result['phash'] = [f"{h:016x}" if h is not None else "" for h in hashes]
+    return result, hashes
+
+
+def find_duplicates(dataset_df, threshold=DEFAULT_THRESHOLD, cache_path=None, workers=None):
+    """Copy of dataset_df with 'phash' and 'cluster' (index of the representative) columns"""
+    result, hashes = add_hashes(dataset_df, cache_path, workers)
+    result['cluster'] = cluster_hashes(hashes, threshold)
+    return result
+
+
+def extend_clusters(dataset_df, new_df, threshold=DEFAULT_THRESHOLD):
+    """
+    Appends new_df to a clustered dataset_df without touching the existing
+    clusters: every new image joins the lowest representative within threshold
+    or becomes a representative itself. Images of new_df without a 'phash'
+    are their own representative.
+    """
+    clusters = dataset_df['cluster'].to_numpy()
+    tree = BKTree()
+    for i in np.flatnonzero(clusters == np.arange(len(dataset_df))):
+        if dataset_df['phash'].iat[i]:
+            tree.add(int(dataset_df['phash'].iat[i], 16), int(i))
+
+    hashes = new_df['phash'] if 'phash' in new_df.columns else [""] * len(new_df)
+    new_clusters = []
+    for index, value in enumerate(hashes, start=len(dataset_df)):
+        members = tree.search(int(value, 16), threshold) if value else []
+        if members:
+            new_clusters.append(min(members))
+            continue
+        new_clusters.append(index)
+        if value:
+            tree.add(int(value, 16), index)
+    new_df = new_df.assign(phash=list(hashes), cluster=new_clusters)
+    return pd.concat([dataset_df, new_df], ignore_index=True)
+
+
+def copy_to_cluster(storage, dataset_df, index):
+    """
+    Copies the entry of image 'index' to the other images of its cluster that
+    have no points yet, marked with 'copied_from'. Returns the keys written.
+    """
+    entry = storage.get(str(index))
+    if not entry or 'cluster' not in dataset_df.columns:
+        return []
+    clusters = dataset_df['cluster'].to_numpy()
+    written = []
+    for member in np.flatnonzero(clusters == clusters[index]):
+        key = str(member)
+        if member == index or storage.get(key):
+            continue
+        copied = copy.deepcopy(entry)
+        copied['copied_from'] = str(index)
+        if 'image_paths' in copied:
+            copied['image_paths'] = {'rgb': dataset_df.iloc[member]['rgb'],
+                                     'depth': dataset_df.iloc[member]['depth']}
+        storage[key] = copied
+        written.append(key)
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cluster near-duplicate frames with perceptual hashes")
+    parser.add_argument("dataset", help="Dataset root folder")
+    parser.add_argument("-o", "--output", default="duplicates.csv")
+    parser.add_argument("--threshold", type=int, default=DEFAULT_THRESHOLD,
+                        help="Max Hamming distance (of 63 bits) to the cluster representative")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    result = find_duplicates(open_dataset(args.dataset), args.threshold,
+                             os.path.join(args.dataset, CACHE_NAME), args.workers)
+    result.to_csv(args.output, index_label="index")
+    clusters = result['cluster'].nunique()
+    print(f"{len(result)} pairs in {clusters} clusters, {len(result) - clusters} near-duplicates. "
+          f"Written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,18 @@
+import mmap
+import cv2
+import numpy as np
+
+
+def read_image(path, flags=cv2.IMREAD_UNCHANGED):
+    """
+    Decodes an image straight from a memory-mapped view of the file.
+    Avoids an intermediate copy of the encoded bytes and, unlike cv2.imread,
+    works with non-ASCII paths on Windows. Returns None if the file can't be decoded.
+    """
+    try:
+        with open(path, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return cv2.imdecode(np.frombuffer(mm, dtype=np.uint8), flags)
+    except (OSError, ValueError):
+        # Empty files can't be mapped, missing files can't be opened
+        return None
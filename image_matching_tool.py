@@ -1,12 +1,23 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
-from tkinter import filedialog
-from PIL import Image, ImageTk
+from tkinter import filedialog, simpledialog
 import cv2
-import numpy as np
 import os
-import pandas as pd
 import json
+import queue
+import threading
+from annotation_client import AnnotationClient
+from annotation_core import (AnnotationStore, OffsetTransform, DEFAULT_OVERLAY_OFFSET, load_pairs, prefetch_paths,
+                             find_image, render_overlay, normalize_path)
+from progressive_loading import ProgressiveLoader, POLL_INTERVAL_MS
+from dataset_watch import DatasetWatcher, prepare_pairs, append_pairs, WATCH_POLL_MS
+from dataset_scan import navigable_mask, find_next_index
+from point_editing import PointLayer
+from image_viewer import ZoomableView
+from lens_calibration import load_calibration
+from session_telemetry import TelemetryLog, telemetry_path, IMAGE_ID_COMPONENTS
+from memory_budget import governor, PRIORITY_PREVIEWS, PRIORITY_MAPS, PRIORITY_VIEW
+from frame_dedup import find_duplicates, CACHE_NAME
 
 class ScrollableFrame(ttk.Frame):
     def __init__(self, container, *args, **kwargs):
@@ -28,43 +39,6 @@ class ScrollableFrame(ttk.Frame):
         scrollbar_h.pack(side="bottom", fill="x")
         canvas.pack(side="left", fill="both", expand=True)
 
-# Add create_dataset_df function here (same as in point_matching_tool.py)
-def create_dataset_df(main_path):
-    """
-    Recibe el directorio principal del dataset y retorna un DataFrame
-    con las rutas de las imágenes rgb y su correspondiente imagen de profundidad.
-    """
-    # Directorios de imágenes rgb y depth
-    rgb_dir = os.path.join(main_path, "rgb")
-    depth_dir = os.path.join(main_path, "depth")
-    
-    # Verificar que los directorios existan
-    if not os.path.exists(rgb_dir):
-        raise FileNotFoundError(f"No se encontró el directorio: {rgb_dir}")
-    if not os.path.exists(depth_dir):
-        raise FileNotFoundError(f"No se encontró el directorio: {depth_dir}")
-    
-    # Obtener la lista de archivos en la carpeta rgb
-    rgb_files = os.listdir(rgb_dir)
-    
-    # Crear una lista para almacenar las rutas correspondientes de cada imagen
-    data = []
-    for file in rgb_files:
-        rgb_image_path = os.path.join(rgb_dir, file)
-        depth_image_path = os.path.join(depth_dir, file)
-        
-        # Verificar que la imagen de profundidad exista
-        if os.path.exists(depth_image_path):
-            data.append({
-                "rgb": rgb_image_path,
-                "depth": depth_image_path
-            })
-        else:
-            print(f"Warning: No se encontró la imagen de profundidad para: {file}")
-    
-    # Crear el DataFrame
-    df = pd.DataFrame(data)
-    return df
  
 
 class ObesityAnalyzerApp:
@@ -114,7 +88,7 @@ class ObesityAnalyzerApp:
             self.x_offset_label.pack(side=tk.LEFT)
             
             self.x_offset_slider = ttk.Scale(self.x_offset_frame, from_=-100, to=100, orient="horizontal")
-            self.x_offset_slider.set(-36)  # Initial value X = -36
+            self.x_offset_slider.set(DEFAULT_OVERLAY_OFFSET[0])
             self.x_offset_slider.pack(side=tk.LEFT, padx=5)
             
             # Variable to sync entry with slider
@@ -132,7 +106,7 @@ class ObesityAnalyzerApp:
             self.y_offset_label.pack(side=tk.LEFT)
             
             self.y_offset_slider = ttk.Scale(self.y_offset_frame, from_=-100, to=100, orient="horizontal")
-            self.y_offset_slider.set(0)
+            self.y_offset_slider.set(DEFAULT_OVERLAY_OFFSET[1])
             self.y_offset_slider.pack(side=tk.LEFT, padx=5)
             
             # Variable to sync entry with slider
@@ -152,9 +126,32 @@ class ObesityAnalyzerApp:
             self.points = []
             self.lines = []  # New list for storing lines
             self.canvas = None
+            self.point_layer = None  # Canvas items of the points, created with the canvas
+
+            # Point being dragged and whether it actually moved
+            self.drag_index = None
+            self.drag_moved = False
             self.rgb_image_cv = None
             self.depth_image_cv = None
-            self.current_image_tk = None
+
+            # Images on screen: a reduced preview while the full-resolution pair loads.
+            # Points are always kept in full-resolution coordinates, canvas = image * view zoom
+            self.rgb_display_cv = None
+            self.depth_display_cv = None
+            self.display_scale = 1.0
+            # Optional lens calibration, images are shown undistorted
+            self.loader = ProgressiveLoader(calibration=load_calibration())
+            self.full_image_poll = None
+            # Opt-in timing of clicks, edits and navigation (ANNOTATION_TELEMETRY), no-op when off
+            self.telemetry = TelemetryLog(telemetry_path(), "image_overlay")
+
+            # Caches and images on screen count against the memory budget shared by both tools
+            self.memory = governor()
+            self.memory.register("image overlay previews", self.loader.previews, PRIORITY_PREVIEWS)
+            for side, camera in (self.loader.calibration or {}).items():
+                self.memory.register(f"image overlay {side} remap tables", camera, PRIORITY_MAPS)
+            self.memory.track("image overlay images", lambda: [self.rgb_image_cv, self.depth_image_cv,
+                                                               self.rgb_display_cv, self.depth_display_cv])
 
             # Add clear points button after other buttons
             self.clear_button = ttk.Button(self.button_frame, text="Clear Points", command=self.clear_points)
@@ -162,13 +159,18 @@ class ObesityAnalyzerApp:
 
             # Add dataset variables
             self.dataset_df = None
+            self.dataset_folder = None
+            self.dataset_loading = False  # Scan of a new dataset running
             self.current_index = -1
+            # Background watcher of the dataset folders, None when not watching
+            self.dataset_watcher = None
+            self.watch_poll = None
             
             # Add dataset controls after the button frame
             self.add_dataset_controls()
 
-            # Add storage for points per image
-            self.points_storage = {}  # Solo para la sesión actual
+            # Points per image, kept for the session only or, once connected, on the annotation server
+            self.store = AnnotationStore(server_field='overlay_points')
             
         except Exception as e:
             self.show_error("Error initializing application", str(e))
@@ -191,16 +193,69 @@ class ObesityAnalyzerApp:
                                  command=self.next_image, state=tk.DISABLED)
         self.btn_next.pack(side=tk.LEFT, padx=5)
 
+        # Skip pairs the header scan found unreadable or mismatched
+        self.skip_invalid_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(dataset_frame, text="Skip bad pairs", variable=self.skip_invalid_var,
+                        command=self.update_navigation_buttons).pack(side=tk.LEFT, padx=5)
+
+        # Only stop at one image per group of near-duplicate frames
+        self.representatives_var = tk.BooleanVar(value=False)
+        self.representatives_check = ttk.Checkbutton(dataset_frame, text="One per duplicate group",
+                                                     variable=self.representatives_var,
+                                                     command=self.toggle_representatives)
+        self.representatives_check.pack(side=tk.LEFT, padx=5)
+
+        # Append pairs written to rgb/ and depth/ after loading (live capture)
+        self.watch_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(dataset_frame, text="Watch for new pairs", variable=self.watch_var,
+                        command=self.toggle_watch).pack(side=tk.LEFT, padx=5)
+
+        # Shared annotation server
+        self.btn_server = ttk.Button(dataset_frame, text="Connect Server",
+                                   command=self.connect_to_server)
+        self.btn_server.pack(side=tk.LEFT, padx=5)
+
         # Current image label
         self.current_image_label = ttk.Label(dataset_frame, text="No dataset loaded")
         self.current_image_label.pack(side=tk.LEFT, padx=5)
 
+        # Memory use of the caches, click for the breakdown
+        self.memory_label = ttk.Label(dataset_frame, text=self.memory.status(), cursor="hand2")
+        self.memory_label.pack(side=tk.LEFT, padx=5)
+        self.memory_label.bind("<Button-1>", lambda e: self.show_memory_dump())
+
     def show_error(self, title, message):
         messagebox.showerror(title, message)
 
     def show_warning(self, title, message):
         messagebox.showwarning(title, message)
 
+    def run_in_background(self, task, on_done, error_title, on_error=None):
+        """Runs task in a worker thread and calls on_done(result) back on the Tk thread"""
+        results = queue.Queue()
+
+        def worker():
+            try:
+                results.put((True, task()))
+            except Exception as e:
+                results.put((False, e))
+
+        def poll():
+            try:
+                ok, value = results.get_nowait()
+            except queue.Empty:
+                self.master.after(100, poll)
+                return
+            if ok:
+                on_done(value)
+            else:
+                if on_error:
+                    on_error()
+                self.show_error(error_title, str(value))
+
+        threading.Thread(target=worker, daemon=True).start()
+        self.master.after(100, poll)
+
     def load_rgb_image(self):
         try:
             path = filedialog.askopenfilename(filetypes=[("Images", "*.png;*.jpg")])
@@ -211,8 +266,7 @@ class ObesityAnalyzerApp:
                 self.rgb_image_cv = cv2.imread(path, cv2.IMREAD_UNCHANGED)
                 if self.rgb_image_cv is None:
                     raise IOError("Could not load the image. The file may be corrupted or in an unsupported format.")
-                self.create_or_update_canvas()
-                self.update_overlay()
+                self.show_full_images()
         except Exception as e:
             self.show_error("Error loading RGB image", str(e))
 
@@ -227,13 +281,21 @@ class ObesityAnalyzerApp:
                 if self.depth_image_cv is None:
                     raise IOError("Could not load the image. The file may be corrupted or in an unsupported format.")
                 self.set_default_values()
-                self.create_or_update_canvas()
-                self.update_overlay()
+                self.show_full_images()
         except Exception as e:
             self.show_error("Error loading depth image", str(e))
 
+    def show_full_images(self):
+        """Displays the full-resolution images, dropping any pending background load"""
+        self.loader.cancel()
+        self.rgb_display_cv = self.rgb_image_cv
+        self.depth_display_cv = self.depth_image_cv
+        self.display_scale = 1.0
+        self.create_or_update_canvas()
+        self.update_overlay()
+
     def create_or_update_canvas(self):
-        if self.rgb_image_cv is None:
+        if self.rgb_display_cv is None:
             return
 
         if self.canvas is None:
@@ -245,9 +307,17 @@ class ObesityAnalyzerApp:
             self.canvas_frame = ttk.Frame(self.horizontal_frame)
             self.canvas_frame.pack(side=tk.LEFT, expand=True, fill=tk.BOTH, padx=(0,10))
             
+            # Zoomed with the wheel and panned with the middle button
             self.canvas = tk.Canvas(self.canvas_frame)
             self.canvas.pack(expand=True)
+            self.view = ZoomableView(self.canvas, on_zoom=self.redraw_points)
+            self.memory.register("image overlay view", self.view, PRIORITY_VIEW)
+            self.point_layer = PointLayer(self.canvas)
             self.canvas.bind("<Button-1>", self.on_click)
+            self.canvas.bind("<B1-Motion>", self.on_drag)
+            self.canvas.bind("<ButtonRelease-1>", self.on_release)
+            self.canvas.bind("<Delete>", lambda e: self.delete_selected_point())
+            self.canvas.bind("<BackSpace>", lambda e: self.delete_selected_point())
 
             # Right frame for point list - fixed width
             self.points_container = ttk.Frame(self.horizontal_frame, width=200)
@@ -274,12 +344,18 @@ class ObesityAnalyzerApp:
                                             command=self.clear_points)
             self.clear_points_btn.pack(pady=10)
 
+            # Editing of the selected point (click a point to select it, drag to move it)
+            edit_frame = ttk.Frame(self.points_container)
+            edit_frame.pack(pady=(0, 10))
+            tk.Button(edit_frame, text="Delete", command=self.delete_selected_point).pack(side=tk.LEFT, padx=2)
+            tk.Button(edit_frame, text="Earlier", command=lambda: self.move_selected_point(-1)).pack(side=tk.LEFT, padx=2)
+            tk.Button(edit_frame, text="Later", command=lambda: self.move_selected_point(1)).pack(side=tk.LEFT, padx=2)
+
     def clear_points(self):
+        self.telemetry.record("clear", self.current_index, points=len(self.points))
         # Clear current points
-        for _, _, point_id in self.points:
-            self.canvas.delete(point_id)
-        for line_id in self.lines:
-            self.canvas.delete(line_id)
+        if self.point_layer is not None:
+            self.point_layer.clear()
         
         # Clear lists
         self.points = []
@@ -287,8 +363,8 @@ class ObesityAnalyzerApp:
         
         # If we're viewing a dataset image, also clear stored points
         if self.current_index >= 0:
-            if str(self.current_index) in self.points_storage:
-                del self.points_storage[str(self.current_index)]
+            self.store.pop(self.current_index)
+            self.save_points(str(self.current_index))
         
         # Update image
         self.update_overlay()
@@ -299,13 +375,14 @@ class ObesityAnalyzerApp:
 
     def update_overlay(self, event=None):
         try:
-            if self.rgb_image_cv is None:
+            if self.rgb_display_cv is None:
                 return
 
             # Create base image
-            overlay = self.rgb_image_cv.copy()
+            overlay = self.rgb_display_cv.copy()
+            s = self.display_scale
 
-            if self.depth_image_cv is not None:
+            if self.depth_display_cv is not None:
                 # Get offset values from variables
                 try:
                     x_offset = int(self.x_offset_var.get())
@@ -314,75 +391,53 @@ class ObesityAnalyzerApp:
                     x_offset = int(self.x_offset_slider.get())
                     y_offset = int(self.y_offset_slider.get())
                 
-                # Create transformation matrix for offset
-                M = np.float32([[1, 0, x_offset], [0, 1, y_offset]])
-                
-                # Apply offset to depth map
-                depth_resized = cv2.resize(self.depth_image_cv, 
-                                        (self.rgb_image_cv.shape[1], self.rgb_image_cv.shape[0]))
-                depth_shifted = cv2.warpAffine(depth_resized, M, 
-                                            (depth_resized.shape[1], depth_resized.shape[0]))
-                
-                # Convert to grayscale and apply colormap
-                depth_gray = cv2.cvtColor(depth_shifted, cv2.COLOR_BGR2GRAY)
-                depth_normalized = cv2.normalize(depth_gray, None, 0, 255, cv2.NORM_MINMAX)
-                depth_colormap = cv2.applyColorMap(depth_normalized, cv2.COLORMAP_JET)
-
-                # Apply transparency
+                # Shift the colour-mapped depth map by +offset (full-resolution pixels) and blend it
                 alpha = self.alpha_slider.get() / 100.0
-                overlay = cv2.addWeighted(overlay, 1-alpha, depth_colormap, alpha, 0)
-
-            # Convert to PIL format and then to PhotoImage
-            overlay_rgb = cv2.cvtColor(overlay, cv2.COLOR_BGR2RGB)
-            image = Image.fromarray(overlay_rgb)
-            self.current_image_tk = ImageTk.PhotoImage(image)
+                overlay = render_overlay(overlay, self.depth_display_cv,
+                                         OffsetTransform.from_overlay(x_offset, y_offset), alpha, s)
 
-            # Update canvas
+            # Update canvas, zoom and position are kept while the size doesn't change
             if self.canvas is not None:
-                self.canvas.delete("all")
-                self.canvas.config(width=image.width, height=image.height)
-                self.canvas.create_image(0, 0, image=self.current_image_tk, anchor="nw")
-                
-                # Redraw lines
-                for i in range(len(self.points)-1):
-                    x1, y1, _ = self.points[i]
-                    x2, y2, _ = self.points[i+1]
-                    self.canvas.create_line(x1, y1, x2, y2, fill="yellow", width=2)
-                
-                # Redraw points and their labels above the lines
-                for i, (x, y, _) in enumerate(self.points, 1):
-                    self.canvas.create_oval(x-4, y-4, x+4, y+4, 
-                                        fill="white", outline="black", width=2)
-                    self.canvas.create_text(x, y-15, text=f"{i}", 
-                                        fill="white", font=("Arial", 12, "bold"))
+                self.view.set_image(overlay, s)
+                self.redraw_points()
         except Exception as e:
             self.show_error("Error updating overlay", str(e))
 
+    def redraw_points(self):
+        """Points, lines and labels at the current zoom"""
+        self.point_layer.set_points([(x, y) for x, y, _ in self.points], self.view.zoom)
+
     def on_click(self, event):
-        x = self.canvas.canvasx(event.x)
-        y = self.canvas.canvasy(event.y)
-        
-        # Create the point
-        point_id = self.canvas.create_oval(x-4, y-4, x+4, y+4, 
-                                        fill="white", outline="black", width=2)
-        self.points.append((x, y, point_id))
-        
-        # Draw line if there is a previous point
-        if len(self.points) > 1:
-            prev_x, prev_y, _ = self.points[-2]
-            line_id = self.canvas.create_line(prev_x, prev_y, x, y, 
-                                            fill="yellow", width=2)
-            self.lines.append(line_id)
+        canvas_x = self.canvas.canvasx(event.x)
+        canvas_y = self.canvas.canvasy(event.y)
+        # Keyboard focus for Delete/BackSpace on the selected point
+        self.canvas.focus_set()
+
+        # Clicking an existing point selects it and starts dragging it
+        hit = self.point_layer.hit(canvas_x, canvas_y)
+        if hit is not None:
+            self.point_layer.select(hit)
+            self.drag_index = hit
+            self.drag_moved = False
+            return
+        self.point_layer.select(None)
+
+        # Canvas -> full-resolution image coordinates, whatever the zoom and the shown resolution
+        x = round(canvas_x / self.view.zoom)
+        y = round(canvas_y / self.view.zoom)
+        w, h = self.view.full_size
+        if not (0 <= x < w and 0 <= y < h):
+            return
         
-        # Add only the number above the point
-        self.canvas.create_text(x, y-15, text=str(len(self.points)), 
-                            fill="white", font=("Arial", 12, "bold"))
+        # Create the point, its line and number
+        self.points.append((x, y, None))
+        self.point_layer.add(x, y)
+        self.telemetry.record("click", self.current_index)
 
         # Store points for current image
         if self.current_index >= 0:
-            self.points_storage[str(self.current_index)] = {
-                'points': [(x, y) for x, y, _ in self.points],
-            }
+            self.store.set(self.current_index, {'points': [(x, y) for x, y, _ in self.points]})
+            self.save_points(str(self.current_index))
         
         # Create frame for each point with border and fixed width
         point_container = ttk.Frame(self.points_frame, relief="solid", borderwidth=1)
@@ -394,23 +449,90 @@ class ObesityAnalyzerApp:
                             anchor="center")
         point_label.pack(padx=5, pady=2, fill=tk.X)
 
+    def on_drag(self, event):
+        if self.drag_index is None:
+            return
+        x, y = self.view.to_image(event.x, event.y)
+        w, h = self.view.full_size
+        x = round(min(max(x, 0), w - 1))
+        y = round(min(max(y, 0), h - 1))
+        self.points[self.drag_index] = (x, y, None)
+        self.point_layer.move(self.drag_index, x, y)
+        self.drag_moved = True
+
+    def on_release(self, event):
+        # The list and the storage are only refreshed once the drag ends
+        if self.drag_index is not None and self.drag_moved:
+            self.telemetry.record("move", self.current_index)
+            self.save_point_edit()
+        self.drag_index = None
+        self.drag_moved = False
+
+    def delete_selected_point(self):
+        if self.point_layer is None or self.point_layer.selected is None:
+            return
+        i = self.point_layer.selected
+        del self.points[i]
+        self.point_layer.delete(i)
+        self.telemetry.record("delete", self.current_index)
+        self.save_point_edit()
+
+    def move_selected_point(self, step):
+        """Moves the selected point one place earlier (-1) or later (1) in the point order"""
+        if self.point_layer is None or self.point_layer.selected is None:
+            return
+        i = self.point_layer.selected
+        j = i + step
+        if not 0 <= j < len(self.points):
+            return
+        self.points[i], self.points[j] = self.points[j], self.points[i]
+        self.point_layer.swap(i, j)
+        self.telemetry.record("reorder", self.current_index)
+        self.save_point_edit()
+
+    def save_point_edit(self):
+        """Stores the current image's points after an edit and refreshes the point list"""
+        if self.current_index >= 0:
+            if self.points:
+                self.store.set(self.current_index, {'points': [(x, y) for x, y, _ in self.points]})
+            else:
+                self.store.pop(self.current_index)
+            self.save_points(str(self.current_index))
+        self.update_points_list()
+
+    def update_points_list(self):
+        for widget in self.points_frame.winfo_children():
+            widget.destroy()
+        for i, (x, y, _) in enumerate(self.points, 1):
+            point_container = ttk.Frame(self.points_frame, relief="solid", borderwidth=1)
+            point_container.pack(fill=tk.X, padx=5, pady=2)
+            point_label = ttk.Label(point_container, 
+                                text=f"Point {i} at ({int(x)}, {int(y)})",
+                                anchor="center")
+            point_label.pack(padx=5, pady=2, fill=tk.X)
+
+    def record_offset(self):
+        self.telemetry.record_change("offset", self.current_index,
+                                     [int(self.x_offset_slider.get()), int(self.y_offset_slider.get())])
+
     def on_x_slider_change(self, event=None):
         value = int(self.x_offset_slider.get())
         self.x_offset_var.set(str(value))
+        self.record_offset()
         self.update_overlay()
 
     def on_y_slider_change(self, event=None):
         value = int(self.y_offset_slider.get())
         self.y_offset_var.set(str(value))
+        self.record_offset()
         self.update_overlay()
 
     def on_x_entry_change(self, event=None):
         try:
-            value = int(self.x_offset_var.get())
-            if not (-100 <= value <= 100):
-                raise ValueError("Offset value must be between -100 and 100")
+            value = OffsetTransform.check(self.x_offset_var.get())
             self.x_offset_slider.set(value)
             self.x_offset_var.set(str(value))
+            self.record_offset()
             self.update_overlay()
         except ValueError as e:
             self.show_error("Invalid X offset", str(e))
@@ -418,11 +540,10 @@ class ObesityAnalyzerApp:
 
     def on_y_entry_change(self, event=None):
         try:
-            value = int(self.y_offset_var.get())
-            if not (-100 <= value <= 100):
-                raise ValueError("Offset value must be between -100 and 100")
+            value = OffsetTransform.check(self.y_offset_var.get())
             self.y_offset_slider.set(value)
             self.y_offset_var.set(str(value))
+            self.record_offset()
             self.update_overlay()
         except ValueError as e:
             self.show_error("Invalid Y offset", str(e))
@@ -432,10 +553,10 @@ class ObesityAnalyzerApp:
         """Sets default values for interface controls"""
         try:
             # Set default values for offsets
-            self.x_offset_slider.set(-36)  # default value for X
-            self.y_offset_slider.set(0)    # default value for Y
-            self.x_offset_var.set("-36")
-            self.y_offset_var.set("0")
+            self.x_offset_slider.set(DEFAULT_OVERLAY_OFFSET[0])
+            self.y_offset_slider.set(DEFAULT_OVERLAY_OFFSET[1])
+            self.x_offset_var.set(str(DEFAULT_OVERLAY_OFFSET[0]))
+            self.y_offset_var.set(str(DEFAULT_OVERLAY_OFFSET[1]))
             
             # Set default value for transparency
             self.alpha_slider.set(40)  # 40% transparency
@@ -443,17 +564,55 @@ class ObesityAnalyzerApp:
             self.show_error("Error setting default values", str(e))
 
     def load_dataset(self):
+        folder = filedialog.askdirectory(title="Select Dataset Root Folder")
+        if not folder:
+            return
+        # Header-only integrity scan in the background, bad pairs are marked and can be skipped
+        self.dataset_loading = True
+        self.btn_load_dataset.config(state=tk.DISABLED)
+        self.current_image_label.config(text="Scanning dataset...")
+
+        def on_done(dataset_df):
+            self.dataset_loading = False
+            self.btn_load_dataset.config(state=tk.NORMAL)
+            self.dataset_loaded(folder, dataset_df)
+
+        def on_error():
+            self.dataset_loading = False
+            self.btn_load_dataset.config(state=tk.NORMAL)
+            self.update_navigation_buttons()
+
+        self.run_in_background(lambda: load_pairs(folder), on_done, "Error loading dataset", on_error)
+
+    def dataset_loaded(self, folder, dataset_df):
+        """Opens the first image of a scanned dataset"""
         try:
-            folder = filedialog.askdirectory(title="Select Dataset Root Folder")
-            if folder:
-                self.dataset_df = create_dataset_df(folder)
-                if not self.dataset_df.empty:
-                    self.current_index = 0
+            self.dataset_df = dataset_df
+            self.dataset_folder = folder
+            self.toggle_watch()
+            if not self.dataset_df.empty:
+                bad_pairs = int((~self.dataset_df['valid']).sum())
+                if self.representatives_var.get():
+                    self.toggle_representatives()
+
+                index = self.acquire_image(0, 1)
+                if index is None:
+                    self.current_index = -1
                     self.update_navigation_buttons()
-                    self.load_current_images()
-                    messagebox.showinfo("Success", f"Loaded dataset with {len(self.dataset_df)} image pairs")
-                else:
-                    messagebox.showwarning("Warning", "No valid image pairs found in the dataset")
+                    if self.store.client is None:
+                        messagebox.showwarning("Warning", "All image pairs in the dataset have problems")
+                    return
+                self.current_index = index
+                self.update_navigation_buttons()
+                self.load_current_images()
+                messagebox.showinfo("Success", f"Loaded dataset with {len(self.dataset_df)} image pairs"
+                                    + (f" ({bad_pairs} with problems)" if bad_pairs else ""))
+            elif self.dataset_watcher is not None:
+                self.current_index = -1
+                self.update_navigation_buttons()
+                self.current_image_label.config(text="Waiting for new pairs...")
+            else:
+                messagebox.showwarning("Warning", "No valid image pairs found in the dataset")
         except Exception as e:
             self.show_error("Error loading dataset", str(e))
 
@@ -464,11 +623,94 @@ class ObesityAnalyzerApp:
             self.current_image_label.config(text="No dataset loaded")
             return
 
-        self.btn_prev.config(state=tk.NORMAL if self.current_index > 0 else tk.DISABLED)
-        self.btn_next.config(state=tk.NORMAL if self.current_index < len(self.dataset_df) - 1 else tk.DISABLED)
+        mask = navigable_mask(self.dataset_df, self.skip_invalid_var.get(),
+                              self.representatives_var.get())
+        has_prev = find_next_index(mask, self.current_index - 1, -1) is not None
+        has_next = find_next_index(mask, self.current_index + 1, 1) is not None
+        self.btn_prev.config(state=tk.NORMAL if has_prev else tk.DISABLED)
+        self.btn_next.config(state=tk.NORMAL if has_next else tk.DISABLED)
         
-        current_file = os.path.basename(self.dataset_df.iloc[self.current_index]['rgb'])
-        self.current_image_label.config(text=f"Image {self.current_index + 1}/{len(self.dataset_df)}: {current_file}")
+        current_pair = self.dataset_df.iloc[self.current_index]
+        current_file = os.path.basename(current_pair['rgb'])
+        text = f"Image {self.current_index + 1}/{len(self.dataset_df)}: {current_file}"
+        if not current_pair.get('valid', True):
+            text += f" [BAD: {current_pair['scan_status']}]"
+        if current_pair.get('cluster', self.current_index) != self.current_index:
+            text += f" [duplicate of {current_pair['cluster'] + 1}]"
+        self.current_image_label.config(text=text)
+
+    def toggle_representatives(self):
+        """Groups near-duplicate frames the first time the mode is switched on"""
+        if not self.representatives_var.get() or self.dataset_df is None or self.dataset_df.empty \
+                or 'cluster' in self.dataset_df.columns:
+            self.update_navigation_buttons()
+            return
+
+        dataset_df = self.dataset_df
+        # Hashes are cached next to the dataset, only new or changed images are decoded
+        cache_path = os.path.join(self.dataset_folder, CACHE_NAME)
+        self.representatives_check.config(state=tk.DISABLED)
+
+        def on_done(result):
+            self.representatives_check.config(state=tk.NORMAL)
+            if self.dataset_df is not dataset_df:
+                # Another dataset was loaded or new pairs were appended meanwhile
+                self.toggle_representatives()
+                return
+            self.dataset_df = result
+            self.update_navigation_buttons()
+
+        def on_error():
+            self.representatives_check.config(state=tk.NORMAL)
+            self.representatives_var.set(False)
+
+        self.run_in_background(lambda: find_duplicates(dataset_df, cache_path=cache_path),
+                               on_done, "Error finding duplicate frames", on_error)
+
+    def toggle_watch(self):
+        """Starts or stops watching the dataset folders for pairs added during a capture"""
+        if self.dataset_watcher is not None:
+            self.dataset_watcher.stop()
+            self.dataset_watcher = None
+        if not self.watch_var.get() or self.dataset_folder is None:
+            return
+        try:
+            known = self.dataset_df['rgb'] if 'rgb' in self.dataset_df.columns else []
+            self.dataset_watcher = DatasetWatcher(self.dataset_folder, known, self.prepare_new_pairs)
+        except ValueError as e:
+            self.watch_var.set(False)
+            self.show_warning("Watch for new pairs", str(e))
+            return
+        if self.watch_poll is None:
+            self.watch_poll = self.master.after(WATCH_POLL_MS, self.poll_watch)
+
+    def prepare_new_pairs(self, new_pairs):
+        """Runs in the watch thread: header scan, previews and (when grouping duplicates) hashes"""
+        dataset_df = self.dataset_df
+        hash_cache = None
+        if dataset_df is not None and 'cluster' in dataset_df.columns:
+            hash_cache = os.path.join(self.dataset_folder, CACHE_NAME)
+        return prepare_pairs(new_pairs, self.loader, hash_cache)
+
+    def poll_watch(self):
+        """Appends the pairs found by the watcher after the existing ones, indices never move"""
+        self.watch_poll = None
+        if self.dataset_watcher is None:
+            return
+        new_pairs, errors = self.dataset_watcher.get()
+        for error in errors:
+            print(f"Warning: watching the dataset failed: {error}")
+        if new_pairs is not None:
+            self.dataset_df = append_pairs(self.dataset_df, new_pairs)
+            if self.representatives_var.get() and 'cluster' not in self.dataset_df.columns:
+                self.toggle_representatives()
+            if self.current_index < 0:
+                index = self.acquire_image(0, 1)
+                if index is not None:
+                    self.current_index = index
+                    self.load_current_images()
+            self.update_navigation_buttons()
+        self.watch_poll = self.master.after(WATCH_POLL_MS, self.poll_watch)
 
     def load_current_images(self):
         try:
@@ -476,90 +718,177 @@ class ObesityAnalyzerApp:
                 return
 
             current_pair = self.dataset_df.iloc[self.current_index]
+            self.telemetry.record("shown", self.current_index, path=normalize_path(current_pair['rgb'], IMAGE_ID_COMPONENTS))
             
             # Clear existing points and lines
-            for _, _, point_id in self.points:
-                self.canvas.delete(point_id)
-            for line_id in self.lines:
-                self.canvas.delete(line_id)
+            if self.point_layer is not None:
+                self.point_layer.clear()
+            self.drag_index = None
             self.points = []
             self.lines = []
             
-            # Load RGB image
-            self.rgb_image_cv = cv2.imread(current_pair['rgb'], cv2.IMREAD_UNCHANGED)
-            if self.rgb_image_cv is None:
-                raise IOError(f"Could not load RGB image: {current_pair['rgb']}")
-            
-            # Load depth image
-            self.depth_image_cv = cv2.imread(current_pair['depth'], cv2.IMREAD_UNCHANGED)
-            if self.depth_image_cv is None:
-                raise IOError(f"Could not load depth image: {current_pair['depth']}")
+            # Show a reduced preview right away, the full-resolution pair is decoded
+            # in the background and swapped in by poll_full_images
+            prefetch = prefetch_paths(self.dataset_df, self.current_index)
+            self.rgb_image_cv = None
+            self.depth_image_cv = None
+            self.rgb_display_cv, self.depth_display_cv = self.loader.load(
+                current_pair['rgb'], current_pair['depth'], prefetch)
+            self.display_scale = self.loader.preview_scale
+            if self.full_image_poll is None:
+                self.full_image_poll = self.master.after(POLL_INTERVAL_MS, self.poll_full_images)
 
             # Ensure canvas is created
             self.create_or_update_canvas()
 
-            # Restore points if they exist for this image
-            if str(self.current_index) in self.points_storage:
-                stored_data = self.points_storage[str(self.current_index)]
-                
-                # Recreate points with new canvas IDs
-                for x, y in stored_data['points']:
-                    point_id = self.canvas.create_oval(x-4, y-4, x+4, y+4, 
-                                                     fill="white", outline="black", width=2)
-                    self.points.append((x, y, point_id))
-                    
-                    # Recreate lines if needed
-                    if len(self.points) > 1:
-                        prev_x, prev_y, _ = self.points[-2]
-                        line_id = self.canvas.create_line(prev_x, prev_y, x, y, 
-                                                        fill="yellow", width=2)
-                        self.lines.append(line_id)
-
-            # Clear points frame
-            for widget in self.points_frame.winfo_children():
-                widget.destroy()
+            # Restore points if they exist for this image (they are drawn by update_overlay)
+            if self.current_index in self.store:
+                stored_data = self.store.get(self.current_index)
+                self.points = [(x, y, None) for x, y in stored_data['points']]
 
             # Restore point labels in the list
-            for i, (x, y, _) in enumerate(self.points, 1):
-                point_container = ttk.Frame(self.points_frame, relief="solid", borderwidth=1)
-                point_container.pack(fill=tk.X, padx=5, pady=2)
-                point_label = ttk.Label(point_container, 
-                                    text=f"Point {i} at ({int(x)}, {int(y)})",
-                                    anchor="center")
-                point_label.pack(padx=5, pady=2, fill=tk.X)
+            self.update_points_list()
             
             self.update_overlay()
+            self.update_memory()
         except Exception as e:
             self.show_error("Error loading images", str(e))
 
+    def poll_full_images(self):
+        """Swaps the preview for the full-resolution pair once it's decoded"""
+        result = self.loader.poll()
+        if result is None:
+            if self.loader.pending:
+                self.full_image_poll = self.master.after(POLL_INTERVAL_MS, self.poll_full_images)
+            else:
+                self.full_image_poll = None
+            return
+        self.full_image_poll = None
+
+        rgb_image, depth_image, error = result
+        if error is not None:
+            self.show_error("Error loading images", str(error))
+            return
+        self.rgb_image_cv = rgb_image
+        self.depth_image_cv = depth_image
+        self.telemetry.record("loaded", self.current_index)
+        self.show_full_images()
+        self.update_memory()
+
+    def update_memory(self):
+        """Brings the caches back within the shared memory budget and shows the usage"""
+        self.memory.enforce()
+        self.memory_label.config(text=self.memory.status())
+
+    def show_memory_dump(self):
+        messagebox.showinfo("Memory", self.memory.dump())
+
     def previous_image(self):
         if self.current_index > 0:
+            index = self.acquire_image(self.current_index - 1, -1)
+            if index is None:
+                return
+
             # Save current points before changing image
             if self.points:
-                self.points_storage[str(self.current_index)] = {
-                    'points': [(x, y) for x, y, _ in self.points],
-                }
+                self.store.set(self.current_index, {'points': [(x, y) for x, y, _ in self.points]})
 
-            self.current_index -= 1
+            self.telemetry.record("navigate", self.current_index, to=index)
+            self.release_image(self.current_index)
+            self.current_index = index
             self.load_current_images()
             self.update_navigation_buttons()
 
     def next_image(self):
         if self.dataset_df is not None and self.current_index < len(self.dataset_df) - 1:
+            index = self.acquire_image(self.current_index + 1, 1)
+            if index is None:
+                return
+
             # Save current points before changing image
             if self.points:
-                self.points_storage[str(self.current_index)] = {
-                    'points': [(x, y) for x, y, _ in self.points],
-                }
+                self.store.set(self.current_index, {'points': [(x, y) for x, y, _ in self.points]})
 
-            self.current_index += 1
+            self.telemetry.record("navigate", self.current_index, to=index)
+            self.release_image(self.current_index)
+            self.current_index = index
             self.load_current_images()
             self.update_navigation_buttons()
 
+    def save_points(self, key):
+        """Sends one image's points to the annotation server, if connected"""
+        # Merged into the shared entry so the point mapping data is kept
+        self.store.save(key)
+
+    def acquire_image(self, start, step):
+        """
+        Returns the first index from start in the direction of step that can be
+        opened, skipping bad pairs if enabled and leasing it when connected to
+        the server. None if there is none.
+        """
+        try:
+            index = find_image(self.dataset_df, start, step, self.skip_invalid_var.get(),
+                               self.representatives_var.get(), self.store)
+            if index is None and self.store.client is not None:
+                messagebox.showinfo("Annotation Server", "All remaining images are leased by other annotators")
+            return index
+        except (IOError, OSError) as e:
+            self.show_error("Annotation server error", str(e))
+            return None
+
+    def release_image(self, index):
+        self.store.release(index)
+
+    def connect_to_server(self):
+        url = simpledialog.askstring("Annotation Server", "Server URL:",
+                                     initialvalue=os.environ.get("ANNOTATION_SERVER", "http://127.0.0.1:8765"),
+                                     parent=self.master)
+        if not url:
+            return
+        client = None
+        try:
+            # Shared with the other tab, so both see the same entry versions
+            client = AnnotationClient.shared(url)
+            if self.dataset_df is not None and self.current_index >= 0:
+                if not client.acquire(self.current_index):
+                    self.show_warning("Annotation Server",
+                                      "The current image is being labeled by another annotator")
+            self.store.connect(client)
+            self.btn_server.config(text=f"Server: {client.host}:{client.port}")
+            self.load_current_images()
+            self.master.after(1000, self.poll_server_conflicts)
+        except Exception as e:
+            if client is not None and self.store.client is not client:
+                client.close()
+            self.show_error("Error connecting to annotation server", str(e))
+
+    def poll_server_conflicts(self):
+        """Warns about writes the server rejected because another annotator holds or changed the image"""
+        if self.store.client is None:
+            return
+        rejected = [key for key, _, _ in self.store.take_conflicts()]
+        if rejected:
+            self.show_warning("Annotation Server",
+                              "Points of images " + ", ".join(str(int(k) + 1) for k in rejected) +
+                              " were not saved because another annotator is labeling or changed them")
+        self.master.after(1000, self.poll_server_conflicts)
+
+    def shutdown(self):
+        """Sends pending writes and releases the current lease"""
+        if self.dataset_watcher is not None:
+            self.dataset_watcher.stop()
+        self.store.close(release=self.current_index)
+        self.telemetry.close()
+
 def main():
     root = tk.Tk()
-    # Create the app without assigning to an unused variable
-    ObesityAnalyzerApp(root)
+    app = ObesityAnalyzerApp(root)
+
+    def on_close():
+        app.shutdown()
+        root.destroy()
+
+    root.protocol("WM_DELETE_WINDOW", on_close)
     root.mainloop()
 
 if __name__ == "__main__":
@@ -0,0 +1,313 @@
+import math
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from PIL import Image, ImageTk
+from annotation_render import to_bgr
+
+# Side of the square tiles, in level pixels when zoomed out and in canvas pixels when
+# zoomed in past the finest level, so no tile is ever larger than this on screen
+TILE_SIZE = 256
+# Largest canvas size of a view, bigger images start zoomed out to fit
+DEFAULT_VIEWPORT = (800, 600)
+MAX_ZOOM = 8.0
+# Smallest zoom as a fraction of the zoom that fits the whole image
+MIN_FIT_FRACTION = 0.25
+ZOOM_STEP = 1.25
+# Bytes of cached tiles kept per view (Tk holds 4 bytes per pixel), least recently used go first
+MAX_TILE_BYTES = 64 * 1024 * 1024
+# How often a view checks whether the pyramid of a new image is ready
+PYRAMID_POLL_MS = 10
+
+# Pyramids are built off the Tk thread, one at a time: a newer image makes queued ones stale
+_pyramid_builder = ThreadPoolExecutor(max_workers=1)
+
+
+class ImagePyramid:
+    """
+    Resolution levels of an image, each half the size of the previous one
+    (cv2.pyrDown), so level k pixel (x, y) is level 0 pixel (x * 2^k, y * 2^k).
+    Images are converted once to 8-bit RGB for display. Under memory pressure
+    the finest levels can be dropped, the next one is shown enlarged instead.
+    """
+
+    def __init__(self, image, min_size=TILE_SIZE):
+        self.levels = [cv2.cvtColor(to_bgr(image), cv2.COLOR_BGR2RGB)]
+        while max(self.levels[-1].shape[:2]) > min_size:
+            self.levels.append(cv2.pyrDown(self.levels[-1]))
+        self.first = 0  # Finest level still held
+
+    @property
+    def nbytes(self):
+        return sum(level.nbytes for level in self.levels if level is not None)
+
+    def level_for(self, scale):
+        """Coarsest level that still has a pixel per canvas pixel at scale (canvas px per level 0 px)"""
+        k = 0
+        while k + 1 < len(self.levels) and scale * 2 ** (k + 1) <= 1:
+            k += 1
+        return max(k, self.first)
+
+    def downscale(self):
+        """Drops the finest level held, False if only the coarsest one is left"""
+        if self.first + 1 >= len(self.levels):
+            return False
+        self.levels[self.first] = None
+        self.first += 1
+        return True
+
+
+class ZoomableView:
+    """
+    Zoom and pan on a tk.Canvas. The image is drawn as tiles of the pyramid
+    level closest to the zoom, and only the tiles inside the visible part of
+    the canvas are created. Canvas coordinates are full-resolution image
+    coordinates times zoom, so canvas items placed at that scale (PointLayer)
+    follow panning by themselves. Wheel zooms around the cursor, the middle
+    (or right) button drags the view, double middle click fits the image.
+    """
+
+    def __init__(self, canvas, max_size=DEFAULT_VIEWPORT, on_zoom=None, on_view=None):
+        self.canvas = canvas
+        self.max_size = max_size
+        self.on_zoom = on_zoom  # Called after the zoom changes, items must be redrawn at the new scale
+        self.on_view = on_view  # Called after any zoom or pan
+        self.pyramid = None
+        self.generation = 0  # Images passed to set_image, pyramids of older ones are dropped
+        self.building = None  # Future of the pyramid being built
+        self.image_scale = 1.0  # Pixels of the shown image per full-resolution pixel (previews are smaller)
+        self.full_size = None
+        self.zoom = 1.0
+        self.fit_zoom = 1.0
+        self.tiles = OrderedDict()  # (level, tx, ty, zoom) -> (PhotoImage, bytes)
+        self.tile_bytes = 0
+        self.items = {}  # (level, tx, ty) -> (canvas item, PhotoImage) on the canvas
+
+        canvas.configure(xscrollincrement=1, yscrollincrement=1)
+        canvas.bind("<MouseWheel>", lambda e: self.zoom_at(ZOOM_STEP if e.delta > 0 else 1 / ZOOM_STEP, e.x, e.y))
+        canvas.bind("<Button-4>", lambda e: self.zoom_at(ZOOM_STEP, e.x, e.y))
+        canvas.bind("<Button-5>", lambda e: self.zoom_at(1 / ZOOM_STEP, e.x, e.y))
+        for button in (2, 3):
+            canvas.bind(f"<ButtonPress-{button}>", lambda e: self.canvas.scan_mark(e.x, e.y))
+            canvas.bind(f"<B{button}-Motion>", self._pan)
+        canvas.bind("<Double-Button-2>", lambda e: self.fit())
+        canvas.bind("<Configure>", lambda e: self.render())
+
+    def set_image(self, image, image_scale=1.0, keep_view=True):
+        """
+        Shows image, a full-resolution image or a reduced version of it with
+        image_scale pixels per full-resolution pixel. The zoom and position
+        are kept if the full-resolution size didn't change (preview -> full
+        frame, next frame of a sequence). The geometry changes at once, the
+        pyramid is built in the background and the tiles follow when it's ready.
+        """
+        full_size = (image.shape[1] / image_scale, image.shape[0] / image_scale)
+        same_size = self.full_size is not None and \
+            all(abs(a - b) <= max(2.0, 0.01 * a) for a, b in zip(full_size, self.full_size))
+        self.generation += 1
+        generation = self.generation
+        self.building = _pyramid_builder.submit(
+            lambda: ImagePyramid(image) if generation == self.generation else None)
+        self.canvas.after(PYRAMID_POLL_MS, self._poll_pyramid, generation, image_scale)
+        if not same_size:
+            # The previous image's tiles would be misplaced, the old pyramid stays until then otherwise
+            self.pyramid = None
+            self._clear_tiles()
+            self._clear_items()
+        self.full_size = full_size
+
+        self.fit_zoom = min(1.0, self.max_size[0] / full_size[0], self.max_size[1] / full_size[1])
+        if keep_view and same_size:
+            self.render()
+            return
+        # New image size: canvas as large as the image at the fitting zoom
+        self.canvas.config(width=int(full_size[0] * self.fit_zoom), height=int(full_size[1] * self.fit_zoom))
+        self._set_zoom(self.fit_zoom, 0, 0)
+
+    @property
+    def pending(self):
+        """Whether the pyramid of the last image is still being built"""
+        return self.building is not None
+
+    def _poll_pyramid(self, generation, image_scale):
+        if generation != self.generation:
+            return
+        if not self.building.done():
+            self.canvas.after(PYRAMID_POLL_MS, self._poll_pyramid, generation, image_scale)
+            return
+        pyramid = self.building.result()
+        self.building = None
+        self.pyramid = pyramid
+        self.image_scale = image_scale
+        self._clear_tiles()
+        self._clear_items()
+        self.render()
+
+    def to_image(self, x, y):
+        """Widget (event) coordinates -> full-resolution image coordinates"""
+        return self.canvas.canvasx(x) / self.zoom, self.canvas.canvasy(y) / self.zoom
+
+    def center(self):
+        """Full-resolution image coordinates at the centre of the visible area"""
+        return self.to_image(self.canvas.winfo_width() / 2, self.canvas.winfo_height() / 2)
+
+    def set_view(self, zoom, center):
+        """Zooms to zoom with center (full-resolution coordinates) in the middle of the canvas"""
+        if self.full_size is None:
+            return
+        zoom_changed = not math.isclose(zoom, self.zoom)
+        self.zoom = zoom
+        self._update_scrollregion()
+        self._scroll_to(center[0] * zoom - self.canvas.winfo_width() / 2,
+                        center[1] * zoom - self.canvas.winfo_height() / 2)
+        self._changed(zoom_changed, notify=False)
+
+    def fit(self):
+        if self.full_size is not None:
+            self._set_zoom(self.fit_zoom, 0, 0)
+
+    def zoom_at(self, factor, x, y):
+        """Multiplies the zoom by factor keeping the image point under widget position (x, y) in place"""
+        if self.full_size is None:
+            return
+        zoom = min(max(self.zoom * factor, self.fit_zoom * MIN_FIT_FRACTION), MAX_ZOOM)
+        ix, iy = self.to_image(x, y)
+        self._set_zoom(zoom, ix * zoom - x, iy * zoom - y)
+
+    def _set_zoom(self, zoom, left, top):
+        zoom_changed = not math.isclose(zoom, self.zoom)
+        self.zoom = zoom
+        self._update_scrollregion()
+        self._scroll_to(left, top)
+        self._changed(zoom_changed)
+
+    def _update_scrollregion(self):
+        self.canvas.configure(scrollregion=(0, 0, int(self.full_size[0] * self.zoom),
+                                            int(self.full_size[1] * self.zoom)))
+
+    def _scroll_to(self, left, top):
+        width = max(self.full_size[0] * self.zoom, 1)
+        height = max(self.full_size[1] * self.zoom, 1)
+        self.canvas.xview_moveto(max(left, 0) / width)
+        self.canvas.yview_moveto(max(top, 0) / height)
+
+    def _pan(self, event):
+        self.canvas.scan_dragto(event.x, event.y, gain=1)
+        self._changed(False)
+
+    def _changed(self, zoom_changed, notify=True):
+        if zoom_changed:
+            self._clear_items()
+        self.render()
+        if zoom_changed and self.on_zoom is not None:
+            self.on_zoom()
+        if notify and self.on_view is not None:
+            self.on_view()
+
+    def memory_usage(self):
+        # Tk holds 4 bytes per pixel of every PhotoImage
+        return (self.pyramid.nbytes if self.pyramid is not None else 0) + self.tile_bytes
+
+    def release_memory(self, target):
+        """
+        Drops cached tiles that are off screen, then the finest pyramid levels,
+        until at most target bytes are held
+        """
+        used = self.memory_usage()
+        on_canvas = {id(photo) for _, photo in self.items.values()}
+        for key in list(self.tiles):
+            if used <= target:
+                return
+            photo, size = self.tiles[key]
+            if id(photo) not in on_canvas:
+                del self.tiles[key]
+                self.tile_bytes -= size
+                used -= size
+        while used > target and self.pyramid is not None and self.pyramid.downscale():
+            self._clear_tiles()
+            self._clear_items()
+            self.render()
+            used = self.memory_usage()
+
+    def _clear_tiles(self):
+        self.tiles.clear()
+        self.tile_bytes = 0
+
+    def _clear_items(self):
+        for item, _ in self.items.values():
+            self.canvas.delete(item)
+        self.items = {}
+
+    @staticmethod
+    def _tile_step(factor):
+        """Canvas pixels per tile: level tiles when zoomed out, canvas tiles when zoomed in"""
+        return TILE_SIZE * factor if factor <= 1 else TILE_SIZE
+
+    def _tile(self, level, tx, ty, factor):
+        """PhotoImage of tile (tx, ty) of a level shown at factor canvas pixels per level pixel, cached"""
+        key = (level, tx, ty, self.zoom)
+        cached = self.tiles.get(key)
+        if cached is not None:
+            self.tiles.move_to_end(key)
+            return cached[0]
+        image = self.pyramid.levels[level]
+        if factor <= 1:
+            x0, y0 = tx * TILE_SIZE, ty * TILE_SIZE
+            tile = image[y0:y0 + TILE_SIZE, x0:x0 + TILE_SIZE]
+            # Tile edges are rounded the same way for neighbours, so there are no seams
+            width = round((x0 + tile.shape[1]) * factor) - round(x0 * factor)
+            height = round((y0 + tile.shape[0]) * factor) - round(y0 * factor)
+            tile = cv2.resize(tile, (max(width, 1), max(height, 1)), interpolation=cv2.INTER_AREA)
+        else:
+            # Zoomed past the level's resolution: the tile is a TILE_SIZE square of the canvas,
+            # sampled by nearest neighbour so pixels stay sharp for precise clicks
+            x0, y0 = tx * TILE_SIZE, ty * TILE_SIZE
+            width = min(TILE_SIZE, round(image.shape[1] * factor) - x0)
+            height = min(TILE_SIZE, round(image.shape[0] * factor) - y0)
+            # Canvas pixel centre (u + x0 + 0.5) samples level pixel (u + x0 + 0.5) / factor - 0.5
+            M = np.array([[1 / factor, 0, (x0 + 0.5) / factor - 0.5],
+                          [0, 1 / factor, (y0 + 0.5) / factor - 0.5]])
+            tile = cv2.warpAffine(image, M, (max(width, 1), max(height, 1)),
+                                  flags=cv2.INTER_NEAREST | cv2.WARP_INVERSE_MAP, borderMode=cv2.BORDER_REPLICATE)
+        photo = ImageTk.PhotoImage(Image.fromarray(tile))
+        size = tile.shape[0] * tile.shape[1] * 4
+        self.tiles[key] = (photo, size)
+        self.tile_bytes += size
+        # Tiles on the canvas stay alive through self.items, only the cache entry goes
+        while self.tile_bytes > MAX_TILE_BYTES and len(self.tiles) > 1:
+            self.tile_bytes -= self.tiles.popitem(last=False)[1][1]
+        return photo
+
+    def render(self):
+        """Creates the tiles inside the visible area and drops the ones that left it"""
+        if self.pyramid is None:
+            return
+        level = self.pyramid.level_for(self.zoom / self.image_scale)
+        level_scale = self.image_scale / 2 ** level  # Level pixels per full-resolution pixel
+        factor = self.zoom / level_scale  # Canvas pixels per level pixel
+        image = self.pyramid.levels[level]
+
+        left, top = self.canvas.canvasx(0), self.canvas.canvasy(0)
+        width = max(self.canvas.winfo_width(), int(self.canvas.cget("width")))
+        height = max(self.canvas.winfo_height(), int(self.canvas.cget("height")))
+        step = self._tile_step(factor)
+        if factor <= 1:
+            counts = [math.ceil(n / TILE_SIZE) for n in image.shape[1::-1]]
+        else:
+            counts = [math.ceil(round(n * factor) / TILE_SIZE) for n in image.shape[1::-1]]
+        columns = range(max(int(left // step), 0), min(int((left + width) // step) + 1, counts[0]))
+        rows = range(max(int(top // step), 0), min(int((top + height) // step) + 1, counts[1]))
+
+        visible = {(level, tx, ty) for tx in columns for ty in rows}
+        for key in list(self.items):
+            if key not in visible:
+                self.canvas.delete(self.items.pop(key)[0])
+        for key in visible - self.items.keys():
+            _, tx, ty = key
+            photo = self._tile(level, tx, ty, factor)
+            item = self.canvas.create_image(round(tx * step), round(ty * step),
+                                            image=photo, anchor="nw", tags="tile")
+            self.items[key] = (item, photo)
+        # Points and lines stay above the image
+        self.canvas.tag_lower("tile")
@@ -0,0 +1,202 @@
+import argparse
+import json
+import time
+import numpy as np
+from annotation_core import MAPPING_FIELDS, OffsetTransform, load_pairs, make_entry
+
+METHODS = ("linear", "spline")
+# Marks entries filled in between keyframes, cleared when the entry is promoted
+INTERPOLATED = "interpolated"
+
+
+def is_interpolated(entry):
+    return bool(entry and entry.get(INTERPOLATED))
+
+
+def promote(entry):
+    """Entry as if labeled by hand: it becomes a keyframe"""
+    return {k: v for k, v in entry.items() if k not in (INTERPOLATED, "keyframes")}
+
+
+def _segments(keys, frames):
+    """Index i of the keyframe interval keys[i]..keys[i + 1] of every frame"""
+    return np.clip(np.searchsorted(keys, frames, side='right') - 1, 0, len(keys) - 2)
+
+
+def interpolate_linear(keys, values, frames):
+    """
+    Values (K, ...) at keys interpolated at frames, one operation over the
+    whole frames x values array. Returns (F, ...).
+    """
+    keys = np.asarray(keys, dtype=np.float64)
+    frames = np.asarray(frames, dtype=np.float64)
+    i = _segments(keys, frames)
+    t = ((frames - keys[i]) / (keys[i + 1] - keys[i])).reshape((-1,) + (1,) * (values.ndim - 1))
+    return values[i] * (1 - t) + values[i + 1] * t
+
+
+def _second_derivatives(keys, values):
+    """
+    Second derivatives at the knots of the natural cubic spline through values.
+    The tridiagonal system is solved once for all value columns (Thomas algorithm).
+    """
+    y = values.reshape(len(keys), -1)
+    m = np.zeros_like(y)
+    n = len(keys) - 2
+    if n < 1:
+        return m.reshape(values.shape)
+    h = np.diff(keys)
+    slopes = np.diff(y, axis=0) / h[:, None]
+    rhs = 6 * np.diff(slopes, axis=0)
+    lower, diag, upper = h[:-1], 2 * (h[:-1] + h[1:]), h[1:]
+
+    c = np.empty(n)
+    d = np.empty_like(rhs)
+    c[0], d[0] = upper[0] / diag[0], rhs[0] / diag[0]
+    for i in range(1, n):
+        denom = diag[i] - lower[i] * c[i - 1]
+        c[i] = upper[i] / denom
+        d[i] = (rhs[i] - lower[i] * d[i - 1]) / denom
+    for i in range(n - 2, -1, -1):
+        d[i] -= c[i] * d[i + 1]
+    m[1:-1] = d
+    return m.reshape(values.shape)
+
+
+def interpolate_spline(keys, values, frames):
+    """Natural cubic spline version of interpolate_linear, linear with only two keyframes"""
+    keys = np.asarray(keys, dtype=np.float64)
+    frames = np.asarray(frames, dtype=np.float64)
+    if len(keys) < 3:
+        return interpolate_linear(keys, values, frames)
+    m = _second_derivatives(keys, values)
+    i = _segments(keys, frames)
+    shape = (-1,) + (1,) * (values.ndim - 1)
+    h = (keys[i + 1] - keys[i]).reshape(shape)
+    a = ((keys[i + 1] - frames) / (keys[i + 1] - keys[i])).reshape(shape)
+    b = 1 - a
+    return a * values[i] + b * values[i + 1] + ((a ** 3 - a) * m[i] + (b ** 3 - b) * m[i + 1]) * h ** 2 / 6
+
+
+INTERPOLATORS = {"linear": interpolate_linear, "spline": interpolate_spline}
+
+
+def keyframes(storage):
+    """
+    Sorted dataset indices of the entries labeled by hand. Keys that are not
+    dataset indices (files merged without a dataset are keyed by image path)
+    are left out, see unindexed_keys.
+    """
+    return sorted(int(key) for key, entry in storage.items()
+                  if key.isdigit() and entry.get('rgb_points') and not is_interpolated(entry))
+
+
+def unindexed_keys(storage):
+    """Keys of storage that are not dataset indices, these entries can't be interpolated"""
+    return [key for key in storage if not key.isdigit()]
+
+
+def _offset(entry):
+    offset = entry.get('offset')
+    if offset is not None:
+        return offset
+    # Older entries: mean displacement of the point pairs
+    rgb, depth = np.asarray(entry['rgb_points']), np.asarray(entry['depth_points'])
+    return np.rint((depth - rgb).mean(axis=0)).astype(int).tolist()
+
+
+def _runs(storage, keys):
+    """Consecutive keyframes that can be interpolated together: same point count and image space"""
+    runs = []
+    for key in keys:
+        entry = storage[str(key)]
+        signature = (len(entry['rgb_points']), len(entry.get('depth_points') or []), bool(entry.get('undistorted')))
+        if runs and runs[-1][0] == signature:
+            runs[-1][1].append(key)
+        else:
+            runs.append((signature, [key]))
+    return runs
+
+
+def interpolate_store(storage, dataset_df, method="linear"):
+    """
+    Entries for every frame between two keyframes, {key: entry}. Frames are
+    filled within runs of keyframes with the same number of points; rgb
+    points, depth points and offset are interpolated together. Entries are
+    marked interpolated and name their surrounding keyframes; fields of an
+    existing entry that interpolation doesn't produce (overlay_points) are kept.
+    """
+    interpolate = INTERPOLATORS[method]
+    rgb_paths = dataset_df['rgb'].to_numpy()
+    depth_paths = dataset_df['depth'].to_numpy()
+    filled = {}
+    for (count, depth_count, undistorted), run in _runs(storage, keyframes(storage)):
+        if len(run) < 2 or count != depth_count:
+            continue
+        keys = np.array(run)
+        frames = np.setdiff1d(np.arange(keys[0], min(keys[-1], len(dataset_df) - 1) + 1), keys)
+        if not len(frames):
+            continue
+        # (K, 2 * points + 1, 2): rgb points, depth points, offset
+        values = np.array([storage[str(k)]['rgb_points'] + storage[str(k)]['depth_points'] + [_offset(storage[str(k)])]
+                           for k in run], dtype=np.float64)
+        result = np.rint(interpolate(keys, values, frames)).astype(int).tolist()
+        segments = _segments(keys, frames).tolist()
+        for frame, row, i in zip(frames.tolist(), result, segments):
+            entry = make_entry(row[:count], row[count:2 * count], OffsetTransform(*row[-1]), undistorted,
+                               rgb_paths[frame], depth_paths[frame])
+            entry[INTERPOLATED] = True
+            entry['keyframes'] = [run[i], run[i + 1]]
+            filled[str(frame)] = dict(storage.get(str(frame), {}), **entry)
+    return filled
+
+
+def refill(storage, dataset_df, method="linear"):
+    """
+    Replaces the interpolated entries of storage (a dict, changed in place)
+    with a new interpolation. Returns the keys that were written or removed.
+    Stale interpolations lose only the point mapping fields, the entry is
+    removed when nothing else is left.
+    """
+    filled = interpolate_store(storage, dataset_df, method)
+    stale = [key for key, entry in storage.items() if is_interpolated(entry) and key not in filled]
+    for key in stale:
+        rest = {k: v for k, v in storage[key].items() if k not in MAPPING_FIELDS}
+        if rest:
+            storage[key] = rest
+        else:
+            del storage[key]
+    storage.update(filled)
+    return list(filled) + stale
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fill the frames between labeled keyframes by interpolation")
+    parser.add_argument("dataset", help="Dataset the points were labeled on")
+    parser.add_argument("json_file", nargs="?", default="labeled_points.json")
+    parser.add_argument("-o", "--output", help="Output points file (default: update json_file)")
+    parser.add_argument("--method", choices=METHODS, default="linear")
+    args = parser.parse_args()
+
+    with open(args.json_file, 'r') as f:
+        storage = json.load(f)
+    dataset_df = load_pairs(args.dataset)
+    unindexed = unindexed_keys(storage)
+    if unindexed:
+        print(f"Warning: {len(unindexed)} entries are keyed by image path, not dataset index "
+              f"(e.g. {unindexed[0]!r}), they are left out; merge with --dataset to index them")
+
+    start = time.perf_counter()
+    refill(storage, dataset_df, args.method)
+    elapsed = time.perf_counter() - start
+    filled = [key for key, entry in storage.items() if is_interpolated(entry)]
+
+    output = args.output or args.json_file
+    with open(output, 'w') as f:
+        json.dump(storage, f, indent=4)
+    print(f"Interpolated {len(filled)} frames from {len(keyframes(storage))} keyframes "
+          f"in {elapsed:.2f}s, written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+import argparse
+import json
+import os
+import threading
+from collections import OrderedDict
+import cv2
+import numpy as np
+
+# Per-camera intrinsics and distortion, e.g.
+# {"rgb": {"width": 1280, "height": 720, "fx": 910.0, "fy": 910.0, "cx": 640.0, "cy": 360.0,
+#          "dist": [k1, k2, p1, p2, k3]}, "depth": {...}}
+# Either camera may be left out, its images are then used as they are.
+CALIBRATION_FILE = "camera_calibration.json"
+# Remap tables kept per camera (one per resolution: previews and full frames)
+MAX_CACHED_MAPS = 8
+# Iterations of the inverse distortion model, well below 0.01 px at the image corners
+UNDISTORT_CRITERIA = (cv2.TERM_CRITERIA_COUNT | cv2.TERM_CRITERIA_EPS, 40, 1e-8)
+
+
+def _maps_bytes(maps):
+    return sum(m.nbytes for m in maps if m is not None)
+
+
+class CameraModel:
+    """
+    Pinhole camera with OpenCV distortion coefficients. The intrinsics refer to
+    the calibration resolution and are scaled to whatever size is requested.
+    Undistorted images keep the same camera matrix, so depth back-projection
+    with the same intrinsics stays valid.
+    """
+
+    def __init__(self, fx, fy, cx, cy, dist, width=None, height=None):
+        self.K = np.array([[fx, 0, cx], [0, fy, cy], [0, 0, 1]], dtype=np.float64)
+        self.dist = np.asarray(dist, dtype=np.float64).ravel()
+        self.size = (width, height) if width and height else None
+        self.maps = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        # Sent to worker processes without the lock and the cached maps
+        state = dict(self.__dict__)
+        del state["lock"]
+        state["maps"] = OrderedDict()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def camera_matrix(self, size):
+        """Camera matrix for images of size (width, height)"""
+        if size is None or self.size is None or tuple(size) == self.size:
+            return self.K
+        sx, sy = size[0] / self.size[0], size[1] / self.size[1]
+        return np.diag([sx, sy, 1.0]) @ self.K
+
+    def float_maps(self, size):
+        """Reference cv2.remap tables for (width, height), one float32 map per axis (not cached)"""
+        K = self.camera_matrix(size)
+        return cv2.initUndistortRectifyMap(K, self.dist, None, K, (int(size[0]), int(size[1])), cv2.CV_32FC1)
+
+    def undistort_maps(self, size, nearest=False):
+        """
+        cv2.remap tables for (width, height), built once per resolution.
+        Fixed-point maps, the fastest format for cv2.remap. For nearest
+        neighbour the float maps are rounded to whole pixels, the fractional
+        table is only valid for the interpolating modes.
+        """
+        key = (int(size[0]), int(size[1]), nearest)
+        with self.lock:
+            if key in self.maps:
+                self.maps.move_to_end(key)
+                return self.maps[key]
+        map_x, map_y = self.float_maps(key[:2])
+        maps = cv2.convertMaps(map_x, map_y, cv2.CV_16SC2, nninterpolation=nearest)
+        with self.lock:
+            self.maps[key] = maps
+            while len(self.maps) > MAX_CACHED_MAPS:
+                self.maps.popitem(last=False)
+        return maps
+
+    def memory_usage(self):
+        with self.lock:
+            return sum(_maps_bytes(maps) for maps in self.maps.values())
+
+    def release_memory(self, target):
+        """Drops the least recently used remap tables until at most target bytes are held"""
+        with self.lock:
+            used = sum(_maps_bytes(maps) for maps in self.maps.values())
+            while self.maps and used > target:
+                _, maps = self.maps.popitem(last=False)
+                used -= _maps_bytes(maps)
+
+    def undistort_image(self, image, interpolation=cv2.INTER_LINEAR):
+        nearest = interpolation == cv2.INTER_NEAREST
+        map1, map2 = self.undistort_maps((image.shape[1], image.shape[0]), nearest)
+        if nearest:
+            # Rounded integer map alone, the (empty) fractional table must not be passed
+            map2 = None
+        return cv2.remap(image, map1, map2, interpolation, borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+
+    def undistort_points(self, points, size):
+        """Raw pixel coordinates -> undistorted pixel coordinates, (N, 2) in and out"""
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 1, 2)
+        if not len(points):
+            return points.reshape(0, 2)
+        K = self.camera_matrix(size)
+        return cv2.undistortPointsIter(points, K, self.dist, None, K, UNDISTORT_CRITERIA).reshape(-1, 2)
+
+    def distort_points(self, points, size):
+        """Undistorted pixel coordinates -> raw pixel coordinates, (N, 2) in and out"""
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        if not len(points):
+            return points
+        K = self.camera_matrix(size)
+        # Normalized rays of the undistorted pixels, projected through the lens model
+        normalized = (points - K[:2, 2]) / [K[0, 0], K[1, 1]]
+        rays = np.column_stack([normalized, np.ones(len(points))])
+        projected, _ = cv2.projectPoints(rays, np.zeros(3), np.zeros(3), K, self.dist)
+        return projected.reshape(-1, 2)
+
+
+def load_calibration(path=CALIBRATION_FILE):
+    """{'rgb': CameraModel, 'depth': CameraModel} for the cameras in the file, {} without one"""
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        data = json.load(f)
+    return {side: CameraModel(c["fx"], c["fy"], c["cx"], c["cy"], c.get("dist", []),
+                              c.get("width"), c.get("height"))
+            for side, c in data.items() if side in ("rgb", "depth")}
+
+
+def undistort(calibration, side, image, interpolation=None):
+    """Undistorts an rgb or depth image if that camera is calibrated. Depth is never interpolated."""
+    camera = calibration.get(side) if calibration else None
+    if camera is None or image is None:
+        return image
+    if interpolation is None:
+        interpolation = cv2.INTER_NEAREST if side == "depth" else cv2.INTER_LINEAR
+    return camera.undistort_image(image, interpolation)
+
+
+def convert_points(calibration, side, points, size, to_undistorted):
+    """Converts points between raw and undistorted space, unchanged if that camera isn't calibrated"""
+    camera = calibration.get(side) if calibration else None
+    if camera is None or not len(points):
+        return np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if to_undistorted:
+        return camera.undistort_points(points, size)
+    return camera.distort_points(points, size)
+
+
+def check_nearest(camera, size):
+    """
+    Fraction of pixels where nearest-neighbour undistortion with the cached
+    fixed-point maps matches cv2.remap with float maps (should be 1.0)
+    """
+    width, height = int(size[0]), int(size[1])
+    image = np.random.default_rng(0).integers(0, 65536, (height, width), dtype=np.uint16)
+    map_x, map_y = camera.float_maps((width, height))
+    reference = cv2.remap(image, map_x, map_y, cv2.INTER_NEAREST, borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+    return float(np.mean(camera.undistort_image(image, cv2.INTER_NEAREST) == reference))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the cached undistortion maps against float remap tables")
+    parser.add_argument("calibration", nargs="?", default=CALIBRATION_FILE)
+    parser.add_argument("--size", type=int, nargs=2, metavar=("WIDTH", "HEIGHT"),
+                        help="Image size (default: the calibration resolution, else 640 480)")
+    args = parser.parse_args()
+
+    calibration = load_calibration(args.calibration)
+    if not calibration:
+        raise SystemExit(f"No cameras in {args.calibration}")
+    failed = False
+    for side, camera in calibration.items():
+        size = args.size or camera.size or (640, 480)
+        match = check_nearest(camera, size)
+        print(f"{side}: nearest-neighbour undistortion matches float maps on {100 * match:.2f}% of pixels")
+        failed |= match < 1.0
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import os
+import threading
+import weakref
+
+# Budget in MB for everything the governor tracks, overridable with this variable
+BUDGET_ENV = "ANNOTATION_MEMORY_MB"
+DEFAULT_BUDGET_MB = 1024
+MB = 1024 * 1024
+
+# Release order, cheapest to rebuild first
+PRIORITY_VALIDITY = 10
+PRIORITY_PREVIEWS = 20
+PRIORITY_MAPS = 30
+PRIORITY_VIEW = 40
+
+
+def array_bytes(arrays):
+    """Bytes of the distinct numpy arrays in arrays (None and repeats are skipped)"""
+    seen, total = set(), 0
+    for array in arrays:
+        if array is not None and id(array) not in seen:
+            seen.add(id(array))
+            total += array.nbytes
+    return total
+
+
+class MemoryGovernor:
+    """
+    Central account of the memory held by image caches and display buffers,
+    checked against a budget. Consumers implement memory_usage() (bytes) and
+    release_memory(target) (drop, evict or downscale until at most target
+    bytes are held) and are asked to release, lowest priority first, when the
+    total is over budget. Tracked buffers (the images on screen) are counted
+    but never released. Consumers are held by weak references.
+    """
+
+    def __init__(self, budget=None):
+        if budget is None:
+            budget = int(float(os.environ.get(BUDGET_ENV, DEFAULT_BUDGET_MB)) * MB)
+        self.budget = budget
+        self.consumers = []  # (priority, name, weakref)
+        self.tracked = []  # (name, callable returning arrays)
+        self.lock = threading.Lock()
+
+    def register(self, name, consumer, priority):
+        with self.lock:
+            self.consumers.append((priority, name, weakref.ref(consumer)))
+            self.consumers.sort(key=lambda item: item[0])
+
+    def track(self, name, arrays):
+        """Counts the arrays returned by the callable arrays, without ever releasing them"""
+        with self.lock:
+            self.tracked.append((name, arrays))
+
+    def _live(self):
+        with self.lock:
+            self.consumers = [item for item in self.consumers if item[2]() is not None]
+            return [(priority, name, ref()) for priority, name, ref in self.consumers], list(self.tracked)
+
+    def usage(self):
+        """[(name, bytes, releasable)] of every consumer and tracked buffer"""
+        consumers, tracked = self._live()
+        rows = [(name, consumer.memory_usage(), True) for _, name, consumer in consumers]
+        rows += [(name, array_bytes(arrays()), False) for name, arrays in tracked]
+        return rows
+
+    def total(self):
+        return sum(size for _, size, _ in self.usage())
+
+    def enforce(self):
+        """Releases memory in priority order until the total fits the budget. Returns the bytes freed."""
+        consumers, tracked = self._live()
+        sizes = [consumer.memory_usage() for _, _, consumer in consumers]
+        excess = sum(sizes) + sum(array_bytes(arrays()) for _, arrays in tracked) - self.budget
+        freed = 0
+        for (_, _, consumer), size in zip(consumers, sizes):
+            if excess <= 0:
+                break
+            if not size:
+                continue
+            consumer.release_memory(max(size - excess, 0))
+            released = size - consumer.memory_usage()
+            freed += released
+            excess -= released
+        return freed
+
+    def status(self):
+        """Short usage text for the UI"""
+        return f"Memory: {self.total() / MB:.0f} / {self.budget / MB:.0f} MB"
+
+    def dump(self):
+        """Usage of every consumer, for debugging"""
+        rows = self.usage()
+        lines = [f"{name:<32}{size / MB:>10.1f} MB{'' if releasable else '  (pinned)'}"
+                 for name, size, releasable in rows]
+        lines.append(f"{'total':<32}{sum(size for _, size, _ in rows) / MB:>10.1f} MB")
+        lines.append(f"{'budget':<32}{self.budget / MB:>10.1f} MB")
+        return "\n".join(lines)
+
+
+_governor = None
+_governor_lock = threading.Lock()
+
+
+def governor():
+    """The process-wide governor shared by every tool"""
+    global _governor
+    with _governor_lock:
+        if _governor is None:
+            _governor = MemoryGovernor()
+        return _governor
@@ -0,0 +1,200 @@
+import math
+from collections import defaultdict
+
+# Grid cell size in image pixels, about the size of a point marker
+DEFAULT_CELL_SIZE = 16
+# Distance in canvas pixels within which a click grabs a point
+HIT_RADIUS = 8
+
+POINT_STYLE = {"fill": "white", "outline": "black", "width": 2}
+SELECTED_FILL = "red"
+# Outline of points that failed a check, e.g. depth points on invalid depth
+FLAGGED_OUTLINE = "orange"
+LINE_STYLE = {"fill": "yellow", "width": 2}
+LABEL_STYLE = {"fill": "white", "font": ("Arial", 12, "bold")}
+
+
+class PointIndex:
+    """
+    Uniform grid over a list of 2D points. Lookups only visit the cells around
+    the query and moving a point touches two cells, so hit-testing stays cheap
+    during drag motion events however many points there are.
+    """
+
+    def __init__(self, cell_size=DEFAULT_CELL_SIZE):
+        self.cell_size = cell_size
+        self.positions = []
+        self.cells = defaultdict(set)
+
+    def _cell(self, x, y):
+        return int(x // self.cell_size), int(y // self.cell_size)
+
+    def rebuild(self, points):
+        self.positions = [(x, y) for x, y in points]
+        self.cells = defaultdict(set)
+        for i, (x, y) in enumerate(self.positions):
+            self.cells[self._cell(x, y)].add(i)
+
+    def add(self, x, y):
+        self.positions.append((x, y))
+        i = len(self.positions) - 1
+        self.cells[self._cell(x, y)].add(i)
+        return i
+
+    def move(self, i, x, y):
+        old = self._cell(*self.positions[i])
+        new = self._cell(x, y)
+        if old != new:
+            self.cells[old].discard(i)
+            self.cells[new].add(i)
+        self.positions[i] = (x, y)
+
+    def remove(self, i):
+        # Later points shift down by one, cheaper to rebuild than to renumber cell by cell
+        self.rebuild(self.positions[:i] + self.positions[i + 1:])
+
+    def swap(self, i, j):
+        pi, pj = self.positions[i], self.positions[j]
+        self.move(i, *pj)
+        self.move(j, *pi)
+
+    def nearest(self, x, y, radius):
+        """Index of the closest point within radius of (x, y), or None"""
+        cx, cy = self._cell(x, y)
+        reach = int(math.ceil(radius / self.cell_size))
+        best, best_dist = None, radius * radius
+        for gx in range(cx - reach, cx + reach + 1):
+            for gy in range(cy - reach, cy + reach + 1):
+                for i in self.cells.get((gx, gy), ()):
+                    px, py = self.positions[i]
+                    dist = (px - x) ** 2 + (py - y) ** 2
+                    if dist <= best_dist:
+                        best, best_dist = i, dist
+        return best
+
+
+class PointLayer:
+    """
+    Canvas items of an ordered polyline of numbered points. Points are given in
+    image coordinates and drawn at 'scale'; edits update only the items they
+    affect instead of redrawing every point.
+    """
+
+    def __init__(self, canvas, hit_radius=HIT_RADIUS):
+        self.canvas = canvas
+        self.hit_radius = hit_radius
+        self.scale = 1.0
+        self.points = []
+        self.markers = []  # (oval, label) item ids per point
+        self.lines = []  # Line i joins point i and i+1
+        self.index = PointIndex()
+        self.selected = None
+
+    def _marker_coords(self, x, y):
+        x, y = x * self.scale, y * self.scale
+        return (x - 4, y - 4, x + 4, y + 4), (x, y - 15)
+
+    def _line_coords(self, i):
+        (x1, y1), (x2, y2) = self.points[i], self.points[i + 1]
+        s = self.scale
+        return x1 * s, y1 * s, x2 * s, y2 * s
+
+    def _create_marker(self, i):
+        oval_coords, label_coords = self._marker_coords(*self.points[i])
+        oval = self.canvas.create_oval(*oval_coords, tags="point", **POINT_STYLE)
+        label = self.canvas.create_text(*label_coords, text=str(i + 1), tags="label", **LABEL_STYLE)
+        return oval, label
+
+    def _create_line(self, i):
+        line = self.canvas.create_line(*self._line_coords(i), tags="line", **LINE_STYLE)
+        # Lines stay below the point markers (created first)
+        self.canvas.tag_lower(line, self.markers[0][0])
+        return line
+
+    def clear(self):
+        for oval, label in self.markers:
+            self.canvas.delete(oval, label)
+        for line in self.lines:
+            self.canvas.delete(line)
+        self.points, self.markers, self.lines = [], [], []
+        self.index.rebuild([])
+        self.selected = None
+
+    def set_points(self, points, scale=None):
+        """Replaces every item, used when the image or the whole point set changes"""
+        selected = self.selected
+        self.clear()
+        if scale is not None:
+            self.scale = scale
+        self.points = [(x, y) for x, y in points]
+        self.index.rebuild(self.points)
+        self.markers = [self._create_marker(i) for i in range(len(self.points))]
+        self.lines = [self._create_line(i) for i in range(len(self.points) - 1)]
+        if selected is not None and selected < len(self.points):
+            self.select(selected)
+
+    def hit(self, canvas_x, canvas_y):
+        """Index of the point under a canvas position, or None"""
+        return self.index.nearest(canvas_x / self.scale, canvas_y / self.scale,
+                                  self.hit_radius / self.scale)
+
+    def select(self, i):
+        if self.selected is not None and self.selected < len(self.markers):
+            self.canvas.itemconfig(self.markers[self.selected][0], fill=POINT_STYLE["fill"])
+        self.selected = i
+        if i is not None:
+            self.canvas.itemconfig(self.markers[i][0], fill=SELECTED_FILL)
+
+    def flag(self, i, flagged):
+        outline = FLAGGED_OUTLINE if flagged else POINT_STYLE["outline"]
+        self.canvas.itemconfig(self.markers[i][0], outline=outline)
+
+    def set_flags(self, flags):
+        for i, flagged in enumerate(flags):
+            self.flag(i, flagged)
+
+    def add(self, x, y):
+        self.points.append((x, y))
+        self.index.add(x, y)
+        i = len(self.points) - 1
+        if i > 0:
+            self.lines.append(self._create_line(i - 1))
+        self.markers.append(self._create_marker(i))
+
+    def move(self, i, x, y):
+        self.points[i] = (x, y)
+        self.index.move(i, x, y)
+        oval_coords, label_coords = self._marker_coords(x, y)
+        oval, label = self.markers[i]
+        self.canvas.coords(oval, *oval_coords)
+        self.canvas.coords(label, *label_coords)
+        for line in (i - 1, i):
+            if 0 <= line < len(self.lines):
+                self.canvas.coords(self.lines[line], *self._line_coords(line))
+
+    def delete(self, i):
+        oval, label = self.markers.pop(i)
+        self.canvas.delete(oval, label)
+        del self.points[i]
+        self.index.remove(i)
+
+        # The lines on both sides of the point become one line between its neighbours
+        if self.lines:
+            self.canvas.delete(self.lines.pop(min(i, len(self.lines) - 1)))
+            if 0 < i < len(self.points):
+                self.canvas.coords(self.lines[i - 1], *self._line_coords(i - 1))
+        for j in range(i, len(self.markers)):
+            self.canvas.itemconfig(self.markers[j][1], text=str(j + 1))
+
+        if self.selected == i:
+            self.selected = None
+        elif self.selected is not None and self.selected > i:
+            self.selected -= 1
+
+    def swap(self, i, j):
+        """Exchanges the order of two points, the markers keep their numbers"""
+        pi, pj = self.points[i], self.points[j]
+        self.move(i, *pj)
+        self.move(j, *pi)
+        if self.selected in (i, j):
+            self.select(j if self.selected == i else i)
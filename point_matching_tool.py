@@ -1,12 +1,29 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
-from tkinter import filedialog
-from PIL import Image, ImageTk
+from tkinter import filedialog, simpledialog
 import cv2
 import numpy as np
 import os
-import pandas as pd
-import json
+import queue
+import threading
+from annotation_qa import run_qa, write_report
+from depth_sampling import load_intrinsics, sample_landmarks, export_landmarks
+from annotation_client import AnnotationClient
+from annotation_core import (AnnotationStore, OffsetTransform, POINTS_FILE, DEFAULT_OFFSET, load_pairs,
+                             prefetch_paths, image_size, entry_points, make_entry, find_image,
+                             normalize_path)
+from progressive_loading import ProgressiveLoader, POLL_INTERVAL_MS
+from dataset_scan import navigable_mask, find_next_index
+from region_metrics import compute_region_metrics, export_region_metrics
+from point_editing import PointLayer
+from image_viewer import ZoomableView
+from lens_calibration import load_calibration
+from frame_dedup import find_duplicates, copy_to_cluster, CACHE_NAME
+from depth_validity import ValidityCache
+from dataset_watch import DatasetWatcher, prepare_pairs, append_pairs, WATCH_POLL_MS
+from keyframe_interpolation import METHODS, refill, keyframes, promote, is_interpolated, unindexed_keys
+from session_telemetry import TelemetryLog, telemetry_path, IMAGE_ID_COMPONENTS
+from memory_budget import governor, PRIORITY_VALIDITY, PRIORITY_PREVIEWS, PRIORITY_MAPS, PRIORITY_VIEW
 
 class ScrollableFrame(ttk.Frame):
     def __init__(self, container, *args, **kwargs):
@@ -28,42 +45,10 @@ class ScrollableFrame(ttk.Frame):
         self.scrollbar_x.pack(side="bottom", fill="x")
         self.canvas.pack(side="left", fill="both", expand=True)
 
-def create_dataset_df(main_path):
-    """
-    Recibe el directorio principal del dataset y retorna un DataFrame
-    con las rutas de las imágenes rgb y su correspondiente imagen de profundidad.
-    """
-    # Directorios de imágenes rgb y depth
-    rgb_dir = os.path.join(main_path, "rgb")
-    depth_dir = os.path.join(main_path, "depth")
-    
-    # Verificar que los directorios existan
-    if not os.path.exists(rgb_dir):
-        raise FileNotFoundError(f"No se encontró el directorio: {rgb_dir}")
-    if not os.path.exists(depth_dir):
-        raise FileNotFoundError(f"No se encontró el directorio: {depth_dir}")
-    
-    # Obtener la lista de archivos en la carpeta rgb
-    rgb_files = os.listdir(rgb_dir)
-    
-    # Crear una lista para almacenar las rutas correspondientes de cada imagen
-    data = []
-    for file in rgb_files:
-        rgb_image_path = os.path.join(rgb_dir, file)
-        depth_image_path = os.path.join(depth_dir, file)
-        
-        # Verificar que la imagen de profundidad exista
-        if os.path.exists(depth_image_path):
-            data.append({
-                "rgb": rgb_image_path,
-                "depth": depth_image_path
-            })
-        else:
-            print(f"Warning: No se encontró la imagen de profundidad para: {file}")
-    
-    # Crear el DataFrame
-    df = pd.DataFrame(data)
-    return df
+
+# Largest canvas of each image, bigger images start zoomed out to fit
+DUAL_VIEWPORT = (640, 480)
+
 
 class DualImageMatchingApp:
     def __init__(self, master):
@@ -92,28 +77,67 @@ class DualImageMatchingApp:
             self.depth_points = []
             self.rgb_lines = []
             self.depth_lines = []
-            self.current_rgb_image_tk = None
-            self.current_depth_image_tk = None
+
+            # Point being dragged on the RGB canvas and whether it actually moved
+            self.drag_index = None
+            self.drag_moved = False
+
+            # Images on screen: a reduced preview (display_scale pixels per full-resolution pixel)
+            # while the full-resolution pair loads. Points are always kept in full-resolution
+            # coordinates, canvas = image * view zoom
+            self.rgb_display_cv = None
+            self.depth_display_cv = None
+            self.display_scale = 1.0
+            # Optional lens calibration, images are shown (and points placed) undistorted
+            self.calibration = load_calibration()
+            # Invalid-depth mask and distance transform of each full depth frame, built by the loader
+            self.validity_cache = ValidityCache()
+            self.depth_validity = None
+            self.loader = ProgressiveLoader(calibration=self.calibration, validity=self.validity_cache)
+            self.full_image_poll = None
+            # Opt-in timing of clicks, edits and navigation (ANNOTATION_TELEMETRY), no-op when off
+            self.telemetry = TelemetryLog(telemetry_path(), "point_mapping")
+
+            # Caches and images on screen count against the memory budget shared by both tools
+            self.memory = governor()
+            self.memory.register("point mapping depth validity", self.validity_cache, PRIORITY_VALIDITY)
+            self.memory.register("point mapping previews", self.loader.previews, PRIORITY_PREVIEWS)
+            for side, camera in self.calibration.items():
+                self.memory.register(f"point mapping {side} remap tables", camera, PRIORITY_MAPS)
+            self.memory.register("point mapping RGB view", self.rgb_view, PRIORITY_VIEW)
+            self.memory.register("point mapping depth view", self.depth_view, PRIORITY_VIEW)
+            self.memory.track("point mapping images", lambda: [self.rgb_image_cv, self.depth_image_cv,
+                                                               self.rgb_display_cv, self.depth_display_cv])
 
             # Add dataset variables
             self.dataset_df = None
+            self.dataset_folder = None
+            self.dataset_loading = False  # Scan of a new dataset running
             self.current_index = -1
+            # Background watcher of the dataset folders, None when not watching
+            self.dataset_watcher = None
+            self.watch_poll = None
             
             # Add dataset controls
             self.add_dataset_controls()
 
-            # Add storage for points per image
-            self.points_storage = {}  # Format: {image_index: {'rgb_points': [], 'depth_points': [], 'rgb_lines': [], 'depth_lines': []}}
-            
-            # JSON file for saving points
-            self.json_file = "labeled_points.json"
+            # Points per image, saved to the JSON file or, once connected, to the annotation server
+            self.json_file = POINTS_FILE
+            self.store = AnnotationStore(self.json_file)
             self.load_points_from_json()
+
+            # Depth camera intrinsics used for the 3D position of the points
+            self.intrinsics_file = "camera_intrinsics.json"
+            self.intrinsics = load_intrinsics(self.intrinsics_file)
         except Exception as e:
             self.show_error("Error initializing application", str(e))
 
     def show_error(self, title, message):
         messagebox.showerror(title, message)
 
+    def show_warning(self, title, message):
+        messagebox.showwarning(title, message)
+
     def create_control_panel(self):
         control_panel = ttk.Frame(self.main_frame.scrollable_frame)
         control_panel.pack(fill=tk.X, pady=10)
@@ -134,6 +158,19 @@ class DualImageMatchingApp:
         self.clear_button = ttk.Button(btn_frame, text="Clear Points", command=self.clear_points)
         self.clear_button.pack(side=tk.LEFT, padx=5)
 
+        # Editing of the selected point (click a point to select it, drag to move it)
+        self.delete_point_button = ttk.Button(btn_frame, text="Delete Point",
+                                              command=self.delete_selected_point)
+        self.delete_point_button.pack(side=tk.LEFT, padx=5)
+
+        self.move_earlier_button = ttk.Button(btn_frame, text="Move Earlier",
+                                              command=lambda: self.move_selected_point(-1))
+        self.move_earlier_button.pack(side=tk.LEFT, padx=5)
+
+        self.move_later_button = ttk.Button(btn_frame, text="Move Later",
+                                            command=lambda: self.move_selected_point(1))
+        self.move_later_button.pack(side=tk.LEFT, padx=5)
+
         # Offset controls
         offset_frame = ttk.LabelFrame(control_panel, text="Depth Map Offset")
         offset_frame.pack(pady=5, padx=10, fill=tk.X)
@@ -143,12 +180,12 @@ class DualImageMatchingApp:
         x_frame.pack(fill=tk.X, pady=2)
         ttk.Label(x_frame, text="X Offset:").pack(side=tk.LEFT, padx=5)
         
-        self.x_offset_var = tk.StringVar(value="36")
+        self.x_offset_var = tk.StringVar(value=str(DEFAULT_OFFSET[0]))
         self.x_offset_entry = ttk.Entry(x_frame, textvariable=self.x_offset_var, width=5)
         self.x_offset_entry.pack(side=tk.LEFT, padx=5)
         
         self.x_offset_slider = ttk.Scale(x_frame, from_=-100, to=100, orient="horizontal")
-        self.x_offset_slider.set(36)
+        self.x_offset_slider.set(DEFAULT_OFFSET[0])
         self.x_offset_slider.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
 
         # Control Y
@@ -156,14 +193,20 @@ class DualImageMatchingApp:
         y_frame.pack(fill=tk.X, pady=2)
         ttk.Label(y_frame, text="Y Offset:").pack(side=tk.LEFT, padx=5)
         
-        self.y_offset_var = tk.StringVar(value="-8")
+        self.y_offset_var = tk.StringVar(value=str(DEFAULT_OFFSET[1]))
         self.y_offset_entry = ttk.Entry(y_frame, textvariable=self.y_offset_var, width=5)
         self.y_offset_entry.pack(side=tk.LEFT, padx=5)
         
         self.y_offset_slider = ttk.Scale(y_frame, from_=-100, to=100, orient="horizontal")
-        self.y_offset_slider.set(-8)
+        self.y_offset_slider.set(DEFAULT_OFFSET[1])
         self.y_offset_slider.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
 
+        # Depth points on holes or depth edges are outlined; optionally moved to the nearest valid pixel
+        self.snap_var = tk.BooleanVar(value=False)
+        self.snap_check = ttk.Checkbutton(offset_frame, text="Snap depth points to valid depth",
+                                          variable=self.snap_var, command=self.update_depth_points)
+        self.snap_check.pack(anchor=tk.W, padx=5, pady=2)
+
         # Bind events
         self.bind_offset_events()
         
@@ -176,15 +219,27 @@ class DualImageMatchingApp:
         # Title
         ttk.Label(container, text=f"{title} Image", font=("Arial", 12, "bold")).pack(pady=5)
 
-        # Canvas for image
+        # Canvas for image, zoomed with the wheel and panned with the middle button
         canvas = tk.Canvas(container, width=400, height=400)
         canvas.pack(pady=5)
         
         if is_rgb:
             self.rgb_canvas = canvas
+            self.rgb_view = ZoomableView(canvas, DUAL_VIEWPORT, on_zoom=self.redraw_points,
+                                         on_view=self.sync_depth_view)
+            self.rgb_layer = PointLayer(canvas)
             canvas.bind("<Button-1>", self.on_rgb_click)
+            canvas.bind("<B1-Motion>", self.on_rgb_drag)
+            canvas.bind("<ButtonRelease-1>", self.on_rgb_release)
+            canvas.bind("<Delete>", lambda e: self.delete_selected_point())
+            canvas.bind("<BackSpace>", lambda e: self.delete_selected_point())
         else:
             self.depth_canvas = canvas
+            self.depth_view = ZoomableView(canvas, DUAL_VIEWPORT, on_zoom=self.redraw_points)
+            self.depth_layer = PointLayer(canvas)
+            # Metrics of the region outlined by the depth points
+            self.region_metrics_label = ttk.Label(container, text="")
+            self.region_metrics_label.pack(pady=2)
 
         # Points list
         points_frame = ttk.LabelFrame(container, text=f"Points in {title} Image")
@@ -216,7 +271,7 @@ class DualImageMatchingApp:
                 self.rgb_image_cv = cv2.imread(path, cv2.IMREAD_UNCHANGED)
                 if self.rgb_image_cv is None:
                     raise IOError("Could not load image. The file may be corrupted or in an unsupported format.")
-                self.update_canvas()
+                self.show_full_images()
         except Exception as e:
             self.show_error("Error loading RGB image", str(e))
 
@@ -230,109 +285,164 @@ class DualImageMatchingApp:
                 self.depth_image_cv = cv2.imread(path, cv2.IMREAD_UNCHANGED)
                 if self.depth_image_cv is None:
                     raise IOError("Could not load image. The file may be corrupted or in an unsupported format.")
-                self.update_canvas()
+                self.depth_validity = self.validity_cache.get(path, self.depth_image_cv)
+                self.show_full_images()
         except Exception as e:
             self.show_error("Error loading depth map", str(e))
 
+    def show_full_images(self):
+        """Displays the full-resolution images, dropping any pending background load"""
+        self.loader.cancel()
+        self.rgb_display_cv = self.rgb_image_cv
+        self.depth_display_cv = self.depth_image_cv
+        self.display_scale = 1.0
+        self.update_canvas()
+        self.update_point_lists()
+
     def update_canvas(self):
         try:
-            if self.rgb_image_cv is not None:
-                rgb_display = cv2.cvtColor(self.rgb_image_cv, cv2.COLOR_BGR2RGB)
-                rgb_img = Image.fromarray(rgb_display)
-                self.current_rgb_image_tk = ImageTk.PhotoImage(rgb_img)
-                
-                self.rgb_canvas.config(width=rgb_img.width, height=rgb_img.height)
-                self.rgb_canvas.delete("all")
-                self.rgb_canvas.create_image(0, 0, image=self.current_rgb_image_tk, anchor="nw")
-                self.redraw_points()
-
-            if self.depth_image_cv is not None:
-                depth_display = cv2.cvtColor(self.depth_image_cv, cv2.COLOR_BGR2RGB)
-                depth_img = Image.fromarray(depth_display)
-                self.current_depth_image_tk = ImageTk.PhotoImage(depth_img)
-                
-                self.depth_canvas.config(width=depth_img.width, height=depth_img.height)
-                self.depth_canvas.delete("all")
-                self.depth_canvas.create_image(0, 0, image=self.current_depth_image_tk, anchor="nw")
-                self.redraw_points()
+            # Zoom and position are kept while the size doesn't change (preview -> full frame)
+            if self.rgb_display_cv is not None:
+                self.rgb_view.set_image(self.rgb_display_cv, self.display_scale)
+            if self.depth_display_cv is not None:
+                self.depth_view.set_image(self.depth_display_cv, self.display_scale)
+            self.redraw_points()
         except Exception as e:
             self.show_error("Error updating display", str(e))
 
+    def sync_depth_view(self):
+        """The depth view follows the RGB view, shifted by the offset so both show the same spot"""
+        if self.depth_view.full_size is None:
+            return
+        x, y = self.rgb_view.center()
+        self.depth_view.set_view(self.rgb_view.zoom,
+                                 (x + int(self.x_offset_var.get()), y + int(self.y_offset_var.get())))
+
     def on_rgb_click(self, event):
-        if self.rgb_image_cv is None or self.depth_image_cv is None:
+        if self.rgb_display_cv is None or self.depth_display_cv is None:
             return
 
-        x = event.x
-        y = event.y
+        # Keyboard focus for Delete/BackSpace on the selected point
+        self.rgb_canvas.focus_set()
+
+        # Clicking an existing point selects it and starts dragging it
+        hit = self.rgb_layer.hit(self.rgb_canvas.canvasx(event.x), self.rgb_canvas.canvasy(event.y))
+        if hit is not None:
+            self.select_point(hit)
+            self.drag_index = hit
+            self.drag_moved = False
+            return
+        self.select_point(None)
+
+        # Canvas -> full-resolution image coordinates, whatever the zoom and the shown resolution
+        x, y = self.rgb_view.to_image(event.x, event.y)
+        x, y = int(round(x)), int(round(y))
+        w, h = self.rgb_view.full_size
+        if not (0 <= x < w and 0 <= y < h):
+            return
         
         # Add point in RGB image
-        rgb_point_id = self.rgb_canvas.create_oval(x-4, y-4, x+4, y+4, 
-                                                 fill="white", outline="black", width=2, tags="point")
-        self.rgb_points.append((x, y, rgb_point_id))
+        self.rgb_points.append((x, y, None))
         
         # Calculate position in depth image
-        x_offset = int(self.x_offset_var.get())
-        y_offset = int(self.y_offset_var.get())
-        depth_x = x + x_offset
-        depth_y = y + y_offset
-        
-        # Create depth point
-        depth_point_id = self.depth_canvas.create_oval(depth_x-4, depth_y-4, depth_x+4, depth_y+4, 
-                                                     fill="white", outline="black", width=2, tags="point")
-        self.depth_points.append((depth_x, depth_y, depth_point_id))
-
-        # Create lines if there are previous points
-        if len(self.rgb_points) > 1:
-            prev_x, prev_y, _ = self.rgb_points[-2]
-            rgb_line_id = self.rgb_canvas.create_line(prev_x, prev_y, x, y, 
-                                                     fill="yellow", width=2, tags="line")
-            self.rgb_lines.append(rgb_line_id)
-            
-            prev_depth_x, prev_depth_y, _ = self.depth_points[-2]
-            depth_line_id = self.depth_canvas.create_line(prev_depth_x, prev_depth_y, depth_x, depth_y, 
-                                                        fill="yellow", width=2, tags="line")
-            self.depth_lines.append(depth_line_id)
+        (depth_x, depth_y), = self.place_depth_points([(x, y)])
+        self.depth_points.append((depth_x, depth_y, None))
+
+        self.telemetry.record("click", self.current_index)
 
         # Store points for current image
         if self.current_index >= 0:
-            self.points_storage[str(self.current_index)] = {
-                'rgb_points': [(x, y) for x, y, _ in self.rgb_points],
-                'depth_points': [(x, y) for x, y, _ in self.depth_points],
-                'image_paths': {
-                    'rgb': self.dataset_df.iloc[self.current_index]['rgb'],
-                    'depth': self.dataset_df.iloc[self.current_index]['depth']
-                }
-            }
-            self.save_points_to_json()
-
-        # Update visualization
-        self.redraw_points()
-        self.update_point_lists()
+            self.store_current_points()
 
-    def redraw_points(self):
-        # Clear canvas
-        self.rgb_canvas.delete("point", "line", "label")
-        self.depth_canvas.delete("point", "line", "label")
-
-        # Draw points and lines in RGB
-        for i, (x, y, _) in enumerate(self.rgb_points, 1):
-            self.draw_point(self.rgb_canvas, x, y, f"PO{i}")
-            if i > 1:
-                prev_x, prev_y, _ = self.rgb_points[i-2]
-                self.rgb_canvas.create_line(prev_x, prev_y, x, y, fill="yellow", width=2, tags="line")
+        # Update visualization, only the new items are drawn
+        self.rgb_layer.add(x, y)
+        self.depth_layer.add(depth_x, depth_y)
+        self.update_point_lists()
 
-        # Draw points and lines in Depth
-        for i, (x, y, _) in enumerate(self.depth_points, 1):
-            self.draw_point(self.depth_canvas, x, y, f"PD{i}")
-            if i > 1:
-                prev_x, prev_y, _ = self.depth_points[i-2]
-                self.depth_canvas.create_line(prev_x, prev_y, x, y, fill="yellow", width=2, tags="line")
+    def on_rgb_drag(self, event):
+        if self.drag_index is None:
+            return
+        x, y = self.rgb_view.to_image(event.x, event.y)
+        w, h = self.rgb_view.full_size
+        x = int(round(min(max(x, 0), w - 1)))
+        y = int(round(min(max(y, 0), h - 1)))
+        (depth_x, depth_y), = self.place_depth_points([(x, y)])
+
+        i = self.drag_index
+        self.rgb_points[i] = (x, y, None)
+        self.depth_points[i] = (depth_x, depth_y, None)
+        self.rgb_layer.move(i, x, y)
+        self.depth_layer.move(i, depth_x, depth_y)
+        if self.depth_validity is not None:
+            self.depth_layer.flag(i, not self.depth_validity.check([(depth_x, depth_y)])[0][0])
+        self.drag_moved = True
+
+    def on_rgb_release(self, event):
+        # Lists, depth sampling and storage are only refreshed once the drag ends
+        if self.drag_index is not None and self.drag_moved:
+            self.telemetry.record("move", self.current_index)
+            self.save_point_edit()
+        self.drag_index = None
+        self.drag_moved = False
+
+    def select_point(self, index):
+        self.rgb_layer.select(index)
+        self.depth_layer.select(index)
+
+    def delete_selected_point(self):
+        i = self.rgb_layer.selected
+        if i is None:
+            return
+        del self.rgb_points[i]
+        del self.depth_points[i]
+        self.rgb_layer.delete(i)
+        self.depth_layer.delete(i)
+        self.telemetry.record("delete", self.current_index)
+        self.save_point_edit()
+
+    def move_selected_point(self, step):
+        """Moves the selected point one place earlier (-1) or later (1) in the point order"""
+        i = self.rgb_layer.selected
+        if i is None or not 0 <= i + step < len(self.rgb_points):
+            return
+        j = i + step
+        self.rgb_points[i], self.rgb_points[j] = self.rgb_points[j], self.rgb_points[i]
+        self.depth_points[i], self.depth_points[j] = self.depth_points[j], self.depth_points[i]
+        self.rgb_layer.swap(i, j)
+        self.depth_layer.swap(i, j)
+        self.telemetry.record("reorder", self.current_index)
+        self.save_point_edit()
+
+    def save_point_edit(self):
+        """Stores the current image's points after an edit and refreshes the point lists"""
+        if self.current_index >= 0:
+            if self.rgb_points:
+                self.store_current_points()
+            elif self.store.pop(self.current_index) is not None:
+                self.save_points(str(self.current_index))
+        self.update_point_lists()
 
-    def draw_point(self, canvas, x, y, label):
-        canvas.create_oval(x-4, y-4, x+4, y+4, fill="white", outline="black", width=2, tags="point")
-        # Get only the number from label (removing 'PO' or 'PD')
-        number = label[2:]
-        canvas.create_text(x, y-15, text=number, fill="white", font=("Arial", 12, "bold"), tags="label")
+    def redraw_points(self):
+        # Points are stored in image coordinates, the layers scale them to the zoom of each view
+        self.rgb_layer.set_points([(x, y) for x, y, _ in self.rgb_points], self.rgb_view.zoom)
+        self.depth_layer.set_points([(x, y) for x, y, _ in self.depth_points], self.depth_view.zoom)
+        flags = self.depth_point_flags()
+        if flags is not None:
+            self.depth_layer.set_flags(flags)
+
+    def offset_transform(self):
+        return OffsetTransform(int(self.x_offset_var.get()), int(self.y_offset_var.get()))
+
+    def place_depth_points(self, rgb_points):
+        """Depth positions of RGB points: rgb + offset, snapped to valid depth if enabled"""
+        return self.offset_transform().to_depth(rgb_points, self.depth_validity if self.snap_var.get() else None)
+
+    def depth_point_flags(self):
+        """Whether each depth point lies on an invalid depth pixel, None until the full depth map is loaded"""
+        if self.depth_validity is None or not self.depth_points:
+            return None
+        valid, _ = self.depth_validity.check([(x, y) for x, y, _ in self.depth_points])
+        return ~valid
 
     def update_point_lists(self):
         # Clear existing lists
@@ -347,31 +457,76 @@ class DualImageMatchingApp:
             frame.pack(fill=tk.X, padx=5, pady=2)
             ttk.Label(frame, text=f"{i}: ({int(x)}, {int(y)})").pack(padx=5, pady=2)
 
-        # Update Depth list
+        # Update Depth list with the sampled depth and 3D position of each point
+        samples = self.sample_depth_points()
+        flags = self.depth_point_flags()
+        if flags is not None:
+            self.depth_layer.set_flags(flags)
         for i, (x, y, _) in enumerate(self.depth_points, 1):
             frame = ttk.Frame(self.depth_points_frame, relief="solid", borderwidth=1)
             frame.pack(fill=tk.X, padx=5, pady=2)
-            ttk.Label(frame, text=f"{i}: ({int(x)}, {int(y)})").pack(padx=5, pady=2)
+            text = f"{i}: ({int(x)}, {int(y)})"
+            if flags is not None and flags[i-1]:
+                text += " [invalid depth]"
+            if samples is not None:
+                depth_value, (px, py, pz) = samples[0][i-1], samples[1][i-1]
+                if np.isfinite(depth_value):
+                    text += f" z={depth_value:.0f}\n({px:.3f}, {py:.3f}, {pz:.3f}) m"
+                else:
+                    text += " no valid depth"
+            ttk.Label(frame, text=text).pack(padx=5, pady=2)
+
+        self.update_region_metrics()
+
+    def update_region_metrics(self):
+        """Area, depth and volume of the polygon closed by the current depth points"""
+        if self.depth_image_cv is None or len(self.depth_points) < 3:
+            self.region_metrics_label.config(text="")
+            return
+        try:
+            polygon = [(x, y) for x, y, _ in self.depth_points]
+            metrics = compute_region_metrics(self.depth_image_cv, polygon, self.intrinsics)
+            if np.isfinite(metrics['mean_depth_m']):
+                self.region_metrics_label.config(
+                    text=f"Region: {metrics['area_px']} px, {metrics['area_m2'] * 1e4:.1f} cm², "
+                         f"mean depth {metrics['mean_depth_m']:.3f} m, "
+                         f"median {metrics['median_depth_m']:.3f} m, "
+                         f"volume {metrics['volume_m3'] * 1e3:.2f} L")
+            else:
+                self.region_metrics_label.config(text=f"Region: {metrics['area_px']} px, no valid depth")
+        except Exception as e:
+            self.region_metrics_label.config(text=f"Region metrics unavailable: {e}")
+
+    def sample_depth_points(self):
+        """Median depth and camera-space XYZ of the current depth points"""
+        if self.depth_image_cv is None or not self.depth_points:
+            return None
+        try:
+            points = [(x, y) for x, y, _ in self.depth_points]
+            _, median, xyz = sample_landmarks(self.depth_image_cv, points, self.intrinsics)
+            return median, xyz
+        except Exception as e:
+            print(f"Warning: could not sample depth points: {e}")
+            return None
 
     def update_offset(self, event=None):
         x_offset = self.x_offset_slider.get()
         y_offset = self.y_offset_slider.get()
         self.x_offset_var.set(str(int(x_offset)))
         self.y_offset_var.set(str(int(y_offset)))
+        self.telemetry.record_change("offset", self.current_index, [int(x_offset), int(y_offset)])
         self.update_depth_points()
 
     def update_offset_from_entry(self, event=None):
         try:
-            x_offset = int(self.x_offset_var.get())
-            y_offset = int(self.y_offset_var.get())
-            
-            if not (-100 <= x_offset <= 100) or not (-100 <= y_offset <= 100):
-                raise ValueError("Offset values must be between -100 and 100")
+            x_offset = OffsetTransform.check(self.x_offset_var.get())
+            y_offset = OffsetTransform.check(self.y_offset_var.get())
 
             self.x_offset_slider.set(x_offset)
             self.y_offset_slider.set(y_offset)
             self.x_offset_var.set(str(x_offset))
             self.y_offset_var.set(str(y_offset))
+            self.telemetry.record_change("offset", self.current_index, [x_offset, y_offset])
             
             self.update_depth_points()
         except ValueError as e:
@@ -385,11 +540,9 @@ class DualImageMatchingApp:
             if not self.rgb_points:
                 return
 
-            x_offset = int(self.x_offset_var.get())
-            y_offset = int(self.y_offset_var.get())
-            
             # Update depth points
-            self.depth_points = [(x + x_offset, y + y_offset, point_id) for (x, y, point_id) in self.rgb_points]
+            depth_points = self.place_depth_points([(x, y) for x, y, _ in self.rgb_points])
+            self.depth_points = [(x, y, point_id) for (x, y), (_, _, point_id) in zip(depth_points, self.rgb_points)]
             
             # Redraw all points
             self.redraw_points()
@@ -398,9 +551,10 @@ class DualImageMatchingApp:
             self.show_error("Error updating depth points", str(e))
 
     def clear_points(self):
+        self.telemetry.record("clear", self.current_index, points=len(self.rgb_points))
         # Clear current points and lines
-        self.rgb_canvas.delete("point", "line", "label")
-        self.depth_canvas.delete("point", "line", "label")
+        self.rgb_layer.clear()
+        self.depth_layer.clear()
         self.rgb_points = []
         self.depth_points = []
         self.rgb_lines = []
@@ -408,9 +562,8 @@ class DualImageMatchingApp:
         
         # If we're viewing a dataset image, also clear stored points
         if self.current_index >= 0:
-            if str(self.current_index) in self.points_storage:
-                del self.points_storage[str(self.current_index)]
-                self.save_points_to_json()
+            if self.store.pop(self.current_index) is not None:
+                self.save_points(str(self.current_index))
         
         # Update both canvases
         self.redraw_points()
@@ -434,25 +587,142 @@ class DualImageMatchingApp:
                                  command=self.next_image, state=tk.DISABLED)
         self.btn_next.pack(side=tk.LEFT, padx=5)
 
+        # Skip pairs the header scan found unreadable or mismatched
+        self.skip_invalid_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(dataset_frame, text="Skip bad pairs", variable=self.skip_invalid_var,
+                        command=self.update_navigation_buttons).pack(side=tk.LEFT, padx=5)
+
+        # Only stop at one image per group of near-duplicate frames
+        self.representatives_var = tk.BooleanVar(value=False)
+        self.representatives_check = ttk.Checkbutton(dataset_frame, text="One per duplicate group",
+                                                     variable=self.representatives_var,
+                                                     command=self.toggle_representatives)
+        self.representatives_check.pack(side=tk.LEFT, padx=5)
+
+        self.btn_copy_duplicates = ttk.Button(dataset_frame, text="Copy to Duplicates",
+                                              command=self.copy_points_to_duplicates)
+        self.btn_copy_duplicates.pack(side=tk.LEFT, padx=5)
+
+        # Keyframe mode: frames between labeled keyframes are filled by interpolation
+        self.interpolation_var = tk.StringVar(value=METHODS[0])
+        ttk.Combobox(dataset_frame, textvariable=self.interpolation_var, values=METHODS,
+                     state="readonly", width=7).pack(side=tk.LEFT, padx=(5, 0))
+        self.btn_interpolate = ttk.Button(dataset_frame, text="Fill Between Keyframes",
+                                          command=self.fill_between_keyframes)
+        self.btn_interpolate.pack(side=tk.LEFT, padx=5)
+        self.btn_accept = ttk.Button(dataset_frame, text="Accept Interpolated",
+                                     command=self.accept_interpolated)
+        self.btn_accept.pack(side=tk.LEFT, padx=5)
+
+        # Append pairs written to rgb/ and depth/ after loading (live capture)
+        self.watch_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(dataset_frame, text="Watch for new pairs", variable=self.watch_var,
+                        command=self.toggle_watch).pack(side=tk.LEFT, padx=5)
+
+        # QA report over all stored points
+        self.btn_qa = ttk.Button(dataset_frame, text="QA Report",
+                                 command=self.show_qa_report)
+        self.btn_qa.pack(side=tk.LEFT, padx=5)
+
+        # Export of the depth and 3D position of all stored points
+        self.btn_export_3d = ttk.Button(dataset_frame, text="Export 3D Points",
+                                        command=self.export_3d_points)
+        self.btn_export_3d.pack(side=tk.LEFT, padx=5)
+
+        # Batch region metrics over all stored points
+        self.btn_export_metrics = ttk.Button(dataset_frame, text="Export Metrics",
+                                             command=self.export_metrics)
+        self.btn_export_metrics.pack(side=tk.LEFT, padx=5)
+
+        # Shared annotation server
+        self.btn_server = ttk.Button(dataset_frame, text="Connect Server",
+                                     command=self.connect_to_server)
+        self.btn_server.pack(side=tk.LEFT, padx=5)
+
         # Current image label
         self.current_image_label = ttk.Label(dataset_frame, text="No dataset loaded")
         self.current_image_label.pack(side=tk.LEFT, padx=5)
 
+        # Memory use of the caches, click for the breakdown
+        self.memory_label = ttk.Label(dataset_frame, text=self.memory.status(), cursor="hand2")
+        self.memory_label.pack(side=tk.LEFT, padx=5)
+        self.memory_label.bind("<Button-1>", lambda e: self.show_memory_dump())
+
     def load_dataset(self):
+        folder = filedialog.askdirectory(title="Select Dataset Root Folder")
+        if not folder:
+            return
+        # Header-only integrity scan in the background, bad pairs are marked and can be skipped
+        self.dataset_loading = True
+        self.btn_load_dataset.config(state=tk.DISABLED)
+        self.current_image_label.config(text="Scanning dataset...")
+
+        def on_done(dataset_df):
+            self.dataset_loading = False
+            self.btn_load_dataset.config(state=tk.NORMAL)
+            self.dataset_loaded(folder, dataset_df)
+
+        def on_error():
+            self.dataset_loading = False
+            self.btn_load_dataset.config(state=tk.NORMAL)
+            self.update_navigation_buttons()
+
+        self.run_in_background(lambda: load_pairs(folder), on_done, "Error loading dataset", on_error)
+
+    def dataset_loaded(self, folder, dataset_df):
+        """Opens the first image of a scanned dataset"""
         try:
-            folder = filedialog.askdirectory(title="Select Dataset Root Folder")
-            if folder:
-                self.dataset_df = create_dataset_df(folder)
-                if not self.dataset_df.empty:
-                    self.current_index = 0
+            self.dataset_df = dataset_df
+            self.dataset_folder = folder
+            self.toggle_watch()
+            if not self.dataset_df.empty:
+                self.check_stored_paths()
+                bad_pairs = int((~self.dataset_df['valid']).sum())
+                if self.representatives_var.get():
+                    self.toggle_representatives()
+
+                index = self.acquire_image(0, 1)
+                if index is None:
+                    self.current_index = -1
                     self.update_navigation_buttons()
-                    self.load_current_images()
-                    messagebox.showinfo("Success", f"Loaded dataset with {len(self.dataset_df)} image pairs")
-                else:
-                    messagebox.showwarning("Warning", "No valid image pairs found in the dataset")
+                    if self.store.client is None:
+                        messagebox.showwarning("Warning", "All image pairs in the dataset have problems")
+                    return
+                self.current_index = index
+                self.update_navigation_buttons()
+                self.load_current_images()
+                messagebox.showinfo("Success", f"Loaded dataset with {len(self.dataset_df)} image pairs"
+                                    + (f" ({bad_pairs} with problems)" if bad_pairs else ""))
+            elif self.dataset_watcher is not None:
+                self.current_index = -1
+                self.update_navigation_buttons()
+                self.current_image_label.config(text="Waiting for new pairs...")
+            else:
+                messagebox.showwarning("Warning", "No valid image pairs found in the dataset")
         except Exception as e:
             self.show_error("Error loading dataset", str(e))
 
+    def check_stored_paths(self):
+        """
+        Makes sure the stored points belong to the images at their index. Local
+        points stored for another image (a dataset indexed in a different file
+        order) are moved to their image; with the server they are only reported,
+        since other annotators use the same keys.
+        """
+        local = self.store.client is None
+        moved, unmatched = self.store.reconcile(self.dataset_df, move=local)
+        if moved and local:
+            self.store.write()
+        lines = []
+        if moved:
+            lines.append(f"{len(moved)} stored entries belonged to another image than the one at their index"
+                         + (" and were moved to their image" if local else
+                            " (the server's points file was indexed in a different order)"))
+        if unmatched:
+            lines.append(f"{len(unmatched)} stored entries refer to images that are not in this dataset")
+        if lines:
+            self.show_warning("Stored Points", "\n".join(lines))
+
     def update_navigation_buttons(self):
         if self.dataset_df is None or self.current_index < 0:
             self.btn_prev.config(state=tk.DISABLED)
@@ -460,127 +730,531 @@ class DualImageMatchingApp:
             self.current_image_label.config(text="No dataset loaded")
             return
 
-        self.btn_prev.config(state=tk.NORMAL if self.current_index > 0 else tk.DISABLED)
-        self.btn_next.config(state=tk.NORMAL if self.current_index < len(self.dataset_df) - 1 else tk.DISABLED)
+        mask = navigable_mask(self.dataset_df, self.skip_invalid_var.get(),
+                              self.representatives_var.get())
+        has_prev = find_next_index(mask, self.current_index - 1, -1) is not None
+        has_next = find_next_index(mask, self.current_index + 1, 1) is not None
+        self.btn_prev.config(state=tk.NORMAL if has_prev else tk.DISABLED)
+        self.btn_next.config(state=tk.NORMAL if has_next else tk.DISABLED)
         
-        current_file = os.path.basename(self.dataset_df.iloc[self.current_index]['rgb'])
-        self.current_image_label.config(text=f"Image {self.current_index + 1}/{len(self.dataset_df)}: {current_file}")
+        current_pair = self.dataset_df.iloc[self.current_index]
+        current_file = os.path.basename(current_pair['rgb'])
+        text = f"Image {self.current_index + 1}/{len(self.dataset_df)}: {current_file}"
+        if not current_pair.get('valid', True):
+            text += f" [BAD: {current_pair['scan_status']}]"
+        if current_pair.get('cluster', self.current_index) != self.current_index:
+            text += f" [duplicate of {current_pair['cluster'] + 1}]"
+        entry = self.store.get(self.current_index)
+        if is_interpolated(entry):
+            first, last = entry['keyframes']
+            text += f" [interpolated from {first + 1}-{last + 1}]"
+        self.current_image_label.config(text=text)
+
+    def toggle_representatives(self):
+        """Groups near-duplicate frames the first time the mode is switched on"""
+        if not self.representatives_var.get() or self.dataset_df is None or self.dataset_df.empty \
+                or 'cluster' in self.dataset_df.columns:
+            self.update_navigation_buttons()
+            return
+
+        dataset_df = self.dataset_df
+        cache_path = os.path.join(self.dataset_folder, CACHE_NAME)
+        self.representatives_check.config(state=tk.DISABLED)
+
+        def on_done(result):
+            self.representatives_check.config(state=tk.NORMAL)
+            if self.dataset_df is not dataset_df:
+                # Another dataset was loaded or new pairs were appended meanwhile
+                self.toggle_representatives()
+                return
+            self.dataset_df = result
+            self.update_navigation_buttons()
+            groups = result['cluster'].nunique()
+            messagebox.showinfo("Duplicate Frames", f"{len(result)} images in {groups} groups, "
+                                                    f"{len(result) - groups} near-duplicates will be skipped")
+
+        def on_error():
+            self.representatives_check.config(state=tk.NORMAL)
+            self.representatives_var.set(False)
+
+        self.run_in_background(lambda: find_duplicates(dataset_df, cache_path=cache_path),
+                               on_done, "Error finding duplicate frames", on_error)
+
+    def toggle_watch(self):
+        """Starts or stops watching the dataset folders for pairs added during a capture"""
+        if self.dataset_watcher is not None:
+            self.dataset_watcher.stop()
+            self.dataset_watcher = None
+        if not self.watch_var.get() or self.dataset_folder is None:
+            return
+        try:
+            known = self.dataset_df['rgb'] if 'rgb' in self.dataset_df.columns else []
+            self.dataset_watcher = DatasetWatcher(self.dataset_folder, known, self.prepare_new_pairs)
+        except ValueError as e:
+            self.watch_var.set(False)
+            self.show_warning("Watch for new pairs", str(e))
+            return
+        if self.watch_poll is None:
+            self.watch_poll = self.master.after(WATCH_POLL_MS, self.poll_watch)
+
+    def prepare_new_pairs(self, new_pairs):
+        """Runs in the watch thread: header scan, previews and (when grouping duplicates) hashes"""
+        dataset_df = self.dataset_df
+        hash_cache = None
+        if dataset_df is not None and 'cluster' in dataset_df.columns:
+            hash_cache = os.path.join(self.dataset_folder, CACHE_NAME)
+        return prepare_pairs(new_pairs, self.loader, hash_cache)
+
+    def poll_watch(self):
+        """Appends the pairs found by the watcher after the existing ones, indices never move"""
+        self.watch_poll = None
+        if self.dataset_watcher is None:
+            return
+        new_pairs, errors = self.dataset_watcher.get()
+        for error in errors:
+            print(f"Warning: watching the dataset failed: {error}")
+        if new_pairs is not None:
+            self.dataset_df = append_pairs(self.dataset_df, new_pairs)
+            if self.representatives_var.get() and 'cluster' not in self.dataset_df.columns:
+                self.toggle_representatives()
+            if self.current_index < 0:
+                index = self.acquire_image(0, 1)
+                if index is not None:
+                    self.current_index = index
+                    self.load_current_images()
+            self.update_navigation_buttons()
+        self.watch_poll = self.master.after(WATCH_POLL_MS, self.poll_watch)
+
+    def copy_points_to_duplicates(self):
+        """Copies the current image's points to the images of its group that have none"""
+        if self.dataset_df is None or self.current_index < 0 or not self.rgb_points:
+            messagebox.showinfo("Copy to Duplicates", "There are no points to copy")
+            return
+        if 'cluster' not in self.dataset_df.columns:
+            messagebox.showinfo("Copy to Duplicates", "Enable 'One per duplicate group' first")
+            return
+
+        self.store_current_points()
+        written = copy_to_cluster(self.store.entries, self.dataset_df, self.current_index)
+        if written:
+            self.save_points(*written)
+        messagebox.showinfo("Copy to Duplicates", f"Points copied to {len(written)} images")
+
+    def fill_between_keyframes(self):
+        """Replaces the points of every frame between two keyframes (images labeled by hand) by interpolation"""
+        if self.dataset_df is None:
+            messagebox.showinfo("Keyframes", "Load a dataset first")
+            return
+        try:
+            if self.current_index >= 0 and self.rgb_points:
+                self.store_current_points()
+            changed = refill(self.store.entries, self.dataset_df, self.interpolation_var.get())
+            if changed:
+                self.save_points(*changed)
+            self.load_current_images()
+            self.update_navigation_buttons()
+            filled = sum(is_interpolated(entry) for entry in self.store.entries.values())
+            message = f"Interpolated {filled} images from {len(keyframes(self.store.entries))} keyframes"
+            unindexed = unindexed_keys(self.store.entries)
+            if unindexed:
+                message += (f"\n\n{len(unindexed)} entries are keyed by image path instead of dataset index "
+                            "and were left out (merge the points file with --dataset to index them)")
+            messagebox.showinfo("Keyframes", message)
+        except Exception as e:
+            self.show_error("Error interpolating keyframes", str(e))
+
+    def accept_interpolated(self):
+        """Keeps the interpolated points of the current image as labeled by hand, making it a keyframe"""
+        entry = self.store.get(self.current_index)
+        if not is_interpolated(entry):
+            messagebox.showinfo("Keyframes", "The current image is not interpolated")
+            return
+        self.store.set(self.current_index, promote(entry))
+        self.save_points(str(self.current_index))
+        self.update_navigation_buttons()
 
     def load_current_images(self):
         if self.dataset_df is None or self.current_index < 0:
             return
 
         current_pair = self.dataset_df.iloc[self.current_index]
+        self.telemetry.record("shown", self.current_index, path=normalize_path(current_pair['rgb'], IMAGE_ID_COMPONENTS))
         
         # Clear existing points and lines
-        self.rgb_canvas.delete("point", "line", "label")
-        self.depth_canvas.delete("point", "line", "label")
+        self.rgb_layer.clear()
+        self.depth_layer.clear()
+        self.drag_index = None
         self.rgb_points = []
         self.depth_points = []
         self.rgb_lines = []
         self.depth_lines = []
         
-        # Load RGB image
-        self.rgb_image_cv = cv2.imread(current_pair['rgb'], cv2.IMREAD_UNCHANGED)
+        # Show a reduced preview right away, the full-resolution pair is decoded
+        # in the background and swapped in by poll_full_images
+        prefetch = prefetch_paths(self.dataset_df, self.current_index)
+        self.rgb_image_cv = None
+        self.depth_image_cv = None
+        self.depth_validity = None
+        self.rgb_display_cv, self.depth_display_cv = self.loader.load(
+            current_pair['rgb'], current_pair['depth'], prefetch)
+        self.display_scale = self.loader.preview_scale
+        if self.full_image_poll is None:
+            self.full_image_poll = self.master.after(POLL_INTERVAL_MS, self.poll_full_images)
         
-        # Load depth image
-        self.depth_image_cv = cv2.imread(current_pair['depth'], cv2.IMREAD_UNCHANGED)
-        
-        # Restore points if they exist for this image
-        if str(self.current_index) in self.points_storage:
-            stored_data = self.points_storage[str(self.current_index)]
-            
-            # Recreate points with new canvas IDs
-            for rgb_point in stored_data['rgb_points']:
-                x, y = rgb_point
-                point_id = self.rgb_canvas.create_oval(x-4, y-4, x+4, y+4, 
-                                                     fill="white", outline="black", width=2, tags="point")
-                self.rgb_points.append((x, y, point_id))
-                
-            for depth_point in stored_data['depth_points']:
-                x, y = depth_point
-                point_id = self.depth_canvas.create_oval(x-4, y-4, x+4, y+4, 
-                                                       fill="white", outline="black", width=2, tags="point")
-                self.depth_points.append((x, y, point_id))
-            
-            # Recreate lines
-            if len(self.rgb_points) > 1:
-                for i in range(len(self.rgb_points)-1):
-                    # RGB lines
-                    x1, y1, _ = self.rgb_points[i]
-                    x2, y2, _ = self.rgb_points[i+1]
-                    line_id = self.rgb_canvas.create_line(x1, y1, x2, y2, 
-                                                        fill="yellow", width=2, tags="line")
-                    self.rgb_lines.append(line_id)
-                    
-                    # Depth lines
-                    x1, y1, _ = self.depth_points[i]
-                    x2, y2, _ = self.depth_points[i+1]
-                    line_id = self.depth_canvas.create_line(x1, y1, x2, y2, 
-                                                          fill="yellow", width=2, tags="line")
-                    self.depth_lines.append(line_id)
+        # Restore points if they exist for this image (canvas items are created by redraw_points)
+        if self.current_index in self.store:
+            stored_data = self.store.get(self.current_index)
+            self.rgb_points = self.restore_points(stored_data, 'rgb')
+            self.depth_points = self.restore_points(stored_data, 'depth')
         
         self.update_canvas()
         self.redraw_points()  # Esto asegura que los números se dibujen correctamente
         self.update_point_lists()
+        self.update_memory()
+
+    def update_memory(self):
+        """Brings the caches back within the shared memory budget and shows the usage"""
+        self.memory.enforce()
+        self.memory_label.config(text=self.memory.status())
+
+    def show_memory_dump(self):
+        messagebox.showinfo("Memory", self.memory.dump())
+
+    def restore_points(self, stored_data, side):
+        """Stored points of one side, converted to undistorted space if they were placed on raw images"""
+        size = image_size(self.dataset_df.iloc[self.current_index], side)
+        return [(x, y, None) for x, y in entry_points(stored_data, side, self.calibration, size)]
+
+    def poll_full_images(self):
+        """Swaps the preview for the full-resolution pair once it's decoded"""
+        result = self.loader.poll()
+        if result is None:
+            if self.loader.pending:
+                self.full_image_poll = self.master.after(POLL_INTERVAL_MS, self.poll_full_images)
+            else:
+                self.full_image_poll = None
+            return
+        self.full_image_poll = None
+
+        rgb_image, depth_image, error = result
+        if error is not None:
+            self.show_error("Error loading images", str(error))
+            return
+        self.rgb_image_cv = rgb_image
+        self.depth_image_cv = depth_image
+        self.telemetry.record("loaded", self.current_index)
+        # Already built by the loader, this is a cache hit
+        self.depth_validity = self.validity_cache.get(self.dataset_df.iloc[self.current_index]['depth'], depth_image)
+        self.show_full_images()
+        self.update_memory()
 
     def previous_image(self):
         if self.current_index > 0:
+            index = self.acquire_image(self.current_index - 1, -1)
+            if index is None:
+                return
+
             # Guardar puntos actuales antes de cambiar de imagen
             if self.rgb_points and self.depth_points:
-                self.points_storage[str(self.current_index)] = {
-                    'rgb_points': [(x, y) for x, y, _ in self.rgb_points],
-                    'depth_points': [(x, y) for x, y, _ in self.depth_points],
-                    'image_paths': {
-                        'rgb': self.dataset_df.iloc[self.current_index]['rgb'],
-                        'depth': self.dataset_df.iloc[self.current_index]['depth']
-                    }
-                }
-                self.save_points_to_json()
-
-            self.current_index -= 1
+                self.store_current_points()
+
+            self.telemetry.record("navigate", self.current_index, to=index)
+            self.release_image(self.current_index)
+            self.current_index = index
             self.load_current_images()
             self.update_navigation_buttons()
 
     def next_image(self):
         if self.dataset_df is not None and self.current_index < len(self.dataset_df) - 1:
+            index = self.acquire_image(self.current_index + 1, 1)
+            if index is None:
+                return
+
             # Guardar puntos actuales antes de cambiar de imagen
             if self.rgb_points and self.depth_points:
-                self.points_storage[str(self.current_index)] = {
-                    'rgb_points': [(x, y) for x, y, _ in self.rgb_points],
-                    'depth_points': [(x, y) for x, y, _ in self.depth_points],
-                    'image_paths': {
-                        'rgb': self.dataset_df.iloc[self.current_index]['rgb'],
-                        'depth': self.dataset_df.iloc[self.current_index]['depth']
-                    }
-                }
-                self.save_points_to_json()
-
-            self.current_index += 1
+                self.store_current_points()
+
+            self.telemetry.record("navigate", self.current_index, to=index)
+            self.release_image(self.current_index)
+            self.current_index = index
             self.load_current_images()
             self.update_navigation_buttons()
 
-    def load_points_from_json(self):
+    def jump_to_image(self, index):
+        if self.dataset_df is None or not (0 <= index < len(self.dataset_df)):
+            self.show_error("Error", f"Image {index + 1} is not part of the loaded dataset")
+            return
+        if self.acquire_image(index, 0) is None:
+            return
+
+        # Save current points before changing image
+        if self.rgb_points and self.depth_points:
+            self.store_current_points()
+
+        self.telemetry.record("navigate", self.current_index, to=index)
+        self.release_image(self.current_index)
+        self.current_index = index
+        self.load_current_images()
+        self.update_navigation_buttons()
+
+    def acquire_image(self, start, step):
+        """
+        Returns the first index from start in the direction of step (0 = only start)
+        that can be opened, skipping bad pairs if enabled. With a server connection
+        the image is leased first and its points are refreshed. Returns None if
+        there is no such image.
+        """
         try:
-            with open(self.json_file, 'r') as f:
-                self.points_storage = json.load(f)
-        except FileNotFoundError:
-            self.points_storage = {}
-        except json.JSONDecodeError:
-            self.show_error("Error", "JSON file is corrupted. Starting with empty storage.")
-            self.points_storage = {}
+            index = find_image(self.dataset_df, start, step, self.skip_invalid_var.get(),
+                               self.representatives_var.get(), self.store)
+            if index is None and self.store.client is not None:
+                messagebox.showinfo("Annotation Server", "The image is being labeled by another annotator"
+                                    if step == 0 else "All remaining images are leased by other annotators")
+            return index
+        except (IOError, OSError) as e:
+            self.show_error("Annotation server error", str(e))
+            return None
+
+    def release_image(self, index):
+        self.store.release(index)
+
+    def connect_to_server(self):
+        url = simpledialog.askstring("Annotation Server", "Server URL:",
+                                     initialvalue=os.environ.get("ANNOTATION_SERVER", "http://127.0.0.1:8765"),
+                                     parent=self.master)
+        if not url:
+            return
+        client = None
+        try:
+            # Shared with the other tab, so both see the same entry versions
+            client = AnnotationClient.shared(url)
+            if self.dataset_df is not None and self.current_index >= 0:
+                if not client.acquire(self.current_index):
+                    self.show_warning("Annotation Server",
+                                      "The current image is being labeled by another annotator")
+            self.store.connect(client)
+            self.btn_server.config(text=f"Server: {client.host}:{client.port}")
+            if self.dataset_df is not None and not self.dataset_df.empty:
+                self.check_stored_paths()
+            self.load_current_images()
+            self.master.after(1000, self.poll_server_conflicts)
+        except Exception as e:
+            if client is not None and self.store.client is not client:
+                client.close()
+            self.show_error("Error connecting to annotation server", str(e))
+
+    def poll_server_conflicts(self):
+        """
+        Handles the writes the server rejected: images another annotator holds
+        are reloaded, for points another annotator changed meanwhile the user
+        chooses which version is kept
+        """
+        if self.store.client is None:
+            return
+        leased, changed = [], []
+        for key, status, entry in self.store.take_conflicts():
+            if status == "conflict":
+                changed.append((key, entry))
+            else:
+                leased.append(key)
+                self.store.set(key, entry)
+        reloaded = list(leased)
+        if leased:
+            self.show_warning("Annotation Server",
+                              "Points of images " + ", ".join(str(int(k) + 1) for k in leased) +
+                              " were not saved because another annotator is labeling them, "
+                              "their points have been reloaded")
+        if changed:
+            keep = messagebox.askyesno("Annotation Server",
+                                       "Points of images " + ", ".join(str(int(k) + 1) for k, _ in changed) +
+                                       " were changed by another annotator since you opened them.\n\n"
+                                       "Keep your points (Yes) or load theirs (No)?")
+            if keep:
+                # The client now knows the server's version, so this write replaces it
+                self.save_points(*[key for key, _ in changed])
+            else:
+                for key, entry in changed:
+                    self.store.set(key, entry)
+                reloaded += [key for key, _ in changed]
+        if str(self.current_index) in reloaded:
+            self.load_current_images()
+        self.master.after(1000, self.poll_server_conflicts)
+
+    def shutdown(self):
+        """Sends pending writes and releases the current lease"""
+        if self.dataset_watcher is not None:
+            self.dataset_watcher.stop()
+        self.store.close(release=self.current_index)
+        self.telemetry.close()
+
+    def store_current_points(self):
+        """Stores the points of the current image and saves them to the JSON file"""
+        row = self.dataset_df.iloc[self.current_index]
+        entry = make_entry([(x, y) for x, y, _ in self.rgb_points], [(x, y) for x, y, _ in self.depth_points],
+                           self.offset_transform(), self.calibration, row['rgb'], row['depth'])
+        stored = self.store.get(self.current_index)
+        if is_interpolated(stored) and \
+                [list(p) for p in stored['rgb_points']] == [list(p) for p in entry['rgb_points']] and \
+                [list(p) for p in stored['depth_points']] == [list(p) for p in entry['depth_points']]:
+            # Only looked at: stays interpolated until edited or accepted
+            return
+        self.store.set(self.current_index, entry)
+        self.save_points(str(self.current_index))
 
-    def save_points_to_json(self):
+    def save_points(self, *keys):
+        """Persists the points of images, locally or through the annotation server"""
         try:
-            with open(self.json_file, 'w') as f:
-                json.dump(self.points_storage, f, indent=4)
+            # Server writes are queued, the click never waits for the network
+            self.store.save(*keys)
         except Exception as e:
             self.show_error("Error saving points", str(e))
 
+    def show_qa_report(self):
+        if not self.store.entries:
+            messagebox.showinfo("QA Report", "There are no labeled points to check")
+            return
+
+        storage = dict(self.store.entries)
+        report_path = os.path.splitext(self.json_file)[0] + "_qa_report.csv"
+        self.btn_qa.config(state=tk.DISABLED)
+
+        def run():
+            report = run_qa(storage)
+            write_report(report, report_path)
+            return report
+
+        def on_done(report):
+            self.btn_qa.config(state=tk.NORMAL)
+            self.open_qa_window(report, report_path)
+
+        def on_error():
+            self.btn_qa.config(state=tk.NORMAL)
+
+        self.run_in_background(run, on_done, "Error running QA", on_error)
+
+    def open_qa_window(self, report, report_path):
+        flagged = report[report['flags'] != '']
+
+        window = tk.Toplevel(self.master)
+        window.title(f"QA Report - {len(flagged)} of {len(report)} images flagged")
+
+        ttk.Label(window, text="Double-click an entry to open the image").pack(padx=5, pady=5)
+        list_frame = ttk.Frame(window)
+        list_frame.pack(fill=tk.BOTH, expand=True, padx=5)
+        listbox = tk.Listbox(list_frame, width=110, height=20)
+        scrollbar = ttk.Scrollbar(list_frame, orient="vertical", command=listbox.yview)
+        listbox.configure(yscrollcommand=scrollbar.set)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+        # Entries keyed by image path (not matched to the dataset) have no index to jump to
+        indices = [int(key) if str(key).isdigit() else None for key in flagged['key']]
+        for index, row in zip(indices, flagged.itertuples()):
+            name = f"Image {index + 1}" if index is not None else f"Unmatched {row.key}"
+            listbox.insert(tk.END, f"{name}: {row.rgb_file} | "
+                                   f"max residual {row.max_residual:.1f}px (point {row.worst_point}) | "
+                                   f"{row.flags}")
+            if index is None:
+                listbox.itemconfig(tk.END, foreground="gray")
+
+        def on_select(event):
+            selection = listbox.curselection()
+            if selection and indices[selection[0]] is not None:
+                self.jump_to_image(indices[selection[0]])
+
+        listbox.bind("<Double-Button-1>", on_select)
+        ttk.Label(window, text=f"Full report saved to {report_path}").pack(padx=5, pady=5)
+
+    def export_3d_points(self):
+        if not self.store.entries:
+            messagebox.showinfo("Export 3D Points", "There are no labeled points to export")
+            return
+
+        path = filedialog.asksaveasfilename(title="Export 3D Points", defaultextension=".csv",
+                                            filetypes=[("CSV", "*.csv"), ("PLY point cloud", "*.ply")])
+        if not path:
+            return
+
+        storage = dict(self.store.entries)
+        self.btn_export_3d.config(state=tk.DISABLED)
+
+        def on_done(count):
+            self.btn_export_3d.config(state=tk.NORMAL)
+            messagebox.showinfo("Export 3D Points", f"Exported {count} points to {path}")
+
+        def on_error():
+            self.btn_export_3d.config(state=tk.NORMAL)
+
+        self.run_in_background(lambda: export_landmarks(storage, path, self.intrinsics,
+                                                         calibration=self.calibration),
+                               on_done, "Error exporting 3D points", on_error)
+
+    def export_metrics(self):
+        if not self.store.entries:
+            messagebox.showinfo("Export Metrics", "There are no labeled points to export")
+            return
+
+        path = filedialog.asksaveasfilename(title="Export Region Metrics", defaultextension=".parquet",
+                                            filetypes=[("Parquet", "*.parquet"), ("CSV", "*.csv")])
+        if not path:
+            return
+
+        storage = dict(self.store.entries)
+        self.btn_export_metrics.config(state=tk.DISABLED)
+
+        def on_done(result):
+            self.btn_export_metrics.config(state=tk.NORMAL)
+            written_path, count = result
+            messagebox.showinfo("Export Metrics", f"Computed metrics of {count} regions, written to {written_path}")
+
+        def on_error():
+            self.btn_export_metrics.config(state=tk.NORMAL)
+
+        self.run_in_background(lambda: export_region_metrics(storage, path, self.intrinsics,
+                                                              calibration=self.calibration),
+                               on_done, "Error exporting region metrics", on_error)
+
+    def run_in_background(self, task, on_done, error_title, on_error=None):
+        """Runs task in a worker thread and calls on_done(result) back on the Tk thread"""
+        results = queue.Queue()
+
+        def worker():
+            try:
+                results.put((True, task()))
+            except Exception as e:
+                results.put((False, e))
+
+        def poll():
+            try:
+                ok, value = results.get_nowait()
+            except queue.Empty:
+                self.master.after(100, poll)
+                return
+            if ok:
+                on_done(value)
+            else:
+                if on_error:
+                    on_error()
+                self.show_error(error_title, str(value))
+
+        threading.Thread(target=worker, daemon=True).start()
+        self.master.after(100, poll)
+
+    def load_points_from_json(self):
+        try:
+            self.store.load()
+        except ValueError:
+            self.show_error("Error", "JSON file is corrupted. Starting with empty storage.")
+
 def main():
     root = tk.Tk()
-    # Create the app without assigning to an unused variable
-    DualImageMatchingApp(root)
+    app = DualImageMatchingApp(root)
+
+    def on_close():
+        app.shutdown()
+        root.destroy()
+
+    root.protocol("WM_DELETE_WINDOW", on_close)
     root.mainloop()
 
 if __name__ == "__main__":
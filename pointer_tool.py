@@ -20,9 +20,18 @@ class IntegratedToolApp:
             self.analyzer_frame = ttk.Frame(self.notebook)
             self.notebook.add(self.analyzer_frame, text="Image Overlay")
             self.analyzer_app = ObesityAnalyzerApp(self.analyzer_frame)
+
+            self.master.protocol("WM_DELETE_WINDOW", self.on_close)
         except Exception as e:
             self.show_error("Error initializing application", str(e))
 
+    def on_close(self):
+        # Flush pending writes to the annotation server before exiting
+        for app in (getattr(self, "dual_app", None), getattr(self, "analyzer_app", None)):
+            if app is not None:
+                app.shutdown()
+        self.master.destroy()
+
     def show_error(self, title, message):
         messagebox.showerror(title, message)
 
@@ -0,0 +1,133 @@
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+from dataset_sources import read_frame, frame_mtime
+from lens_calibration import undistort
+
+# Preview decode flags, the JPEG/PNG decoders skip work at these reductions
+PREVIEW_FLAGS = {
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+DEFAULT_REDUCTION = 4
+DEFAULT_CACHE_SIZE = 64
+# How often the UI checks whether the full-resolution pair is ready
+POLL_INTERVAL_MS = 30
+
+
+class PreviewCache:
+    """Thread-safe LRU cache of reduced-resolution previews, keyed by path and mtime"""
+
+    def __init__(self, max_items=DEFAULT_CACHE_SIZE, reduction=DEFAULT_REDUCTION):
+        self.max_items = max_items
+        self.reduction = reduction
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, path):
+        try:
+            key = (path, frame_mtime(path))
+        except OSError:
+            return None
+        with self.lock:
+            if key in self.items:
+                self.items.move_to_end(key)
+                return self.items[key]
+
+        preview = read_frame(path, PREVIEW_FLAGS[self.reduction])
+        if preview is not None:
+            with self.lock:
+                self.items[key] = preview
+                while len(self.items) > self.max_items:
+                    self.items.popitem(last=False)
+        return preview
+
+    def memory_usage(self):
+        with self.lock:
+            return sum(preview.nbytes for preview in self.items.values())
+
+    def release_memory(self, target):
+        """Evicts the least recently used previews until at most target bytes are held"""
+        with self.lock:
+            used = sum(preview.nbytes for preview in self.items.values())
+            while self.items and used > target:
+                _, preview = self.items.popitem(last=False)
+                used -= preview.nbytes
+
+
+class ProgressiveLoader:
+    """
+    Returns a preview of an image pair right away and decodes the full-resolution
+    pair in a background thread. Results of superseded requests are dropped, so
+    only the last requested pair is ever handed back. With a lens calibration
+    (see lens_calibration.py) previews and full frames are undistorted. With a
+    validity cache (see depth_validity.py) the depth mask of the full frame is
+    built in the background too.
+    """
+
+    def __init__(self, reduction=DEFAULT_REDUCTION, cache_size=DEFAULT_CACHE_SIZE, calibration=None,
+                 validity=None):
+        self.calibration = calibration
+        self.validity = validity
+        self.previews = PreviewCache(cache_size, reduction)
+        self.preview_scale = 1.0 / reduction
+        self.executor = ThreadPoolExecutor(max_workers=2)
+        self.results = queue.Queue()
+        self.generation = 0
+        self.pending = False
+
+    def load(self, rgb_path, depth_path, prefetch=()):
+        """
+        Returns (rgb_preview, depth_preview) and starts the full decode.
+        prefetch is a list of paths whose previews should be warmed up next.
+        """
+        self.generation += 1
+        self.pending = True
+        # The cached remap tables make undistorting a preview a single remap
+        rgb_preview = undistort(self.calibration, "rgb", self.previews.get(rgb_path))
+        depth_preview = undistort(self.calibration, "depth", self.previews.get(depth_path))
+        self.executor.submit(self._decode_full, self.generation, rgb_path, depth_path)
+        for path in prefetch:
+            self.executor.submit(self.previews.get, path)
+        return rgb_preview, depth_preview
+
+    def _decode_full(self, generation, rgb_path, depth_path):
+        if generation != self.generation:
+            return
+        try:
+            rgb = read_frame(rgb_path, cv2.IMREAD_UNCHANGED)
+            if rgb is None:
+                raise IOError(f"Could not load RGB image: {rgb_path}")
+            depth = read_frame(depth_path, cv2.IMREAD_UNCHANGED)
+            if depth is None:
+                raise IOError(f"Could not load depth image: {depth_path}")
+            rgb = undistort(self.calibration, "rgb", rgb)
+            depth = undistort(self.calibration, "depth", depth)
+            if self.validity is not None:
+                self.validity.get(depth_path, depth)
+            self.results.put((generation, rgb, depth, None))
+        except Exception as e:
+            self.results.put((generation, None, None, e))
+
+    def poll(self):
+        """
+        Returns (rgb, depth, error) of the current request once it's decoded,
+        None while it's still pending (see self.pending) or if there is none.
+        Must be called from the UI thread.
+        """
+        while True:
+            try:
+                generation, rgb, depth, error = self.results.get_nowait()
+            except queue.Empty:
+                return None
+            if generation == self.generation:
+                self.pending = False
+                return rgb, depth, error
+
+    def cancel(self):
+        """Discards the pending full-resolution decode"""
+        self.generation += 1
+        self.pending = False
@@ -0,0 +1,171 @@
+import argparse
+import csv
+import json
+import os
+import cv2
+import numpy as np
+from dataset_sources import process_context, read_frame
+from lens_calibration import CALIBRATION_FILE, load_calibration, undistort
+from depth_sampling import load_intrinsics, to_depth_channel, sample_median
+
+METRIC_COLUMNS = ["key", "rgb_file", "points", "area_px", "valid_px", "area_m2",
+                  "mean_depth_m", "median_depth_m", "volume_m3"]
+# Rows buffered before they are written out as one batch / row group
+BATCH_ROWS = 1000
+
+
+def region_mask(shape, polygon):
+    """
+    Rasterizes the closed polygon with cv2.fillPoly, restricted to its bounding box.
+    Returns (mask, (x0, y0)) where the mask covers the clipped bounding box.
+    """
+    h, w = shape[:2]
+    pts = np.rint(np.asarray(polygon, dtype=np.float64)).astype(np.int32).reshape(-1, 2)
+    x0, y0 = np.clip(pts.min(axis=0), 0, [w - 1, h - 1])
+    x1, y1 = np.clip(pts.max(axis=0), 0, [w - 1, h - 1])
+    mask = np.zeros((y1 - y0 + 1, x1 - x0 + 1), dtype=np.uint8)
+    cv2.fillPoly(mask, [pts], 1, offset=(-int(x0), -int(y0)))
+    return mask.astype(bool), (int(x0), int(y0))
+
+
+def compute_region_metrics(depth, polygon, intrinsics):
+    """
+    Area, depth statistics and approximate volume of the region enclosed by the
+    annotated points. The volume is what the region rises towards the camera
+    above the plane through the depth at its outline points.
+    """
+    polygon = np.asarray(polygon, dtype=np.float64).reshape(-1, 2)
+    metrics = dict.fromkeys(METRIC_COLUMNS[2:], np.nan)
+    metrics["points"] = len(polygon)
+    if len(polygon) < 3:
+        return metrics
+
+    depth = to_depth_channel(depth)
+    mask, (x0, y0) = region_mask(depth.shape, polygon)
+    crop = depth[y0:y0 + mask.shape[0], x0:x0 + mask.shape[1]]
+    valid = mask & (crop > 0)
+    metrics["area_px"] = int(mask.sum())
+    metrics["valid_px"] = int(valid.sum())
+    if not valid.any():
+        return metrics
+
+    scale = intrinsics["depth_scale"]
+    rows, cols = np.nonzero(valid)
+    z = crop[rows, cols].astype(np.float64) * scale
+    # Metric footprint of every pixel at its own depth
+    pixel_area = (z / intrinsics["fx"]) * (z / intrinsics["fy"])
+    metrics["area_m2"] = float(pixel_area.sum())
+    metrics["mean_depth_m"] = float(z.mean())
+    metrics["median_depth_m"] = float(np.median(z))
+
+    # Reference plane z = a*u + b*v + c through the outline
+    outline_z = sample_median(depth, polygon) * scale
+    ok = np.isfinite(outline_z)
+    if ok.sum() >= 3:
+        A = np.column_stack([polygon[ok], np.ones(ok.sum())])
+        coeffs = np.linalg.lstsq(A, outline_z[ok], rcond=None)[0]
+        plane = coeffs[0] * (cols + x0) + coeffs[1] * (rows + y0) + coeffs[2]
+    elif ok.any():
+        plane = np.median(outline_z[ok])
+    else:
+        return metrics
+    metrics["volume_m3"] = float((np.clip(plane - z, 0, None) * pixel_area).sum())
+    return metrics
+
+
+def _metrics_entry(task):
+    key, entry, intrinsics, calibration = task
+    points = entry.get('depth_points') or []
+    depth_path = entry.get('image_paths', {}).get('depth')
+    row = {"key": key, "rgb_file": os.path.basename(str(entry.get('image_paths', {}).get('rgb', '')))}
+    if len(points) < 3 or not depth_path:
+        return None
+    depth = read_frame(depth_path, cv2.IMREAD_UNCHANGED)
+    if depth is None:
+        print(f"Warning: could not read {depth_path}")
+        return None
+    if entry.get('undistorted'):
+        # The points were placed on undistorted images
+        depth = undistort(calibration, "depth", depth)
+    row.update(compute_region_metrics(depth, points, intrinsics))
+    return row
+
+
+def iter_region_metrics(storage, intrinsics, workers=None, chunksize=16, calibration=None):
+    """Computes the metrics of every stored region in a process pool, yielding rows as they finish"""
+    tasks = ((key, entry, intrinsics, calibration) for key, entry in storage.items())
+    with process_context().Pool(processes=workers) as pool:
+        for row in pool.imap_unordered(_metrics_entry, tasks, chunksize=chunksize):
+            if row is not None:
+                yield row
+
+
+def _batches(rows, size=BATCH_ROWS):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def write_metrics(rows, path):
+    """
+    Streams rows to a Parquet file, one row group per batch, so memory stays flat.
+    Falls back to CSV when pyarrow isn't installed or path ends with .csv.
+    """
+    count = 0
+    if not path.lower().endswith(".csv"):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            path = os.path.splitext(path)[0] + ".csv"
+            print(f"Warning: pyarrow is not installed, writing {path} instead")
+        else:
+            schema = pa.schema([("key", pa.string()), ("rgb_file", pa.string()), ("points", pa.int32())]
+                               + [(name, pa.float64()) for name in METRIC_COLUMNS[3:]])
+            with pq.ParquetWriter(path, schema) as writer:
+                for batch in _batches(rows):
+                    columns = {name: [row[name] for row in batch] for name in METRIC_COLUMNS}
+                    writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+                    count += len(batch)
+            return path, count
+
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=METRIC_COLUMNS)
+        writer.writeheader()
+        for batch in _batches(rows):
+            writer.writerows(batch)
+            count += len(batch)
+    return path, count
+
+
+def export_region_metrics(storage, path, intrinsics, workers=None, calibration=None):
+    """Batch job over the whole store, returns (written path, number of regions)"""
+    return write_metrics(iter_region_metrics(storage, intrinsics, workers, calibration=calibration), path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Area, depth and volume of the annotated regions")
+    parser.add_argument("json_file", nargs="?", default="labeled_points.json")
+    parser.add_argument("-o", "--output", default="region_metrics.parquet",
+                        help="Output file, .parquet (needs pyarrow) or .csv")
+    parser.add_argument("--intrinsics", default="camera_intrinsics.json")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--calibration", default=CALIBRATION_FILE,
+                        help="Lens calibration for points placed on undistorted images")
+    args = parser.parse_args()
+
+    with open(args.json_file, 'r') as f:
+        storage = json.load(f)
+
+    path, count = export_region_metrics(storage, args.output, load_intrinsics(args.intrinsics), args.workers,
+                                        load_calibration(args.calibration))
+    print(f"Computed metrics of {count} regions, written to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+import argparse
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+import pandas as pd
+
+# Set to 1 (or to the log path) to record telemetry, nothing is recorded otherwise
+TELEMETRY_ENV = "ANNOTATION_TELEMETRY"
+DEFAULT_LOG = "annotation_telemetry.jsonl"
+# Events are buffered and written by a background thread at most this often
+FLUSH_SECONDS = 5.0
+MAX_BUFFERED = 500
+# Gaps between events longer than this count as idle time, not labeling
+DEFAULT_IDLE_GAP = 60.0
+
+# Events that undo or redo earlier work
+REWORK_EVENTS = ("move", "delete", "reorder", "clear")
+# 'shown' events carry the image as its last path components (dataset folder, side
+# folder, file name), so images count once across sessions and datasets
+IMAGE_ID_COMPONENTS = 3
+
+
+def telemetry_path():
+    """Log path from the environment, None when telemetry is off"""
+    value = os.environ.get(TELEMETRY_ENV, "").strip()
+    if not value or value == "0":
+        return None
+    return DEFAULT_LOG if value == "1" else value
+
+
+class TelemetryLog:
+    """
+    Opt-in, append-only JSON lines log of annotation events. record() only
+    appends to a buffer; a background thread writes the buffer in batches,
+    so the UI never waits on the disk. With path None every call is a no-op.
+    """
+
+    def __init__(self, path, tool, flush_seconds=FLUSH_SECONDS):
+        self.path = path
+        self.tool = tool
+        self.session = f"{socket.gethostname()}-{uuid.uuid4().hex[:8]}"
+        self.buffer = []
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.closed = False
+        self.last = {}  # Last value of the events recorded only on change
+        if path is None:
+            return
+        self.flush_seconds = flush_seconds
+        self.writer = threading.Thread(target=self._write_loop, daemon=True)
+        self.writer.start()
+        self.record("session_start")
+
+    @property
+    def enabled(self):
+        return self.path is not None and not self.closed
+
+    def record(self, event, image=None, **fields):
+        if not self.enabled:
+            return
+        item = {"t": time.time(), "session": self.session, "tool": self.tool, "event": event}
+        if image is not None and image >= 0:
+            item["image"] = int(image)
+        item.update(fields)
+        with self.lock:
+            self.buffer.append(item)
+            full = len(self.buffer) >= MAX_BUFFERED
+        if full:
+            self.wakeup.set()
+
+    def record_change(self, event, image, value):
+        """Records event only when value differs from the last one (sliders report every mouse move)"""
+        if self.enabled and self.last.get(event) != value:
+            self.last[event] = value
+            self.record(event, image, value=value)
+
+    def _write_loop(self):
+        while True:
+            self.wakeup.wait(self.flush_seconds)
+            self.wakeup.clear()
+            self._flush()
+            if self.closed:
+                return
+
+    def _flush(self):
+        with self.lock:
+            batch, self.buffer = self.buffer, []
+        if not batch:
+            return
+        try:
+            with open(self.path, 'a') as f:
+                f.write("".join(json.dumps(item) + "\n" for item in batch))
+        except OSError as e:
+            print(f"Warning: could not write telemetry to {self.path}: {e}")
+
+    def close(self):
+        """Records the end of the session and writes what is left"""
+        if not self.enabled:
+            return
+        self.record("session_end")
+        self.closed = True
+        self.wakeup.set()
+        self.writer.join(timeout=5.0)
+
+
+def read_log(paths):
+    """Events of one or more logs as a DataFrame sorted by session and time"""
+    frames = [pd.read_json(path, lines=True) for path in paths if os.path.getsize(path)]
+    events = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=["t", "session", "event"])
+    for column in ("image", "path"):
+        if column not in events.columns:
+            events[column] = pd.NA
+    return events.sort_values(["session", "t"], kind="stable").reset_index(drop=True)
+
+
+def image_visits(events, idle_gap=DEFAULT_IDLE_GAP):
+    """
+    One row per time an image was on screen: from its 'shown' event to the
+    next 'shown' (or the end of the session). Time is split into idle (gaps
+    between events longer than idle_gap), waiting for the full-resolution
+    load and labeling (the rest). image_id is the image path of the 'shown'
+    event, or the session and index for logs recorded without paths.
+    """
+    events = events.copy()
+    shown = events["event"] == "shown"
+    # Visit number within each session, events before the first image belong to no visit
+    events["visit"] = shown.groupby(events["session"]).cumsum()
+    events = events[events["visit"] > 0]
+    gaps = events.groupby("session")["t"].diff().shift(-1)
+    # Time until the next event of the session, long gaps are idle
+    events["until_next"] = gaps.fillna(0.0)
+    events["idle"] = events["until_next"].where(events["until_next"] > idle_gap, 0.0)
+
+    rows = []
+    for (session, visit), group in events.groupby(["session", "visit"], sort=False):
+        start = group["t"].iloc[0]
+        image, path = group["image"].iloc[0], group["path"].iloc[0]
+        end = start + group["until_next"].sum()
+        idle = group["idle"].sum()
+        loaded = group.loc[group["event"] == "loaded", "t"]
+        load_wait = min(loaded.iloc[0] - start, end - start) if len(loaded) else 0.0
+        counts = group["event"].value_counts()
+        clicks = int(counts.get("click", 0))
+        rework = int(sum(counts.get(name, 0) for name in REWORK_EVENTS))
+        rows.append({
+            "session": session,
+            "tool": group["tool"].iloc[0],
+            "image": image,
+            "image_id": path if isinstance(path, str) else f"{session}:{image}",
+            "start": start,
+            "duration": end - start,
+            "idle": idle,
+            "load_wait": load_wait,
+            "labeling": max(end - start - idle - load_wait, 0.0),
+            "points": clicks,
+            "rework": rework,
+            "offset_changes": int(counts.get("offset", 0)),
+        })
+    return pd.DataFrame(rows)
+
+
+def summarize(visits):
+    """Per-session and overall totals of image visits"""
+    def totals(group):
+        labeling = group["labeling"].sum()
+        points = group["points"].sum()
+        images = group["image_id"].nunique()
+        return pd.Series({
+            "images": images,
+            "visits": len(group),
+            "points": points,
+            "duration_s": group["duration"].sum(),
+            "labeling_s": labeling,
+            "load_wait_s": group["load_wait"].sum(),
+            "idle_s": group["idle"].sum(),
+            "time_per_image_s": labeling / images if images else float("nan"),
+            "time_per_point_s": labeling / points if points else float("nan"),
+            "rework_rate": group["rework"].sum() / points if points else float("nan"),
+        })
+
+    per_session = visits.groupby("session").apply(totals)
+    per_session.loc["all"] = totals(visits)
+    return per_session
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput summary of annotation telemetry logs")
+    parser.add_argument("logs", nargs="*", default=[DEFAULT_LOG])
+    parser.add_argument("--idle-gap", type=float, default=DEFAULT_IDLE_GAP,
+                        help="Seconds without events after which time counts as idle")
+    parser.add_argument("-o", "--output", help="Also write one row per image visit to this CSV")
+    args = parser.parse_args()
+
+    visits = image_visits(read_log(args.logs), args.idle_gap)
+    if visits.empty:
+        print("No image visits in the telemetry logs")
+        return
+    summary = summarize(visits)
+    with pd.option_context("display.max_columns", None, "display.width", 200, "display.float_format", "{:.2f}".format):
+        print(summary)
+    total = summary.loc["all"]
+    active = total["labeling_s"] + total["load_wait_s"]
+    if active:
+        print(f"\nWaiting on loads: {100 * total['load_wait_s'] / active:.1f}% of active time, "
+              f"labeling: {100 * total['labeling_s'] / active:.1f}%")
+    if args.output:
+        visits.to_csv(args.output, index=False)
+        print(f"Image visits written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from contextlib import ExitStack, contextmanager
+from unittest import mock
+import cv2
+import numpy as np
+
+# Default limits in milliseconds for the checked percentile of each event type.
+# Starting values, not calibrated on a reference machine: set them from a baseline run.
+DEFAULT_THRESHOLDS = {
+    "on_rgb_click": 50,
+    "update_offset": 50,
+    "zoom": 60,
+    "next_image": 400,
+    "previous_image": 400,
+    "tab_switch": 150,
+}
+EVENT_WEIGHTS = {
+    "on_rgb_click": 4,
+    "update_offset": 3,
+    "zoom": 2,
+    "navigate": 2,
+    "tab_switch": 1,
+}
+PERCENTILES = (50, 95, 99)
+# Longest wait for background work (full-resolution decode) after an event
+SETTLE_TIMEOUT = 10.0
+DISPLAY_SIZE = (1600, 1000)
+
+
+def make_synthetic_dataset(folder, pairs, size):
+    """rgb/ and depth/ folders of smooth random images (16-bit single-channel depth)"""
+    width, height = size
+    rng = np.random.default_rng(0)
+    os.makedirs(os.path.join(folder, "rgb"), exist_ok=True)
+    os.makedirs(os.path.join(folder, "depth"), exist_ok=True)
+    for i in range(pairs):
+        small = rng.integers(0, 255, (height // 32 + 1, width // 32 + 1, 3), dtype=np.uint8)
+        rgb = cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+        depth = cv2.resize(rng.uniform(500, 3000, (height // 32 + 1, width // 32 + 1)).astype(np.float32),
+                           (width, height), interpolation=cv2.INTER_CUBIC).astype(np.uint16)
+        cv2.imwrite(os.path.join(folder, "rgb", f"{i:05d}.png"), rgb)
+        cv2.imwrite(os.path.join(folder, "depth", f"{i:05d}.png"), depth)
+
+
+def generate_events(count, pairs, canvas_size=(640, 480), seed=0):
+    """
+    Random event stream. Navigation comes in runs that stay inside the
+    dataset, so Previous/Next are never pressed while disabled.
+    """
+    rng = random.Random(seed)
+    kinds = list(EVENT_WEIGHTS)
+    weights = [EVENT_WEIGHTS[k] for k in kinds]
+    events, position = [], 0
+    while len(events) < count:
+        kind = rng.choices(kinds, weights)[0]
+        if kind == "navigate":
+            step = 1 if position == 0 or (position < pairs - 1 and rng.random() < 0.5) else -1
+            for _ in range(rng.randint(1, 3)):
+                if not 0 <= position + step < pairs:
+                    break
+                position += step
+                events.append({"type": "next_image" if step > 0 else "previous_image"})
+        elif kind in ("on_rgb_click", "zoom"):
+            event = {"type": kind, "x": rng.randrange(canvas_size[0]), "y": rng.randrange(canvas_size[1])}
+            if kind == "zoom":
+                event["direction"] = rng.choice([1, -1])
+            events.append(event)
+        elif kind == "update_offset":
+            events.append({"type": kind, "x_offset": rng.randint(-60, 60), "y_offset": rng.randint(-30, 30)})
+        else:
+            events.append({"type": kind})
+    return events[:count]
+
+
+def _press(widget, x=None, y=None, button=1):
+    if x is None:
+        x, y = widget.winfo_width() // 2, widget.winfo_height() // 2
+    widget.event_generate(f"<ButtonPress-{button}>", x=x, y=y)
+    widget.event_generate(f"<ButtonRelease-{button}>", x=x, y=y)
+
+
+class LatencyHarness:
+    """
+    Drives IntegratedToolApp through Tk events and measures, per event type,
+    the time from the input until the UI is idle: pending Tk events and idle
+    callbacks processed and no full-resolution load in flight.
+    """
+
+    def __init__(self, app, root):
+        self.app = app
+        self.root = root
+        self.dual = app.dual_app
+        self.samples = {}
+
+    def busy(self):
+        for tool in (self.dual, self.app.analyzer_app):
+            if tool.dataset_loading or tool.loader.pending or tool.full_image_poll is not None:
+                return True
+        # Tiles of a new image appear once its pyramid is built in the background
+        for view in (self.dual.rgb_view, self.dual.depth_view, self.app.analyzer_app.view):
+            if view.pending:
+                return True
+        return False
+
+    def settle(self, timeout=SETTLE_TIMEOUT):
+        deadline = time.perf_counter() + timeout
+        self.root.update()
+        while self.busy() and time.perf_counter() < deadline:
+            time.sleep(0.001)
+            self.root.update()
+
+    @contextmanager
+    def measure(self, kind):
+        start = time.perf_counter()
+        yield
+        self.settle()
+        self.samples.setdefault(kind, []).append((time.perf_counter() - start) * 1000.0)
+
+    def replay(self, event):
+        kind = event["type"]
+        dual = self.dual
+        if kind == "on_rgb_click":
+            with self.measure(kind):
+                _press(dual.rgb_canvas, event["x"], event["y"])
+        elif kind == "update_offset":
+            # The tool reads the sliders on <Motion>, as when they are dragged
+            dual.x_offset_slider.set(event["x_offset"])
+            dual.y_offset_slider.set(event["y_offset"])
+            with self.measure(kind):
+                dual.x_offset_slider.event_generate("<Motion>", x=5, y=5)
+        elif kind == "zoom":
+            with self.measure(kind):
+                dual.rgb_canvas.event_generate("<Button-4>" if event.get("direction", 1) > 0 else "<Button-5>",
+                                               x=event["x"], y=event["y"])
+        elif kind in ("next_image", "previous_image"):
+            button = dual.btn_next if kind == "next_image" else dual.btn_prev
+            with self.measure(kind):
+                _press(button)
+        elif kind == "tab_switch":
+            # There and back, one sample per switch
+            for tab in (self.app.analyzer_frame, self.app.dual_frame):
+                with self.measure(kind):
+                    self.app.notebook.select(tab)
+        else:
+            raise ValueError(f"Unknown event type: {kind}")
+
+    def report(self, thresholds, percentile):
+        """Rows of per-type statistics and whether the checked percentile is within its threshold"""
+        rows = []
+        for kind, values in sorted(self.samples.items()):
+            stats = dict(zip((f"p{p}" for p in PERCENTILES), np.percentile(values, PERCENTILES)))
+            limit = thresholds.get(kind)
+            rows.append({"event": kind, "count": len(values), **stats, "max": max(values),
+                         "threshold": limit,
+                         "ok": limit is None or stats[percentile] <= limit})
+        return rows
+
+
+def run(dataset, events, thresholds, percentile):
+    """Starts the integrated app on dataset, replays events and returns the report rows"""
+    import tkinter as tk
+    from tkinter import filedialog, messagebox
+    from pointer_tool import IntegratedToolApp
+
+    errors = []
+    with ExitStack() as stack:
+        # Dialogs would block the replay: the dataset folder is answered, messages are collected
+        stack.enter_context(mock.patch.object(filedialog, "askdirectory", return_value=dataset))
+        for name in ("showinfo", "showwarning"):
+            stack.enter_context(mock.patch.object(messagebox, name, return_value="ok"))
+        stack.enter_context(mock.patch.object(messagebox, "showerror",
+                                              side_effect=lambda title, message: errors.append(f"{title}: {message}")))
+
+        root = tk.Tk()
+        root.geometry(f"{DISPLAY_SIZE[0]}x{DISPLAY_SIZE[1]}")
+        app = IntegratedToolApp(root)
+        harness = LatencyHarness(app, root)
+        try:
+            root.update()
+            app.dual_app.load_dataset()
+            app.analyzer_app.load_dataset()
+            harness.settle()
+            for event in events:
+                harness.replay(event)
+            rows = harness.report(thresholds, percentile)
+        finally:
+            for tool in (app.dual_app, app.analyzer_app):
+                tool.shutdown()
+            root.destroy()
+    for error in errors:
+        print(f"Error dialog during replay: {error}")
+    return rows, errors
+
+
+@contextmanager
+def virtual_display(use_xvfb):
+    """Xvfb display through xvfbwrapper when available, otherwise the current $DISPLAY"""
+    if use_xvfb:
+        try:
+            from xvfbwrapper import Xvfb
+        except ImportError:
+            Xvfb = None
+            print("Warning: xvfbwrapper is not installed, using the current display")
+        if Xvfb is not None:
+            with Xvfb(width=DISPLAY_SIZE[0], height=DISPLAY_SIZE[1]):
+                yield
+            return
+    if not os.environ.get("DISPLAY"):
+        raise RuntimeError("No X display: install Xvfb and xvfbwrapper, or set DISPLAY")
+    yield
+
+
+def parse_thresholds(values):
+    thresholds = dict(DEFAULT_THRESHOLDS)
+    for value in values or []:
+        kind, _, limit = value.partition("=")
+        thresholds[kind] = float(limit)
+    return thresholds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay UI events against the tools and check input-to-idle latency")
+    parser.add_argument("--dataset", help="Dataset folder (default: a synthetic one in a temporary folder)")
+    parser.add_argument("--pairs", type=int, default=30, help="Pairs of the synthetic dataset")
+    parser.add_argument("--size", type=int, nargs=2, metavar=("WIDTH", "HEIGHT"), default=(1280, 720))
+    parser.add_argument("--events", help="JSON list of recorded events to replay instead of generated ones")
+    parser.add_argument("--count", type=int, default=300, help="Generated events")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save-events", help="Write the replayed event stream to this JSON file")
+    parser.add_argument("--threshold", action="append", metavar="EVENT=MS",
+                        help="Override a threshold, e.g. next_image=300 (repeatable)")
+    parser.add_argument("--percentile", choices=[f"p{p}" for p in PERCENTILES], default="p95",
+                        help="Percentile compared with the thresholds")
+    parser.add_argument("-o", "--output", help="Also write the report as JSON")
+    parser.add_argument("--no-xvfb", action="store_true", help="Use the current display instead of Xvfb")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        dataset = os.path.abspath(args.dataset) if args.dataset else os.path.join(workdir, "dataset")
+        if not args.dataset:
+            make_synthetic_dataset(dataset, args.pairs, args.size)
+            pairs = args.pairs
+        else:
+            pairs = len(os.listdir(os.path.join(dataset, "rgb")))
+        if args.events:
+            with open(args.events, 'r') as f:
+                events = json.load(f)
+        else:
+            events = generate_events(args.count, pairs, seed=args.seed)
+        if args.save_events:
+            with open(args.save_events, 'w') as f:
+                json.dump(events, f, indent=1)
+
+        # The tools keep labeled_points.json in the working directory, leave the real one alone
+        cwd = os.getcwd()
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        os.chdir(workdir)
+        try:
+            with virtual_display(not args.no_xvfb):
+                rows, errors = run(dataset, events, parse_thresholds(args.threshold), args.percentile)
+        finally:
+            os.chdir(cwd)
+
+    print(f"{'event':<16}{'count':>7}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}{'limit':>9}")
+    for row in rows:
+        limit = f"{row['threshold']:.0f}" if row["threshold"] is not None else "-"
+        print(f"{row['event']:<16}{row['count']:>7}{row['p50']:>9.1f}{row['p95']:>9.1f}{row['p99']:>9.1f}"
+              f"{row['max']:>9.1f}{limit:>9}" + ("" if row["ok"] else f"  FAIL ({args.percentile})"))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"percentile": args.percentile, "events": rows, "errors": errors}, f, indent=4)
+
+    failed = [row["event"] for row in rows if not row["ok"]]
+    if failed or errors:
+        print(f"Latency regression: {', '.join(failed)}" if failed else "Error dialogs shown during the replay")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()